@@ -24,6 +24,7 @@ from __future__ import print_function
 import bisect
 import codecs
 import datetime
+import json
 from transitfeed.util import defaultdict
 import optparse
 import os
@@ -138,12 +139,18 @@ class CountingConsoleProblemAccumulator(transitfeed.SimpleProblemAccumulator):
     self._error_count = 0
     self._warning_count = 0
     self._notice_count = 0
-    self._ignore_types = ignore_types or set()
+    self._ignore_types = set(ignore_types or ())
+
+  def _PreReport(self, problem_class, type, column_name=None):
+    return problem_class.__name__ not in self._ignore_types
 
   def _Report(self, e):
     if e.__class__.__name__ in self._ignore_types:
       return
     transitfeed.SimpleProblemAccumulator._Report(self, e)
+    self._Count(e)
+
+  def _Count(self, e):
     if e.IsError():
       self._error_count += 1
     elif e.IsWarning():
@@ -169,12 +176,79 @@ class CountingConsoleProblemAccumulator(transitfeed.SimpleProblemAccumulator):
   def HasNotices(self):
     return self.NoticeCount()
 
+class JsonLinesProblemAccumulator(CountingConsoleProblemAccumulator):
+  """Write each problem as one line of JSON, keeping only the counts.
+
+  Each line is an object with the keys "class", "type", "file", "row",
+  "fields" and "message". Lines are written to the output in batches so
+  memory use doesn't grow with the number of problems.
+
+  Args:
+    output_file: file object to write to
+    ignore_types: list of error type names that will be ignored
+    batch_size: number of problems to buffer before writing them
+  """
+
+  TYPE_NAMES = {TYPE_ERROR: 'error', TYPE_WARNING: 'warning',
+                TYPE_NOTICE: 'notice'}
+
+  def __init__(self, output_file, ignore_types=None, batch_size=100):
+    CountingConsoleProblemAccumulator.__init__(self, ignore_types)
+    self._output_file = output_file
+    self._batch_size = batch_size
+    self._batch = []
+
+  def _Report(self, e):
+    if e.__class__.__name__ in self._ignore_types:
+      return
+    self._Count(e)
+    self._batch.append(json.dumps(self.ProblemToDict(e), sort_keys=True))
+    if len(self._batch) >= self._batch_size:
+      self.Flush()
+
+  def Flush(self):
+    """Write the buffered problems to the output file."""
+    if self._batch:
+      self._output_file.write('\n'.join(self._batch) + '\n')
+      self._batch = []
+    self._output_file.flush()
+
+  @classmethod
+  def ProblemToDict(cls, e):
+    """Return a dict describing e which can be encoded as JSON."""
+    skip = set(transitfeed.ExceptionWithContext.CONTEXT_PARTS + ['type'])
+    fields = {}
+    for k, v in e.__dict__.items():
+      if not k.startswith('_') and k not in skip:
+        fields[k] = _JsonValue(v)
+    return {'class': e.__class__.__name__,
+            'type': cls.TYPE_NAMES[e.GetType()],
+            'file': _JsonValue(getattr(e, 'file_name', None)),
+            'row': getattr(e, 'row_num', None),
+            'fields': fields,
+            'message': _JsonValue(e.FormatProblem())}
+
+
+def _JsonValue(value):
+  """Return value, converted to unicode if it isn't a JSON number or null."""
+  if value is None or isinstance(value, (bool, int, long, float)):
+    return value
+  if isinstance(value, str):
+    # Problems may contain bytes which are not valid utf-8
+    return value.decode('utf-8', 'replace')
+  if isinstance(value, unicode):
+    return value
+  return unicode(value)
+
+
 class BoundedProblemList(object):
   """A list of one type of ExceptionWithContext objects with bounded size."""
   def __init__(self, size_bound):
     self._count = 0
     self._exceptions = []
     self._size_bound = size_bound
+    # None until insort finds out if the exceptions can be compared
+    self._comparable = None
 
   def Add(self, e):
     self._count += 1
@@ -184,6 +258,7 @@ class BoundedProblemList(object):
       # The base class ExceptionWithContext raises this exception in __cmp__
       # to signal that an object is not comparable. Instead of keeping the most
       # significant issue keep the first reported.
+      self._comparable = False
       if self._count <= self._size_bound:
         self._exceptions.append(e)
     else:
@@ -192,6 +267,18 @@ class BoundedProblemList(object):
       if self._count > self._size_bound:
         del self._exceptions[-1]
 
+  def IsFull(self):
+    """Return True if the next problem added will be dropped whatever it is.
+
+    This is only known for problems which can't be compared, of which the
+    first size_bound are kept.
+    """
+    return self._comparable is False and self._count >= self._size_bound
+
+  def AddDropped(self):
+    """Count a problem that IsFull() said would be dropped."""
+    self._count += 1
+
   def _GetDroppedCount(self):
     return self._count - len(self._exceptions)
 
@@ -219,7 +306,7 @@ class LimitPerTypeProblemAccumulator(transitfeed.ProblemAccumulatorInterface):
       TYPE_ERROR: defaultdict(lambda: BoundedProblemList(limit_per_type)),
       TYPE_NOTICE: defaultdict(lambda: BoundedProblemList(limit_per_type))
     }
-    self._ignore_types = ignore_types or set()
+    self._ignore_types = set(ignore_types or ())
 
   def HasIssues(self):
     return (self._type_to_name_to_problist[TYPE_ERROR] or
@@ -228,6 +315,17 @@ class LimitPerTypeProblemAccumulator(transitfeed.ProblemAccumulatorInterface):
   def HasNotices(self):
     return self._type_to_name_to_problist[TYPE_NOTICE]
 
+  def _PreReport(self, problem_class, type, column_name=None):
+    class_name = problem_class.__name__
+    if class_name in self._ignore_types:
+      return False
+    problist = self._type_to_name_to_problist[type][class_name]
+    if problist.IsFull():
+      # Count the problem without building it
+      problist.AddDropped()
+      return False
+    return True
+
   def _Report(self, e):
     if e.__class__.__name__ in self._ignore_types:
       return
@@ -504,6 +602,8 @@ def RunValidationOutputFromOptions(feed, options):
   """Validate feed, output results per options and return an exit code."""
   if options.output.upper() == "CONSOLE":
     return RunValidationOutputToConsole(feed, options)
+  elif options.output_format == 'jsonl':
+    return RunValidationOutputToJsonLines(feed, options, options.output)
   else:
     return RunValidationOutputToFilename(feed, options, options.output)
 
@@ -539,6 +639,22 @@ def RunValidationOutputToFile(feed, options, output_file):
   return exit_code
 
 
+def RunValidationOutputToJsonLines(feed, options, output_filename):
+  """Validate feed, write problems as JSON lines and return an exit code."""
+  try:
+    output_file = open(output_filename, 'w')
+    accumulator = JsonLinesProblemAccumulator(output_file,
+                                              options.error_types_ignore_list)
+    problems = transitfeed.ProblemReporter(accumulator)
+    _, exit_code = RunValidation(feed, options, problems)
+    accumulator.Flush()
+    output_file.close()
+  except IOError as e:
+    print('Error while writing %s: %s' % (output_filename, e))
+    exit_code = 2
+  return exit_code
+
+
 def RunValidationOutputToConsole(feed, options):
   """Validate feed, print reports and return an exit code."""
   accumulator = CountingConsoleProblemAccumulator(
@@ -580,17 +696,31 @@ def RunValidation(feed, options, problems):
 
   gtfs_factory = extension_module.GetGtfsFactory()
 
+  if options.phase_stats:
+    stats = transitfeed.PhaseStats()
+  else:
+    stats = None
+  if options.progress:
+    progress = transitfeed.ConsoleProgressReporter()
+  else:
+    progress = None
+
   print('validating %s' % feed)
   print('FeedValidator extension used: %s' % options.extension)
   loader = gtfs_factory.Loader(feed, problems=problems, extra_validation=False,
                                memory_db=options.memory_db,
                                check_duplicate_trips=\
                                options.check_duplicate_trips,
-                               gtfs_factory=gtfs_factory)
+                               gtfs_factory=gtfs_factory,
+                               stats=stats,
+                               progress=progress)
   schedule = loader.Load()
   # Start validation: children are already validated by the loader.
   schedule.Validate(service_gap_interval=options.service_gap_interval,
-                    validate_children=False)
+                    validate_children=False, stats=stats, progress=progress)
+
+  if stats:
+    WritePhaseStats(stats, options.phase_stats)
 
   if feed == 'IWantMyvalidation-crash.txt':
     # See tests/testfeedvalidator.py
@@ -605,6 +735,16 @@ def RunValidation(feed, options, problems):
     return schedule, 0
 
 
+def WritePhaseStats(stats, output_filename):
+  """Write the phases recorded in stats as JSON to output_filename."""
+  try:
+    output_file = open(output_filename, 'w')
+    stats.WriteJson(output_file)
+    output_file.close()
+  except IOError as e:
+    print('Error while writing %s: %s' % (output_filename, e))
+
+
 def main():
   (feed, options) = ParseCommandLineArguments()
   return RunValidationFromOptions(feed, options)
@@ -633,10 +773,22 @@ https://github.com/google/transitfeed/wiki/FeedValidator
   parser.add_option('-o', '--output', dest='output', metavar='FILE',
                     help='write html output to FILE or --output=CONSOLE to '
                     'print all errors and warnings to the command console')
+  parser.add_option('--output_format', dest='output_format',
+                    type='choice', choices=['html', 'jsonl'],
+                    help='format of the output FILE: html or jsonl, which '
+                    'writes one JSON object per problem as it is found')
   parser.add_option('-p', '--performance', action='store_true',
                     dest='performance',
                     help='output memory and time performance (Availability: '
                     'Unix')
+  parser.add_option('--phase_stats', dest='phase_stats', metavar='FILE',
+                    help='write the wall time, rows per second and memory '
+                    'change of each loading and validation step as JSON to '
+                    'FILE')
+  parser.add_option('--progress', dest='progress', action='store_true',
+                    help='print a progress line with the number of rows '
+                    'processed and rows per second while loading and '
+                    'validating')
   parser.add_option('-m', '--memory_db', dest='memory_db',  action='store_true',
                     help='Use in-memory sqlite db instead of a temporary file. '
                          'It is faster but uses more RAM.')
@@ -673,12 +825,16 @@ https://github.com/google/transitfeed/wiki/FeedValidator
                     '"ExpirationDate,UnusedStop"). Bad error type names will '
                     'be silently ignored!')
 
-  parser.set_defaults(manual_entry=True, output='validation-results.html',
+  parser.set_defaults(manual_entry=True, output=None, output_format='html',
                       memory_db=False, check_duplicate_trips=False,
+                      progress=False,
                       limit_per_type=5, latest_version='',
                       service_gap_interval=13)
   (options, args) = parser.parse_args()
 
+  if options.output is None:
+    options.output = 'validation-results.' + options.output_format
+
   if not len(args) == 1:
     if options.manual_entry:
       feed = raw_input('Enter Feed Location: ')
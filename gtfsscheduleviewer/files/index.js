@@ -21,30 +21,144 @@ function load(config) {
   map = new google.maps.Map(map_dom, mapOptions);
   map.fitBounds(config.bounds);
   initIcons();
-  google.maps.event.addListener(map, "moveend", callbackMoveEnd);
-  google.maps.event.addListener(map, "zoomend", callbackZoomEnd);
-  fetchStopsInBounds(config.bounds);
+  // idle is fired once the map stops moving or zooming
+  google.maps.event.addListener(map, "idle", callbackMoveEnd);
   fetchRoutes();
 }
 
-function callbackZoomEnd() {
+function callbackMoveEnd() {
+  // Map moved, show the stops and shapes of the visible tiles
+  fetchVisibleTiles();
 }
 
-function callbackMoveEnd() {
-  // Map moved, search for stops near the center
-  fetchStopsInBounds(map.getBounds());
+// Don't draw the network when the map shows more than this many tiles, such
+// as on a very large window
+var maxVisibleTiles = 64;
+// Map from "zoom/x/y" to the list of overlays drawn for that tile. The list
+// is empty while the tile is being downloaded.
+var tileOverlays = {};
+
+/**
+ * Return the Web Mercator world coordinates of a LatLng, each in [0, 1), as
+ * used by the /tile/ urls.
+ */
+function latLngToWorld(latLng) {
+  var lat = Math.max(-85.05112878, Math.min(85.05112878, latLng.lat()));
+  var sinLat = Math.sin(lat * Math.PI / 180);
+  return {
+    x: (latLng.lng() + 180) / 360,
+    y: 0.5 - Math.log((1 + sinLat) / (1 - sinLat)) / (4 * Math.PI)
+  };
+}
+
+/**
+ * Fetch the stops and shapes of the tiles covering the map which haven't
+ * been downloaded yet and remove the overlays of tiles no longer visible.
+ * The server caches tiles, so panning back to a tile is cheap.
+ */
+function fetchVisibleTiles() {
+  var bounds = map.getBounds();
+  if (!bounds) {
+    return;
+  }
+  var zoom = map.getZoom();
+  var scale = 1 << zoom;
+  var northEast = latLngToWorld(bounds.getNorthEast());
+  var southWest = latLngToWorld(bounds.getSouthWest());
+  var minX = Math.floor(southWest.x * scale);
+  var maxX = Math.floor(northEast.x * scale);
+  if (maxX < minX) {
+    // The map crosses longitude 180
+    maxX += scale;
+  }
+  var minY = Math.max(0, Math.floor(northEast.y * scale));
+  var maxY = Math.min(scale - 1, Math.floor(southWest.y * scale));
+  var visible = {};
+  if ((maxX - minX + 1) * (maxY - minY + 1) <= maxVisibleTiles) {
+    for (var x = minX; x <= maxX; ++x) {
+      for (var y = minY; y <= maxY; ++y) {
+        var key = zoom + "/" + (x % scale) + "/" + y;
+        visible[key] = true;
+        if (!tileOverlays[key]) {
+          tileOverlays[key] = [];
+          downloadUrl("/tile/" + key + ".json",
+                      make2ArgClosure(callbackDisplayTile, key));
+        }
+      }
+    }
+  }
+  for (var key in tileOverlays) {
+    if (!visible[key]) {
+      removeTileOverlays(tileOverlays[key]);
+      delete tileOverlays[key];
+    }
+  }
+}
+
+function removeTileOverlays(overlays) {
+  for (var i = 0; i < overlays.length; ++i) {
+    overlays[i].setMap(null);
+  }
+}
+
+/**
+ * Draw the stops and shapes of a tile returned by the server.
+ *
+ * @param {String} data JSON encoded object with lists 'stops' and 'shapes'
+ * @param {Number} responseCode Response code from server
+ * @param {String} key The "zoom/x/y" of the tile
+ */
+function callbackDisplayTile(data, responseCode, key) {
+  var overlays = tileOverlays[key];
+  // The tile may have scrolled out of view while it was downloaded
+  if (responseCode != 200 || !overlays) {
+    return;
+  }
+  var tile = JSON.parse(data);
+  var shapes = tile['shapes'];
+  for (var i = 0; i < shapes.length; ++i) {
+    var points = shapes[i]['points'];
+    var linePoints = [];
+    for (var j = 0; j < points.length; ++j) {
+      linePoints.push(new google.maps.LatLng(points[j][0], points[j][1]));
+    }
+    overlays.push(new google.maps.Polyline({
+      path: linePoints,
+      strokeColor: shapes[i]['color'] || '#003399',
+      strokeOpacity: 0.5,
+      strokeWeight: 2,
+      clickable: false,
+      map: map
+    }));
+  }
+  var stops = tile['stops'];
+  for (var i = 0; i < stops.length; ++i) {
+    overlays.push(addTileStopMarker(stops[i]));
+  }
 }
 
 /**
- * Fetch a sample of stops in the bounding box.
+ * Add a small marker for a stop of a tile, given a row from stops.txt.
  */
-function fetchStopsInBounds(bounds) {
-  url = "/json/boundboxstops?n=" + bounds.getNorthEast().lat()
-                         + "&e=" + bounds.getNorthEast().lng()
-                         + "&s=" + bounds.getSouthWest().lat()
-                         + "&w=" + bounds.getSouthWest().lng()
-                         + "&limit=50";
-  downloadUrl(url, callbackDisplayStopsBackground);
+function addTileStopMarker(list) {
+  var marker = new google.maps.Marker({
+    icon: {
+      path: google.maps.SymbolPath.CIRCLE,
+      scale: 3,
+      fillColor: list[4] == 1 ? '#cc0000' : '#003399',
+      fillOpacity: 0.8,
+      strokeWeight: 1
+    },
+    map: map,
+    position: new google.maps.LatLng(list[2], list[3]),
+    title: list[1]
+  });
+  marker.stopId = list[0];
+  marker.stopName = list[1];
+  google.maps.event.addListener(marker, "click", function() {
+    fetchStopInfoWindow(marker);
+  });
+  return marker;
 }
 
 /**
@@ -82,34 +196,6 @@ function tripTextSearchSubmit() {
   selectTrip(text);
 }
 
-/**
- * Add stops markers to the map and remove stops no longer in the
- * background.
- */
-function callbackDisplayStopsBackground(data, responseCode) {
-  if (responseCode != 200) {
-    return;
-  }
-  var stops = eval(data);
-  // Make a list of all background markers
-  var oldStopMarkers = {};
-  for (var stopId in stopMarkersBackground) {
-    oldStopMarkers[stopId] = stopMarkersBackground[stopId];
-  }
-  // Add new markers to the map and remove from oldStopMarkers
-  for (var i=0; i<stops.length; ++i) {
-    var marker = addStopMarkerFromList(stops[i], false);
-    if (oldStopMarkers[marker.stopId]) {
-      delete oldStopMarkers[marker.stopId];
-    }
-  }
-  // Delete all markers that remain in oldStopMarkers
-  for (var stopId in oldStopMarkers) {
-    oldStopMarkers[stopId].setMap(null);
-  }
-  oldStopMarkers = {};
-}
-
 /**
  * Remove all overlays from the map
  */
@@ -500,12 +586,77 @@ function selectTrip(tripId) {
     span.className = 'tripChoiceSelected';
   }
   clearMap();
-  url = "/json/tripstoptimes?trip=" + encodeURIComponent(tripId);
-  downloadUrl(url, callbackDisplayTripStopTimes);
-  fetchTripPolyLine(tripId);
+  fetchTripsData([tripId]);
   fetchTripRows(tripId);
 }
 
+/**
+ * Fetch the stop times and shapes of several trips in one request.
+ *
+ * @param {Array} tripIds List of trip_ids
+ */
+function fetchTripsData(tripIds) {
+  var encodedIds = [];
+  for (var i = 0; i < tripIds.length; ++i) {
+    encodedIds.push(encodeURIComponent(tripIds[i]));
+  }
+  url = "/json/tripsdata?encoded=1&trips=" + encodedIds.join(",");
+  downloadUrl(url, callbackDisplayTripsData);
+}
+
+function callbackDisplayTripsData(data, responseCode) {
+  if (responseCode != 200) {
+    return;
+  }
+  var tripsData = JSON.parse(data);
+  if (!tripsData) return;
+  var shapes = tripsData['shapes'];
+  for (var i = 0; i < shapes.length; ++i) {
+    displayPolyLine({'points': decodePolyline(shapes[i]['encoded']),
+                     'color': shapes[i]['color']});
+  }
+  var trips = tripsData['trips'];
+  for (var i = 0; i < trips.length; ++i) {
+    var stops = [];
+    for (var j = 0; j < trips[i]['stops'].length; ++j) {
+      stops.push(tripsData['stops'][trips[i]['stops'][j]]);
+    }
+    displayTripStopTimes(stops, trips[i]['arrival_times'],
+                         trips[i]['departure_times']);
+  }
+}
+
+/**
+ * Decode a polyline encoded by transitfeed.EncodePolyline.
+ *
+ * @param {String} encoded The encoded points
+ * @return {Array} List of lat,lng pairs
+ */
+function decodePolyline(encoded) {
+  var values = [];
+  var value = 0;
+  var shift = 0;
+  for (var i = 0; i < encoded.length; ++i) {
+    var b = encoded.charCodeAt(i) - 63;
+    value |= (b & 0x1f) << shift;
+    shift += 5;
+    if (b < 0x20) {
+      values.push(value & 1 ? ~(value >> 1) : value >> 1);
+      value = 0;
+      shift = 0;
+    }
+  }
+  var points = [];
+  var lat = 0;
+  var lng = 0;
+  for (var i = 0; i + 1 < values.length; i += 2) {
+    lat += values[i];
+    lng += values[i + 1];
+    points.push([lat / 1e5, lng / 1e5]);
+  }
+  return points;
+}
+
 function callbackDisplayTripStopTimes(data, responseCode) {
   if (responseCode != 200) {
     return;
@@ -70,7 +70,7 @@ class MareyGraph:
     # height/width of graph canvas before transform
     self._gwidth = self._tspan * self._hour_grid
 
-  def Draw(self, stoplist=None, triplist=None, height=520):
+  def Draw(self, stoplist=None, triplist=None, height=520, timetable=None):
     """Main interface for drawing the marey graph.
 
     If called without arguments, the data generated in the previous call
@@ -81,6 +81,10 @@ class MareyGraph:
       stoplist: [Stop, Stop, ...]
       # Class Trip is defined in transitfeed.py
       triplist: [Trip, Trip, ...]
+      # Class PatternTimetable is defined in transitfeed/patternindex.py,
+      # used instead of triplist to draw all trips of a pattern without
+      # loading their stop times again
+      timetable: PatternTimetable
 
     Returns:
       # A string that contain a svg/xml web-page with a marey graph.
@@ -91,6 +95,9 @@ class MareyGraph:
       triplist = []
     if not stoplist:
       stoplist = []
+    if timetable is not None:
+      triplist = timetable.trips
+      stoplist = stoplist or timetable.stops
 
     if not self._cache or triplist or stoplist:
       self._gheight = height
@@ -101,7 +108,8 @@ class MareyGraph:
       self._cache = "%s %s %s %s" % (self._DrawBox(),
                                       self._DrawHours(),
                                       self._DrawStations(),
-                                      self._DrawTrips(triplist))
+                                      self._DrawTrips(triplist,
+                                                      timetable=timetable))
 
 
 
@@ -256,16 +264,16 @@ class MareyGraph:
 
     return pixel_grid
 
-  def _TravelTimes(self,triplist,index=0):
+  def _TravelTimes(self,timetable,index=0):
     """ Calculate distances and plot stops.
 
     Uses a timetable to approximate distances
     between stations
 
     Args:
-    # Class Trip is defined in transitfeed.py
-    triplist: [Trip, Trip, ...]
-    # (Optional) Index of Triplist prefered for timetable Calculation
+    # Class PatternTimetable is defined in transitfeed/patternindex.py
+    timetable: PatternTimetable
+    # (Optional) Index of the trip prefered for timetable Calculation
     index: 3
 
     Returns:
@@ -273,54 +281,96 @@ class MareyGraph:
     # indicating the approximate distance
     [0,33,140, ... ,X]
     """
-
-    def DistanceInTravelTime(dep_secs, arr_secs):
-      t_dist = arr_secs-dep_secs
-      if t_dist<0:
-        t_dist = self._DUMMY_SEPARATOR # min separation
-      return t_dist
-
-    if not triplist:
+    if not timetable.trips:
       return []
 
-    if 0 < index < len(triplist):
-      trip = triplist[index]
-    else:
-      trip = triplist[0]
+    if not 0 < index < len(timetable.trips):
+      index = 0
 
-    t_dists2 = [DistanceInTravelTime(stop[3],tail[2]) for (stop,tail)
-                 in itertools.izip(trip.GetTimeStops(),trip.GetTimeStops()[1:])]
+    t_dists2 = []
+    for t_dist in timetable.GetTravelTimes(index):
+      # Untimed stops and times going backwards get the min separation
+      if t_dist is None or t_dist < 0:
+        t_dist = self._DUMMY_SEPARATOR
+      t_dists2.append(t_dist)
     return t_dists2
 
+  def _TripTimetable(self, triplist):
+    """Returns a PatternTimetable of the trips in triplist.
+
+    The stop times of each trip are loaded once and shared by the
+    calculation of the station lines and the drawing of the trip.
+
+    Args:
+      # Class Trip is defined in transitfeed.py
+      triplist: [Trip, Trip, ...]
+
+    Returns:
+      PatternTimetable
+    """
+    arrivals = []
+    departures = []
+    for t in triplist:
+      time_stops = t.GetTimeStops()
+      arrivals.append([s[0] for s in time_stops])
+      departures.append([s[1] for s in time_stops])
+    return transitfeed.PatternTimetable([], triplist, arrivals, departures)
+
+  def _TimetableRows(self, timetable):
+    """Returns each trip of a PatternTimetable with its start time and stop
+    times as [(Trip, start_secs, [(arr_secs, dep_secs), ...]), ...]."""
+    rows = []
+    for t, arrivals, departures in itertools.izip(
+        timetable.trips, timetable.arrivals, timetable.departures):
+      times = zip(arrivals, departures)
+      start = None
+      if times:
+        start = times[0][0]
+        if start is None:
+          start = times[0][1]
+      rows.append((t, start, times))
+    return rows
+
   def _AddWarning(self, str):
     print(str)
 
-  def _DrawTrips(self,triplist,colpar=""):
+  def _DrawTrips(self,triplist,colpar="",timetable=None):
     """Generates svg polylines for each transit trip.
 
     Args:
       # Class Trip is defined in transitfeed.py
       [Trip, Trip, ...]
+      # (Optional) a PatternTimetable of the trips in triplist
+      timetable: PatternTimetable
 
     Returns:
       # A string containing a polyline tag for each trip
       ' <polyline class="T" stroke="#336633" points="433,0 ...'
     """
 
+    if timetable is None:
+      timetable = self._TripTimetable(triplist)
+    rows = self._TimetableRows(timetable)
     stations = []
-    if not self._stations and triplist:
-      self._stations = self._CalculateYLines(self._TravelTimes(triplist))
+    if not self._stations and rows:
+      self._stations = self._CalculateYLines(self._TravelTimes(timetable))
       if not self._stations:
         self._AddWarning("Failed to use traveltimes for graph")
-        self._stations = self._CalculateYLines(self._Uniform(triplist))
+        self._stations = self._CalculateYLines(self._Uniform(rows))
         if not self._stations:
           self._AddWarning("Failed to calculate station distances")
           return
 
     stations = self._stations
+    # The y coordinate of each station and the x coordinate of each distinct
+    # time are formatted once for all trips
+    station_ys = [int(y + 20) for y in stations]
+    xs = {}
+    x_offset = self._hour_grid * self._offset - 20
+    hour_grid = self._hour_grid
     tmpstrs = []
     servlist = []
-    for t in triplist:
+    for t, start, times in rows:
       if not colpar:
         if t.service_id not in servlist:
           servlist.append(t.service_id)
@@ -329,34 +379,31 @@ class MareyGraph:
       else:
         color=colpar
 
-      start_offsets = [0]
-      first_stop = t.GetTimeStops()[0]
-
-      for j,freq_offset in enumerate(start_offsets):
-        if j>0 and not colpar:
-          color="purple"
-        scriptcall = 'onmouseover="LineClick(\'%s\',\'Trip %s starting %s\')"' % (t.trip_id,
-            t.trip_id, transitfeed.FormatSecondsSinceMidnight(t.GetStartTime()))
-        tmpstrhead = '<polyline class="T" id="%s" stroke="%s" %s points="' % \
-          (str(t.trip_id),color, scriptcall)
-        tmpstrs.append(tmpstrhead)
-
-        for i, s in enumerate(t.GetTimeStops()):
-          arr_t = s[0]
-          dep_t = s[1]
-          if arr_t is None or dep_t is None:
-            continue
-          arr_x = int(arr_t/3600.0 * self._hour_grid) - self._hour_grid * self._offset
-          dep_x = int(dep_t/3600.0 * self._hour_grid) - self._hour_grid * self._offset
-          tmpstrs.append("%s,%s " % (int(arr_x+20), int(stations[i]+20)))
-          tmpstrs.append("%s,%s " % (int(dep_x+20), int(stations[i]+20)))
-        tmpstrs.append('" />')
+      if start is None:
+        continue
+      scriptcall = 'onmouseover="LineClick(\'%s\',\'Trip %s starting %s\')"' % (t.trip_id,
+          t.trip_id, transitfeed.FormatSecondsSinceMidnight(start))
+      tmpstrhead = '<polyline class="T" id="%s" stroke="%s" %s points="' % \
+        (str(t.trip_id),color, scriptcall)
+      tmpstrs.append(tmpstrhead)
+
+      for (arr_t, dep_t), y in itertools.izip(times, station_ys):
+        if arr_t is None or dep_t is None:
+          continue
+        arr_x = xs.get(arr_t)
+        if arr_x is None:
+          arr_x = xs[arr_t] = int(arr_t/3600.0 * hour_grid) - x_offset
+        dep_x = xs.get(dep_t)
+        if dep_x is None:
+          dep_x = xs[dep_t] = int(dep_t/3600.0 * hour_grid) - x_offset
+        tmpstrs.append("%d,%d %d,%d " % (arr_x, y, dep_x, y))
+      tmpstrs.append('" />')
     return "".join(tmpstrs)
 
-  def _Uniform(self, triplist):
+  def _Uniform(self, rows):
     """Fallback to assuming uniform distance between stations"""
     # This should not be neseccary, but we are in fallback mode
-    longest = max([len(t.GetTimeStops()) for t in triplist])
+    longest = max([len(times) for t, start, times in rows])
     return [100] * longest
 
   def _DrawStations(self, color="#aaa"):
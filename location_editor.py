@@ -28,7 +28,7 @@ import transitfeed
 
 class LocationEditorRequestHandler(schedule_viewer.ScheduleRequestHandler):
   def handle_json_GET_setstoplocation(self, params):
-    schedule = self.server.schedule
+    schedule = self.schedule
     stop_id = params.get('id', None)
     lat = params.get('lat', -1)
     lon = params.get('lng', -1)
@@ -38,17 +38,22 @@ class LocationEditorRequestHandler(schedule_viewer.ScheduleRequestHandler):
     else:
       stop.stop_lat = float(lat)
       stop.stop_lon = float(lon)
+      # Responses cached for the old stop location are no longer valid
+      schedule.MarkChanged()
       msg = 'Location of ' + stop['stop_name'] + '(' + stop_id + ') set to ' + \
             lat + 'x' + lon
     print(msg)
     return msg
 
   def handle_json_GET_savedata(self, params):
-    schedule = self.server.schedule
+    schedule = self.schedule
     if not self.server.feed_path:
       msg = 'Feed path not defined'
     else:
       schedule.WriteGoogleTransitFeed(self.server.feed_path)
+      if self.server.watcher:
+        # Don't reload the feed that was just written
+        self.server.watcher.MarkLoaded()
       msg = 'Data saved to ' + self.server.feed_path
     print(msg)
     return msg
@@ -43,13 +43,15 @@ __author__ = 'timothy.stranex@gmail.com (Timothy Stranex)'
 
 
 import datetime
+import json
+import math
 import optparse
 import os
-import re
 import sys
 import time
 import transitfeed
 from transitfeed import util
+from transitfeed.compat import StringIO
 import webbrowser
 
 
@@ -80,6 +82,234 @@ def ApproximateDistanceBetweenPoints(pa, pb):
   return transitfeed.ApproximateDistanceBetweenStops(sa, sb)
 
 
+def GetGridCellSize(distance, max_abs_lat):
+  """Finds the size of the cells of a grid of points in degrees.
+
+  Cells are at least distance wide, so points at most distance apart are in
+  the same or neighbouring cells. A degree of latitude is never shorter than
+  the length used here. A degree of longitude is shorter by the cosine of the
+  latitude, so cells are made wide enough for the point furthest from the
+  equator. The margin absorbs rounding.
+
+  Args:
+    distance: The largest distance between close points in metres.
+    max_abs_lat: The largest absolute latitude of the points in degrees.
+
+  Returns:
+    A tuple (latitude size, longitude size) in degrees.
+  """
+  metres_per_degree = math.radians(1) * util.EARTH_RADIUS
+  lat_cell = max(distance, 1.0) * 1.01 / metres_per_degree
+  lng_cell = lat_cell / max(math.cos(math.radians(min(max_abs_lat, 90.0))),
+                            0.01)
+  return lat_cell, lng_cell
+
+
+def FindStopPairsWithinDistance(a_stops, b_stops, distance):
+  """Finds the pairs of stops from two lists which are close to each other.
+
+  The stops of b_stops are put in a grid of cells which are at least distance
+  wide, so each stop of a_stops is only compared with the stops in its own
+  and the neighbouring cells. This takes time roughly proportional to the
+  number of stops instead of the product of the lengths of the lists. Stops
+  without a location are ignored.
+
+  Args:
+    a_stops: A list of transitfeed.Stop instances.
+    b_stops: A list of transitfeed.Stop instances.
+    distance: The largest distance between the stops of a pair in metres.
+
+  Returns:
+    A list of (distance, a_stop, b_stop) tuples sorted by distance and then
+    by the stop_ids of a_stop and b_stop.
+  """
+  def HasLocation(stop):
+    return stop.stop_lat is not None and stop.stop_lon is not None
+
+  a_stops = [stop for stop in a_stops if HasLocation(stop)]
+  b_stops = [stop for stop in b_stops if HasLocation(stop)]
+  if not a_stops or not b_stops:
+    return []
+  lat_cell, lng_cell = GetGridCellSize(
+      distance, max(abs(stop.stop_lat) for stop in a_stops + b_stops))
+
+  def Cell(stop):
+    return (int(math.floor(stop.stop_lat / lat_cell)),
+            int(math.floor(stop.stop_lon / lng_cell)))
+
+  grid = {}
+  for b_stop in b_stops:
+    grid.setdefault(Cell(b_stop), []).append(b_stop)
+  pairs = []
+  for a_stop in a_stops:
+    lat_index, lng_index = Cell(a_stop)
+    for i in (lat_index - 1, lat_index, lat_index + 1):
+      for j in (lng_index - 1, lng_index, lng_index + 1):
+        for b_stop in grid.get((i, j), ()):
+          pair_distance = transitfeed.ApproximateDistanceBetweenStops(a_stop,
+                                                                      b_stop)
+          if pair_distance <= distance:
+            pairs.append((pair_distance, a_stop.stop_id, b_stop.stop_id,
+                          a_stop, b_stop))
+  pairs.sort(key=lambda pair: pair[:3])
+  return [(pair[0], pair[3], pair[4]) for pair in pairs]
+
+
+def _GetLengthFractions(xy):
+  """Returns the fraction of the length of a projected polyline at each of its
+  vertices."""
+  lengths = [0.0]
+  for (x1, y1), (x2, y2) in zip(xy, xy[1:]):
+    lengths.append(lengths[-1] + math.hypot(x2 - x1, y2 - y1))
+  if not lengths[-1]:
+    return [0.0] * len(xy)
+  return [length / lengths[-1] for length in lengths]
+
+
+def _GetPointsAtFractions(xy, fractions, at):
+  """Returns the points of a projected polyline at the sorted fractions at of
+  its length, given the fractions of its vertices. A fraction of a vertex
+  gives that vertex."""
+  points = []
+  i = 0
+  for fraction in at:
+    while i < len(xy) - 2 and fractions[i + 1] <= fraction:
+      i += 1
+    if len(xy) == 1 or fractions[i + 1] <= fractions[i]:
+      points.append(xy[i])
+      continue
+    t = (fraction - fractions[i]) / (fractions[i + 1] - fractions[i])
+    t = min(max(t, 0.0), 1.0)
+    (x1, y1), (x2, y2) = xy[i], xy[i + 1]
+    points.append((x1 + (x2 - x1) * t, y1 + (y2 - y1) * t))
+  return points
+
+
+def DiscreteFrechetDistance(a_points, b_points, max_distance=None):
+  """Finds the discrete Frechet distance between two polylines.
+
+  This is the shortest leash that lets two walkers go along the polylines
+  from start to end, stepping from vertex to vertex and never going back.
+  Unlike the Hausdorff distance it takes the direction of the polylines into
+  account. The points are projected onto a plane, which is accurate for the
+  short distances used to compare shapes.
+
+  Both polylines are first resampled at the fractions of their lengths of
+  the vertices of either, so that a vertex added in the middle of a segment
+  doesn't change the distance. Only the cells of the dynamic programming
+  table reachable with a leash of at most max_distance are computed, a band
+  along the diagonal for polylines which are close.
+
+  Args:
+    a_points: the first polyline, a non-empty list of (lat, lon) tuples
+    b_points: the second polyline, a non-empty list of (lat, lon) tuples
+    max_distance: if not None, the computation stops as soon as the distance
+                  is known to be larger than max_distance
+
+  Returns:
+    The distance as a float in metres, or infinity if it is larger than
+    max_distance.
+  """
+  lat_scale = math.radians(1) * util.EARTH_RADIUS
+  lng_scale = lat_scale * math.cos(math.radians(a_points[0][0]))
+  a_xy = [(lon * lng_scale, lat * lat_scale) for lat, lon in a_points]
+  b_xy = [(lon * lng_scale, lat * lat_scale) for lat, lon in b_points]
+  a_fractions = _GetLengthFractions(a_xy)
+  b_fractions = _GetLengthFractions(b_xy)
+  at = sorted(set(a_fractions + b_fractions))
+  a_xy = _GetPointsAtFractions(a_xy, a_fractions, at)
+  b_xy = _GetPointsAtFractions(b_xy, b_fractions, at)
+
+  if max_distance is None:
+    max_distance = float('inf')
+  # previous[k] is the distance between a_xy[:i] and b_xy[:start + k + 1], or
+  # None if it is larger than max_distance. Columns outside of previous are
+  # all larger than max_distance.
+  start = 0
+  previous = None
+  for ax, ay in a_xy:
+    row = []
+    if previous is None:
+      previous_end = 0
+    else:
+      previous_end = start + len(previous)
+    j = start
+    while j < len(b_xy):
+      k = j - start
+      if previous is None:
+        candidates = [row[-1] if row else 0.0]
+      else:
+        candidates = [row[-1] if row else None,
+                      previous[k] if k < len(previous) else None,
+                      previous[k - 1] if 0 < k <= len(previous) else None]
+      candidates = [c for c in candidates if c is not None]
+      distance = None
+      if candidates:
+        bx, by = b_xy[j]
+        distance = max(math.hypot(ax - bx, ay - by), min(candidates))
+        if distance > max_distance:
+          distance = None
+      if distance is None and j >= previous_end:
+        break
+      row.append(distance)
+      j += 1
+    while row and row[-1] is None:
+      row.pop()
+    skip = 0
+    while skip < len(row) and row[skip] is None:
+      skip += 1
+    if skip == len(row):
+      return float('inf')
+    start += skip
+    previous = row[skip:]
+  if start + len(previous) < len(b_xy):
+    return float('inf')
+  return previous[-1]
+
+
+def _UnionRanges(ranges):
+  """Return the union of (first, last) ranges of ints as a sorted list of
+  disjoint ranges."""
+  union = []
+  for first, last in sorted(ranges):
+    if union and first <= union[-1][1] + 1:
+      if last > union[-1][1]:
+        union[-1] = (union[-1][0], last)
+    else:
+      union.append((first, last))
+  return union
+
+
+def _IntersectRanges(a_ranges, b_ranges):
+  """Return the intersection of two sorted lists of disjoint (first, last)
+  ranges."""
+  intersection = []
+  i = j = 0
+  while i < len(a_ranges) and j < len(b_ranges):
+    first = max(a_ranges[i][0], b_ranges[j][0])
+    last = min(a_ranges[i][1], b_ranges[j][1])
+    if first <= last:
+      intersection.append((first, last))
+    if a_ranges[i][1] < b_ranges[j][1]:
+      i += 1
+    else:
+      j += 1
+  return intersection
+
+
+def _WeeklyBitmap(day_of_week, first_weekday, num_days):
+  """Return an int with bit i set if day_of_week is True for the day i of
+  num_days starting on first_weekday, where 0 is Monday."""
+  week = 0
+  for i in range(7):
+    if day_of_week[(first_weekday + i) % 7]:
+      week |= 1 << i
+  num_weeks = (num_days + 6) // 7
+  # Repeat the 7 bits of week num_weeks times
+  repeated = week * (((1 << (7 * num_weeks)) - 1) // 127)
+  return repeated & ((1 << num_days) - 1)
+
+
 class Error(Exception):
   """The base exception class for this module."""
 
@@ -117,6 +347,12 @@ class MergeProblemWithContext(transitfeed.ExceptionWithContext):
     return "In files '%s'" % self.dataset_merger.FILE_NAME
 
 
+class ShapesDeduplicated(MergeProblemWithContext):
+  ERROR_TEXT = ("%(count)d shapes were the same as another shape with a "
+                "different id and have been replaced by it, making "
+                "shapes.txt %(bytes_saved)d bytes smaller.")
+
+
 class SameIdButNotMerged(MergeProblemWithContext):
   ERROR_TEXT = ("There is a %(entity_type_name)s in the old feed with id "
                 "'%(id)s' and one from the new feed with the same id but "
@@ -141,6 +377,9 @@ class FareRulesBroken(MergeProblemWithContext):
 class MergeProblemReporter(transitfeed.ProblemReporter):
   """The base problem reporter class for the merge module."""
 
+  # Maximum number of dates listed by CalendarsNotDisjoint
+  _MAX_OVERLAPPING_DATES_SHOWN = 10
+
   def __init__(self, accumulator):
     transitfeed.ProblemReporter.__init__(self, accumulator)
 
@@ -148,9 +387,18 @@ class MergeProblemReporter(transitfeed.ProblemReporter):
     self.AddToAccumulator(
         SameIdButNotMerged(dataset, id=entity_id, reason=reason))
 
-  def CalendarsNotDisjoint(self, dataset):
+  def CalendarsNotDisjoint(self, dataset, overlapping_dates=None):
+    if overlapping_dates:
+      shown = overlapping_dates[:self._MAX_OVERLAPPING_DATES_SHOWN]
+      reason = 'Both feeds have service on %s' % ', '.join(shown)
+      if len(overlapping_dates) > len(shown):
+        reason += ' and %d more dates' % (len(overlapping_dates) - len(shown))
+      reason += '.'
+    else:
+      reason = None
     self.AddToAccumulator(
-        CalendarsNotDisjoint(dataset, problem_type=transitfeed.TYPE_ERROR))
+        CalendarsNotDisjoint(dataset, problem_type=transitfeed.TYPE_ERROR,
+                             reason=reason))
 
   def MergeNotImplemented(self, dataset):
     self.AddToAccumulator(MergeNotImplemented(dataset))
@@ -158,37 +406,95 @@ class MergeProblemReporter(transitfeed.ProblemReporter):
   def FareRulesBroken(self, dataset):
     self.AddToAccumulator(FareRulesBroken(dataset))
 
+  def ShapesDeduplicated(self, dataset, count, bytes_saved):
+    self.AddToAccumulator(
+        ShapesDeduplicated(dataset, problem_type=transitfeed.TYPE_NOTICE,
+                           count=count, bytes_saved=bytes_saved))
+
 
 class HTMLProblemAccumulator(transitfeed.ProblemAccumulatorInterface):
-  """A problem reporter which generates HTML output."""
+  """A problem reporter which generates HTML output.
+
+  The problems are counted by the DataSetMerger which reported them and by
+  their class. With max_samples only the first max_samples problems of each
+  such category are kept, the others are only counted, so that merges with
+  very many problems don't need memory for all of them. The reports are
+  written piece by piece to the output file.
+  """
 
-  def __init__(self):
-    """Initialise."""
-    self._dataset_warnings = {}  # a map from DataSetMergers to their warnings
+  def __init__(self, max_samples=None):
+    """Initialise.
+
+    Args:
+      max_samples: The number of problems kept for each DataSetMerger and
+                   problem class, or None to keep all of them.
+    """
+    self._max_samples = max_samples
+    # Maps from DataSetMergers to a list of (problem class name, problem
+    # text) of their warnings and errors
+    self._dataset_warnings = {}
     self._dataset_errors = {}
     self._notices = []
     self._warning_count = 0
     self._error_count = 0
     self._notice_count = 0
+    # {(DataSetMerger or None for notices, problem class name): count}
+    self._category_counts = {}
 
   def _Report(self, merge_problem):
+    class_name = merge_problem.__class__.__name__
     # Notices are handled special
     if merge_problem.IsNotice():
       self._notice_count += 1
-      self._notices.append(merge_problem)
+      if self._CountCategory(transitfeed.TYPE_NOTICE, None, class_name):
+        self._notices.append(merge_problem)
       return
 
     if merge_problem.IsWarning():
+      problem_type = transitfeed.TYPE_WARNING
       dataset_problems = self._dataset_warnings
       self._warning_count += 1
     else:
+      problem_type = transitfeed.TYPE_ERROR
       dataset_problems = self._dataset_errors
       self._error_count += 1
 
-    problem_html = '<li>%s</li>' % (
-        merge_problem.FormatProblem().replace('\n', '<br>'))
-    dataset_problems.setdefault(merge_problem.dataset_merger, []).append(
-        problem_html)
+    problems = dataset_problems.setdefault(merge_problem.dataset_merger, [])
+    if self._CountCategory(problem_type, merge_problem.dataset_merger,
+                           class_name):
+      problems.append((class_name, merge_problem.FormatProblem()))
+
+  def _CountCategory(self, problem_type, dataset_merger, class_name):
+    """Count a problem, returns True if it should be kept as a sample."""
+    key = (problem_type, dataset_merger, class_name)
+    count = self._category_counts.get(key, 0) + 1
+    self._category_counts[key] = count
+    return self._max_samples is None or count <= self._max_samples
+
+  def _GetOmittedCounts(self, problem_type, dataset_merger):
+    """Returns a sorted list of (problem class name, number of problems not
+    kept) of a type for a DataSetMerger, or for the notices if dataset_merger
+    is None."""
+    omitted = []
+    if self._max_samples is None:
+      return omitted
+    for (category_type, merger, class_name), count in (
+        self._category_counts.items()):
+      if (category_type == problem_type and merger is dataset_merger and
+          count > self._max_samples):
+        omitted.append((class_name, count - self._max_samples))
+    omitted.sort()
+    return omitted
+
+  def _GetStats(self, feed_merger):
+    """Returns a list of (dataset name, merged, copied from the old feed,
+    copied from the new feed) for the DataSetMergers with statistics."""
+    stats = []
+    for merger in feed_merger.GetMergerList():
+      merger_stats = merger.GetMergeStats()
+      if merger_stats is not None:
+        stats.append((merger.DATASET_NAME,) + tuple(merger_stats))
+    return stats
 
   def _GenerateStatsTable(self, feed_merger):
     """Generate an HTML table of merge statistics.
@@ -203,27 +509,20 @@ class HTMLProblemAccumulator(transitfeed.ProblemAccumulatorInterface):
     rows.append('<tr><th class="header"/><th class="header">Merged</th>'
                 '<th class="header">Copied from old feed</th>'
                 '<th class="header">Copied from new feed</th></tr>')
-    for merger in feed_merger.GetMergerList():
-      stats = merger.GetMergeStats()
-      if stats is None:
-        continue
-      merged, not_merged_a, not_merged_b = stats
+    for stats in self._GetStats(feed_merger):
       rows.append('<tr><th class="header">%s</th>'
                   '<td class="header">%d</td>'
                   '<td class="header">%d</td>'
-                  '<td class="header">%d</td></tr>' %
-                  (merger.DATASET_NAME, merged, not_merged_a, not_merged_b))
+                  '<td class="header">%d</td></tr>' % stats)
     return '<table>%s</table>' % '\n'.join(rows)
 
-  def _GenerateSection(self, problem_type):
-    """Generate a listing of the given type of problems.
+  def _WriteSection(self, output_file, problem_type):
+    """Write a listing of the given type of problems.
 
     Args:
+      output_file: The file object that the HTML is written to.
       problem_type: The type of problem. This is one of the problem type
                     constants from transitfeed.
-
-    Returns:
-      The generated HTML as a string.
     """
     if problem_type == transitfeed.TYPE_WARNING:
       dataset_problems = self._dataset_warnings
@@ -233,15 +532,22 @@ class HTMLProblemAccumulator(transitfeed.ProblemAccumulatorInterface):
       heading = 'Errors'
 
     if not dataset_problems:
-      return ''
+      return
 
-    prefix = '<h2 class="issueHeader">%s:</h2>' % heading
-    dataset_sections = []
+    output_file.write('<h2 class="issueHeader">%s:</h2>' % heading)
     for dataset_merger, problems in dataset_problems.items():
-      dataset_sections.append('<h3>%s</h3><ol>%s</ol>' % (
-          dataset_merger.FILE_NAME, '\n'.join(problems)))
-    body = '\n'.join(dataset_sections)
-    return prefix + body
+      output_file.write('<h3>%s</h3><ol>' % dataset_merger.FILE_NAME)
+      for i, (_, text) in enumerate(problems):
+        if i:
+          output_file.write('\n')
+        output_file.write(transitfeed.EncodeUnicode(
+            '<li>%s</li>' % text.replace('\n', '<br>')))
+      output_file.write('</ol>')
+      for class_name, omitted in self._GetOmittedCounts(problem_type,
+                                                        dataset_merger):
+        output_file.write('<p class="omitted">%d more %s problems are not '
+                          'listed.</p>' % (omitted, class_name))
+      output_file.write('\n')
 
   def _GenerateSummary(self):
     """Generate a summary of the warnings and errors.
@@ -250,7 +556,7 @@ class HTMLProblemAccumulator(transitfeed.ProblemAccumulatorInterface):
       The generated HTML as a string.
     """
     items = []
-    if self._notices:
+    if self._notice_count:
       items.append('notices: %d' % self._notice_count)
     if self._dataset_errors:
       items.append('errors: %d' % self._error_count)
@@ -275,6 +581,10 @@ class HTMLProblemAccumulator(transitfeed.ProblemAccumulatorInterface):
         d['url'] = '<a href="%(url)s">%(url)s</a>' % d
       items.append('<li class="notice">%s</li>' %
                    e.FormatProblem(d).replace('\n', '<br>'))
+    for class_name, omitted in self._GetOmittedCounts(
+        transitfeed.TYPE_NOTICE, None):
+      items.append('<li class="notice">%d more %s notices are not '
+                   'listed.</li>' % (omitted, class_name))
     if items:
       return '<h2>Notices:</h2>\n<ul>%s</ul>\n' % '\n'.join(items)
     else:
@@ -312,6 +622,7 @@ class HTMLProblemAccumulator(transitfeed.ProblemAccumulatorInterface):
   table {border-spacing: 5px 0px; margin-top: 3px}
   h3.issueHeader {padding-left: 1em}
   .notice {background-color: yellow}
+  .omitted {padding-left: 40pt; font-style: italic}
   span.pass {background-color: lightgreen}
   span.fail {background-color: yellow}
   .pass, .fail {font-size: 16pt; padding: 3px}
@@ -327,12 +638,6 @@ class HTMLProblemAccumulator(transitfeed.ProblemAccumulatorInterface):
 <p>New feed: <code>%(new_feed_path)s</code></p>
 %(html_merged_feed_path)s""" % locals()
 
-    html_stats = self._GenerateStatsTable(feed_merger)
-    html_summary = self._GenerateSummary()
-    html_notices = self._GenerateNotices()
-    html_errors = self._GenerateSection(transitfeed.TYPE_ERROR)
-    html_warnings = self._GenerateSection(transitfeed.TYPE_WARNING)
-
     html_footer = """
 <div class="footer">
 Generated using transitfeed version %s on %s.
@@ -342,15 +647,87 @@ Generated using transitfeed version %s on %s.
               time.strftime('%B %d, %Y at %I:%M %p %Z'))
 
     output_file.write(transitfeed.EncodeUnicode(html_header))
-    output_file.write(transitfeed.EncodeUnicode(html_stats))
-    output_file.write(transitfeed.EncodeUnicode(html_summary))
-    output_file.write(transitfeed.EncodeUnicode(html_notices))
-    output_file.write(transitfeed.EncodeUnicode(html_errors))
-    output_file.write(transitfeed.EncodeUnicode(html_warnings))
+    output_file.write(transitfeed.EncodeUnicode(
+        self._GenerateStatsTable(feed_merger)))
+    output_file.write(transitfeed.EncodeUnicode(self._GenerateSummary()))
+    output_file.write(transitfeed.EncodeUnicode(self._GenerateNotices()))
+    self._WriteSection(output_file, transitfeed.TYPE_ERROR)
+    self._WriteSection(output_file, transitfeed.TYPE_WARNING)
     output_file.write(transitfeed.EncodeUnicode(html_footer))
 
+  def WriteJsonOutput(self, output_file, feed_merger,
+                      old_feed_path, new_feed_path, merged_feed_path):
+    """Write the results as a JSON object to a file.
+
+    The object has the feed paths, the merge statistics of each data set,
+    the number of errors, warnings and notices and a list of problem
+    categories. Each category has the file name of the data set, the type
+    and class of its problems, their count and the text of the kept samples.
+    The problems are written one by one.
+
+    Args:
+      output_file: The file object that the JSON output will be written to.
+      feed_merger: The FeedMerger instance.
+      old_feed_path: The path to the old feed file as a string.
+      new_feed_path: The path to the new feed file as a string
+      merged_feed_path: The path to the merged feed file as a string. This
+                        may be None if no merged feed was written.
+    """
+    output_file.write('{"old_feed": %s, "new_feed": %s, "merged_feed": %s' % (
+        json.dumps(old_feed_path), json.dumps(new_feed_path),
+        json.dumps(merged_feed_path)))
+    output_file.write(', "stats": %s' % json.dumps([
+        {'dataset': name, 'merged': merged, 'copied_from_old': not_merged_a,
+         'copied_from_new': not_merged_b}
+        for name, merged, not_merged_a, not_merged_b
+        in self._GetStats(feed_merger)]))
+    output_file.write(', "counts": %s' % json.dumps(
+        {'errors': self._error_count, 'warnings': self._warning_count,
+         'notices': self._notice_count}, sort_keys=True))
+    output_file.write(', "problems": [')
+    separator = ''
+    for problem_type, type_name, dataset_problems in (
+        (transitfeed.TYPE_ERROR, 'error', self._dataset_errors),
+        (transitfeed.TYPE_WARNING, 'warning', self._dataset_warnings)):
+      for dataset_merger, problems in dataset_problems.items():
+        for category in self._GetJsonCategories(problem_type, dataset_merger,
+                                                problems):
+          category['file'] = dataset_merger.FILE_NAME
+          category['type'] = type_name
+          output_file.write(separator + json.dumps(category, sort_keys=True))
+          separator = ', '
+    output_file.write('], "notices": [')
+    separator = ''
+    notices = [(e.__class__.__name__, e.FormatProblem()) for e in self._notices]
+    for category in self._GetJsonCategories(transitfeed.TYPE_NOTICE, None,
+                                            notices):
+      output_file.write(separator + json.dumps(category, sort_keys=True))
+      separator = ', '
+    output_file.write(']}')
+
+  def _GetJsonCategories(self, problem_type, dataset_merger, problems):
+    """Returns a list of dicts with the class, count and samples of the
+    problems of a type of a DataSetMerger, or None for notices.
 
-def LoadWithoutErrors(path, memory_db):
+    Args:
+      problem_type: One of the problem type constants from transitfeed.
+      dataset_merger: The DataSetMerger or None.
+      problems: A list of the kept (problem class name, problem text).
+    """
+    samples = {}
+    for class_name, text in problems:
+      samples.setdefault(class_name, []).append(text)
+    categories = []
+    for (category_type, merger, class_name), count in (
+        self._category_counts.items()):
+      if category_type == problem_type and merger is dataset_merger:
+        categories.append({'class': class_name, 'count': count,
+                           'samples': samples.get(class_name, [])})
+    categories.sort(key=lambda category: category['class'])
+    return categories
+
+
+def LoadWithoutErrors(path, memory_db, progress=None):
   """"Return a Schedule object loaded from path; sys.exit for any error."""
   accumulator = transitfeed.ExceptionProblemAccumulator()
   loading_problem_handler = MergeProblemReporter(accumulator)
@@ -358,7 +735,8 @@ def LoadWithoutErrors(path, memory_db):
     schedule = transitfeed.Loader(path,
                                   memory_db=memory_db,
                                   problems=loading_problem_handler,
-                                  extra_validation=True).Load()
+                                  extra_validation=True,
+                                  progress=progress).Load()
   except transitfeed.ExceptionWithContext as e:
     print((
         "\n\nFeeds to merge must load without any errors.\n"
@@ -368,6 +746,14 @@ def LoadWithoutErrors(path, memory_db):
   return schedule
 
 
+def LoadSchedulesWithoutErrors(paths, memory_db, progress=None):
+  """Return a list of Schedule objects loaded from paths.
+
+  Like LoadWithoutErrors this calls sys.exit for any error.
+  """
+  return [LoadWithoutErrors(path, memory_db, progress) for path in paths]
+
+
 class DataSetMerger(object):
   """A DataSetMerger is in charge of merging a set of entities.
 
@@ -378,8 +764,13 @@ class DataSetMerger(object):
     ENTITY_TYPE_NAME: The name of the entity type like 'agency' or 'stop'.
     FILE_NAME: The name of the file containing this data set like 'agency.txt'.
     DATASET_NAME: A name for the dataset like 'Agencies' or 'Stops'.
+    DEPENDENCIES: A tuple of the DataSetMerger classes whose merge results
+      this merger uses. FeedMerger.MergeSchedules runs a merger after the
+      added mergers of these classes.
   """
 
+  DEPENDENCIES = ()
+
   def __init__(self, feed_merger):
     """Initialise.
 
@@ -884,7 +1275,8 @@ class AgencyMerger(DataSetMerger):
   def _Migrate(self, entity, schedule, newid):
     a = transitfeed.Agency(field_dict=entity)
     if newid:
-      a.agency_id = self.feed_merger.GenerateId(entity.agency_id)
+      a.agency_id = self.feed_merger.GenerateId(entity.agency_id,
+                                                 'agency_id')
     return a
 
   def _Add(self, a, b, migrated):
@@ -905,6 +1297,9 @@ class StopMerger(DataSetMerger):
   Attributes:
     largest_stop_distance: The largest distance allowed between stops that
       will be merged in metres.
+    match_by_location: If True stops with different stop_ids which are
+      within largest_stop_distance of each other may be merged, see
+      _MergeByLocation. Otherwise only stops with the same stop_id are.
   """
 
   ENTITY_TYPE_NAME = 'stop'
@@ -912,6 +1307,7 @@ class StopMerger(DataSetMerger):
   DATASET_NAME = 'Stops'
 
   largest_stop_distance = 10.0
+  match_by_location = False
 
   def __init__(self, feed_merger):
     DataSetMerger.__init__(self, feed_merger)
@@ -923,6 +1319,10 @@ class StopMerger(DataSetMerger):
     """Sets largest_stop_distance."""
     self.largest_stop_distance = distance
 
+  def SetMatchByLocation(self, match_by_location):
+    """Sets match_by_location."""
+    self.match_by_location = match_by_location
+
   def _GetIter(self, schedule):
     return schedule.GetStopList()
 
@@ -933,7 +1333,7 @@ class StopMerger(DataSetMerger):
     """Merges two stops.
 
     For the stops to be merged, they must have:
-      - the same stop_id
+      - the same stop_id, unless match_by_location is set
       - the same stop_name (case insensitive)
       - the same zone_id
       - locations less than largest_stop_distance apart
@@ -959,12 +1359,56 @@ class StopMerger(DataSetMerger):
               'stop_name': self._MergeIdenticalCaseInsensitive,
               'zone_id': self._MergeIdentical,
               'location_type': self._MergeIdentical}
+    if self.match_by_location:
+      # The merged stop keeps the stop_id of the new stop
+      del scheme['stop_id']
     return self._SchemedMerge(scheme, a, b)
 
+  def _MergeByLocation(self):
+    """Tries to merge the stops which are near each other.
+
+    Like _MergeDifferentId the stop_ids don't need to match, but only the
+    pairs of stops found by FindStopPairsWithinDistance are tried. Closer
+    pairs are tried first and each stop is merged at most once. The stops
+    which are not merged are migrated.
+
+    Returns:
+      The number of merged stops.
+    """
+    fm = self.feed_merger
+    a_stops = list(self._GetIter(fm.a_schedule))
+    b_stops = list(self._GetIter(fm.b_schedule))
+    merged_a_ids = set()
+    merged_b_ids = set()
+    for distance, a, b in FindStopPairsWithinDistance(
+        a_stops, b_stops, self.largest_stop_distance):
+      if a.stop_id in merged_a_ids or b.stop_id in merged_b_ids:
+        continue
+      try:
+        self._Add(a, b, self._MergeEntities(a, b))
+      except MergeError:
+        continue
+      merged_a_ids.add(a.stop_id)
+      merged_b_ids.add(b.stop_id)
+      self._num_merged += 1
+
+    for a in a_stops:
+      if a.stop_id not in merged_a_ids:
+        self._num_not_merged_a += 1
+        newid = self._HasId(fm.b_schedule, a.stop_id)
+        self._Add(a, None, self._Migrate(a, fm.a_schedule, newid))
+    for b in b_stops:
+      if b.stop_id not in merged_b_ids:
+        self._num_not_merged_b += 1
+        newid = self._HasId(fm.a_schedule, b.stop_id)
+        self._Add(None, b, self._Migrate(b, fm.b_schedule, newid))
+    return self._num_merged
+
   def _Migrate(self, entity, schedule, newid):
     migrated_stop = transitfeed.Stop(field_dict=entity)
     if newid:
-      migrated_stop.stop_id = self.feed_merger.GenerateId(entity.stop_id)
+      migrated_stop.stop_id = self.feed_merger.GenerateId(entity.stop_id,
+                                                           'stop_id')
     return migrated_stop
 
   def _Add(self, a, b, migrated_stop):
@@ -983,7 +1427,10 @@ class StopMerger(DataSetMerger):
     return entity.stop_id
 
   def MergeDataSets(self):
-    num_merged = self._MergeSameId()
+    if self.match_by_location:
+      num_merged = self._MergeByLocation()
+    else:
+      num_merged = self._MergeSameId()
     fm = self.feed_merger
 
     # now we do all the zone_id and parent_station mapping
@@ -1033,7 +1480,8 @@ class StopMerger(DataSetMerger):
       if stop.zone_id in zone_map:
         migrated_stop.zone_id = zone_map[stop.zone_id]
       else:
-        migrated_stop.zone_id = self.feed_merger.GenerateId(stop.zone_id)
+        migrated_stop.zone_id = self.feed_merger.GenerateId(stop.zone_id,
+                                                             'zone_id')
         zone_map[stop.zone_id] = migrated_stop.zone_id
       if stop.parent_station:
         parent_original = schedule.GetStop(stop.parent_station)
@@ -1047,6 +1495,7 @@ class RouteMerger(DataSetMerger):
   ENTITY_TYPE_NAME = 'route'
   FILE_NAME = 'routes.txt'
   DATASET_NAME = 'Routes'
+  DEPENDENCIES = (AgencyMerger,)
 
   def _GetIter(self, schedule):
     return schedule.GetRouteList()
@@ -1068,7 +1517,8 @@ class RouteMerger(DataSetMerger):
   def _Migrate(self, entity, schedule, newid):
     migrated_route = transitfeed.Route(field_dict=entity)
     if newid:
-      migrated_route.route_id = self.feed_merger.GenerateId(entity.route_id)
+      migrated_route.route_id = self.feed_merger.GenerateId(
+          entity.route_id, 'route_id')
     if entity.agency_id:
       original_agency = schedule.GetAgency(entity.agency_id)
     else:
@@ -1142,7 +1592,7 @@ class ServicePeriodMerger(DataSetMerger):
         original_service_period.date_exceptions)
     if newid:
       migrated_service_period.service_id = self.feed_merger.GenerateId(
-          original_service_period.service_id)
+          original_service_period.service_id, 'service_id')
     else:
       migrated_service_period.service_id = original_service_period.service_id
     return migrated_service_period
@@ -1156,9 +1606,12 @@ class ServicePeriodMerger(DataSetMerger):
     return entity.service_id
 
   def MergeDataSets(self):
-    if self.require_disjoint_calendars and not self.CheckDisjointCalendars():
-      self.feed_merger.problem_reporter.CalendarsNotDisjoint(self)
-      return False
+    if self.require_disjoint_calendars:
+      overlapping_dates = self.GetOverlappingDates()
+      if overlapping_dates:
+        self.feed_merger.problem_reporter.CalendarsNotDisjoint(
+            self, overlapping_dates)
+        return False
     self._MergeSameId()
     self.feed_merger.problem_reporter.MergeNotImplemented(self)
     return True
@@ -1208,26 +1661,94 @@ class ServicePeriodMerger(DataSetMerger):
   def CheckDisjointCalendars(self):
     """Check whether any old service periods intersect with any new ones.
 
-    This is a rather coarse check based on
-    transitfeed.SevicePeriod.GetDateRange.
+    Service periods intersect when both are active on the same date, taking
+    the days of the week and the date exceptions into account.
 
     Returns:
       True if the calendars are disjoint or False if not.
     """
-    # TODO: Do an exact check here.
-
-    a_service_periods = self.feed_merger.a_schedule.GetServicePeriodList()
-    b_service_periods = self.feed_merger.b_schedule.GetServicePeriodList()
-
-    for a_service_period in a_service_periods:
-      a_start, a_end = a_service_period.GetDateRange()
-      for b_service_period in b_service_periods:
-        b_start, b_end = b_service_period.GetDateRange()
-        overlap_start = max(a_start, b_start)
-        overlap_end = min(a_end, b_end)
-        if overlap_end >= overlap_start:
-          return False
-    return True
+    return not self.GetOverlappingDates()
+
+  def GetOverlappingDates(self):
+    """Return the dates on which both the old and the new feed have service.
+
+    The date ranges of the service periods of each feed are first merged
+    into sorted, non-overlapping ranges and the two lists are swept to find
+    where they overlap. Only if they do are the active dates of each feed
+    computed, as a bitmap of the days in the overlap, and intersected.
+
+    Returns:
+      A sorted list of "YYYYMMDD" strings, empty if the calendars are
+      disjoint.
+    """
+    a_periods = self._GetPeriodRanges(self.feed_merger.a_schedule)
+    b_periods = self._GetPeriodRanges(self.feed_merger.b_schedule)
+    windows = _IntersectRanges(_UnionRanges([p[:2] for p in a_periods]),
+                               _UnionRanges([p[:2] for p in b_periods]))
+    if not windows:
+      return []
+    first = windows[0][0]
+    last = windows[-1][1]
+    overlap = (self._GetActiveDaysBitmap(a_periods, first, last) &
+               self._GetActiveDaysBitmap(b_periods, first, last))
+    dates = []
+    offset = 0
+    while overlap:
+      if overlap & 1:
+        dates.append(datetime.date.fromordinal(first + offset).strftime(
+            '%Y%m%d'))
+      overlap >>= 1
+      offset += 1
+    return dates
+
+  def _GetPeriodRanges(self, schedule):
+    """Return (first day, last day, service period) for each service period
+    with dates, where the days are date ordinals."""
+    periods = []
+    for service_period in schedule.GetServicePeriodList():
+      start, end = service_period.GetDateRange()
+      if start is None:
+        continue
+      start_date = util.DateStringToDateObject(start)
+      end_date = util.DateStringToDateObject(end)
+      if start_date is None or end_date is None:
+        continue
+      periods.append((start_date.toordinal(), end_date.toordinal(),
+                      service_period))
+    return periods
+
+  def _GetActiveDaysBitmap(self, periods, first, last):
+    """Return an int with bit i set if any of periods is active on the day
+    first + i, for the days up to last."""
+    bitmap = 0
+    for period_first, period_last, service_period in periods:
+      if period_last < first or period_first > last:
+        continue
+      period_bitmap = 0
+      if service_period.start_date and service_period.end_date:
+        start = util.DateStringToDateObject(service_period.start_date)
+        end = util.DateStringToDateObject(service_period.end_date)
+        if start is not None and end is not None:
+          start = max(start.toordinal(), first)
+          end = min(end.toordinal(), last)
+          if start <= end:
+            period_bitmap = _WeeklyBitmap(
+                service_period.day_of_week,
+                datetime.date.fromordinal(start).weekday(),
+                end - start + 1) << (start - first)
+      for date, (exception_type, _) in service_period.date_exceptions.items():
+        date_object = util.DateStringToDateObject(date)
+        if date_object is None:
+          continue
+        day = date_object.toordinal()
+        if day < first or day > last:
+          continue
+        if exception_type == transitfeed.ServicePeriod._EXCEPTION_TYPE_ADD:
+          period_bitmap |= 1 << (day - first)
+        else:
+          period_bitmap &= ~(1 << (day - first))
+      bitmap |= period_bitmap
+    return bitmap
 
   def GetMergeStats(self):
     return None
@@ -1260,7 +1781,7 @@ class FareMerger(DataSetMerger):
         field_dict=original_fare)
     if newid:
       migrated_fare.fare_id = self.feed_merger.GenerateId(
-          original_fare.fare_id)
+          original_fare.fare_id, 'fare_id')
     return migrated_fare
 
   def _Add(self, a, b, migrated_fare):
@@ -1293,6 +1814,7 @@ class TransferMerger(DataSetMerger):
   ENTITY_TYPE_NAME = 'transfer'
   FILE_NAME = 'transfers.txt'
   DATASET_NAME = 'Transfers'
+  DEPENDENCIES = (StopMerger,)
 
   def _GetIter(self, schedule):
     return schedule.GetTransferIter()
@@ -1337,9 +1859,19 @@ class ShapeMerger(DataSetMerger):
   the endpoints of the old and new shapes are no further than
   largest_shape_distance apart.
 
+  With deduplicate_shapes, a shape which is the same as a shape already in
+  the merged schedule is replaced by that shape, whatever their ids. Shapes
+  are the same if their points, including shape_dist_traveled, are equal,
+  found with a dict keyed by the points. Shapes without shape_dist_traveled
+  are also the same if their discrete Frechet distance is at most
+  largest_shape_distance. Only shapes whose first points are in neighbouring
+  cells of a grid and whose last points are close are compared.
+
   Attributes:
     largest_shape_distance: The largest distance between the endpoints of two
       shapes allowed for them to be merged in metres.
+    deduplicate_shapes: Whether to replace shapes by the same shape with a
+      different id.
   """
 
   ENTITY_TYPE_NAME = 'shape'
@@ -1347,11 +1879,29 @@ class ShapeMerger(DataSetMerger):
   DATASET_NAME = 'Shapes'
 
   largest_shape_distance = 10.0
+  deduplicate_shapes = False
+
+  def __init__(self, feed_merger):
+    DataSetMerger.__init__(self, feed_merger)
+    self._num_deduplicated = 0
+    self._bytes_saved = 0
+    # {tuple of points: shape} for the shapes added to the merged schedule
+    self._shapes_by_points = {}
+    # {grid cell of the first point: [shape]} for the shapes added to the
+    # merged schedule which have no shape_dist_traveled
+    self._shapes_by_start_cell = {}
+    # Size of the grid cells in degrees, set by MergeDataSets
+    self._lat_cell = None
+    self._lng_cell = None
 
   def SetLargestShapeDistance(self, distance):
     """Sets largest_shape_distance."""
     self.largest_shape_distance = distance
 
+  def SetDeduplicateShapes(self, deduplicate):
+    """Sets deduplicate_shapes."""
+    self.deduplicate_shapes = deduplicate
+
   def _GetIter(self, schedule):
     return schedule.GetShapeList()
 
@@ -1390,33 +1940,128 @@ class ShapeMerger(DataSetMerger):
     migrated_shape = transitfeed.Shape(original_shape.shape_id)
     if newid:
       migrated_shape.shape_id = self.feed_merger.GenerateId(
-          original_shape.shape_id)
+          original_shape.shape_id, 'shape_id')
     for (lat, lon, dist) in original_shape.points:
       migrated_shape.AddPoint(lat=lat, lon=lon, distance=dist)
     return migrated_shape
 
   def _Add(self, a, b, migrated_shape):
+    if self.deduplicate_shapes and migrated_shape.points:
+      duplicate = self._FindDuplicate(migrated_shape)
+      if duplicate is not None:
+        self._num_deduplicated += 1
+        self._bytes_saved += self._GetShapesTxtSize(migrated_shape)
+        self.feed_merger.Register(a, b, duplicate)
+        return
+      self._IndexShape(migrated_shape)
     self.feed_merger.Register(a, b, migrated_shape)
     self.feed_merger.merged_schedule.AddShapeObject(migrated_shape)
 
   def _GetId(self, shape):
     return shape.shape_id
 
+  def _GetStartCell(self, shape):
+    lat, lon = shape.points[0][:2]
+    return (int(math.floor(lat / self._lat_cell)),
+            int(math.floor(lon / self._lng_cell)))
+
+  def _HasDistances(self, shape):
+    for distance in shape.distance:
+      if distance is not None:
+        return True
+    return False
+
+  def _IndexShape(self, shape):
+    """Add a shape of the merged schedule to the deduplication indexes."""
+    self._shapes_by_points.setdefault(tuple(shape.points), shape)
+    if not self._HasDistances(shape):
+      self._shapes_by_start_cell.setdefault(self._GetStartCell(shape),
+                                            []).append(shape)
+
+  def _FindDuplicate(self, shape):
+    """Returns a shape of the merged schedule which is the same as shape or
+    None."""
+    duplicate = self._shapes_by_points.get(tuple(shape.points))
+    if duplicate is not None or self._HasDistances(shape):
+      return duplicate
+    lat_index, lng_index = self._GetStartCell(shape)
+    points = [point[:2] for point in shape.points]
+    for i in (lat_index - 1, lat_index, lat_index + 1):
+      for j in (lng_index - 1, lng_index, lng_index + 1):
+        for other in self._shapes_by_start_cell.get((i, j), ()):
+          if (ApproximateDistanceBetweenPoints(points[0],
+                                               other.points[0][:2]) >
+              self.largest_shape_distance or
+              ApproximateDistanceBetweenPoints(points[-1],
+                                               other.points[-1][:2]) >
+              self.largest_shape_distance):
+            continue
+          if DiscreteFrechetDistance(
+              points, [point[:2] for point in other.points],
+              self.largest_shape_distance) <= self.largest_shape_distance:
+            return other
+    return None
+
+  def _GetShapesTxtSize(self, shape):
+    """Returns the number of bytes of the rows of shape in shapes.txt."""
+    output = StringIO()
+    writer = util.CsvUnicodeWriter(output)
+    for seq, (lat, lon, dist) in enumerate(shape.points):
+      writer.writerow((shape.shape_id, lat, lon, seq + 1, dist))
+    return len(output.getvalue())
+
   def MergeDataSets(self):
+    if self.deduplicate_shapes:
+      # Cells at least largest_shape_distance wide at every first point
+      max_abs_lat = 0.0
+      for schedule in (self.feed_merger.a_schedule,
+                       self.feed_merger.b_schedule):
+        for shape in schedule.GetShapeList():
+          if shape.points:
+            max_abs_lat = max(max_abs_lat, abs(shape.points[0][0]))
+      self._lat_cell, self._lng_cell = GetGridCellSize(
+          self.largest_shape_distance, max_abs_lat)
     self._MergeSameId()
+    if self._num_deduplicated:
+      print('Shapes deduplicated: %d, %d bytes saved' % (
+          self._num_deduplicated, self._bytes_saved))
+      self.feed_merger.problem_reporter.ShapesDeduplicated(
+          self, self._num_deduplicated, self._bytes_saved)
     return True
 
+  def GetDeduplicationStats(self):
+    """Returns a tuple of the number of shapes replaced by the same shape with
+    a different id and the bytes of shapes.txt this saved."""
+    return (self._num_deduplicated, self._bytes_saved)
+
 
 class TripMerger(DataSetMerger):
   """A DataSetMerger for trips.
 
   This implementation makes no attempt to merge trips, it simply migrates
   them all to the merged feed.
+
+  The stop times aren't migrated with each trip. Once all trips have been
+  migrated the stop_times rows of each input schedule are copied to the
+  merged schedule in one pass, with their trip_id and stop_id replaced by
+  those of the migrated trip and stop. The migrated trips are validated
+  after that.
   """
 
   ENTITY_TYPE_NAME = 'trip'
   FILE_NAME = 'trips.txt'
   DATASET_NAME = 'Trips'
+  DEPENDENCIES = (StopMerger, RouteMerger, ServicePeriodMerger, ShapeMerger)
+
+  def __init__(self, feed_merger):
+    DataSetMerger.__init__(self, feed_merger)
+    # {input schedule: {original trip_id: migrated trip_id}}
+    self._migrated_trip_ids = {}
+    # The migrated trips in the order they were added
+    self._migrated_trips = []
+    # Numbers reserved by MergeDataSets for the trips which need a new id
+    self._next_id_number = None
+    self._last_id_number = None
 
   def _ReportSameIdButNotMerged(self, trip_id, reason):
     pass
@@ -1436,8 +2081,7 @@ class TripMerger(DataSetMerger):
     # Make new trip_id first. AddTripObject reports a problem if it conflicts
     # with an existing id.
     if newid:
-      migrated_trip.trip_id = self.feed_merger.GenerateId(
-          original_trip.trip_id)
+      migrated_trip.trip_id = self._GenerateTripId(original_trip.trip_id)
       migrated_trip.original_trip_id = original_trip.trip_id
     # Need to add trip to schedule before copying stoptimes
     self.feed_merger.merged_schedule.AddTripObject(migrated_trip,
@@ -1464,35 +2108,104 @@ class TripMerger(DataSetMerger):
       original_shape = schedule.GetShape(original_trip.shape_id)
       migrated_trip.shape_id = merge_map[original_shape].shape_id
 
-    for original_stop_time in original_trip.GetStopTimes():
-      migrated_stop_time = transitfeed.StopTime(
-          None,
-          merge_map[original_stop_time.stop],
-          original_stop_time.arrival_time,
-          original_stop_time.departure_time,
-          original_stop_time.stop_headsign,
-          original_stop_time.pickup_type,
-          original_stop_time.drop_off_type,
-          original_stop_time.shape_dist_traveled,
-          original_stop_time.arrival_secs,
-          original_stop_time.departure_secs)
-      migrated_trip.AddStopTimeObject(migrated_stop_time)
+    # The stop times are copied by _CopyStopTimes
+    self._migrated_trip_ids.setdefault(schedule, {})[original_trip.trip_id] = (
+        migrated_trip.trip_id)
 
     for headway_period in original_trip.GetFrequencyTuples():
       migrated_trip.AddFrequency(*headway_period)
 
     return migrated_trip
 
+  def _GenerateTripId(self, trip_id):
+    """Returns a new trip_id, using the numbers reserved by MergeDataSets."""
+    if (self._next_id_number is None or
+        self._next_id_number > self._last_id_number):
+      return self.feed_merger.GenerateId(trip_id, 'trip_id')
+    number = self._next_id_number
+    self._next_id_number += 1
+    return FormatMergedId(trip_id, number)
+
+  def _ReserveTripIds(self):
+    """Reserves the numbers of the new ids of the trips whose trip_id is in
+    both schedules, which are all migrated with a new id."""
+    b_trips = self.feed_merger.b_schedule.trips
+    count = 2 * len([trip_id for trip_id in self.feed_merger.a_schedule.trips
+                     if trip_id in b_trips])
+    if count:
+      self._next_id_number = self.feed_merger.id_allocator.AllocateNumbers(
+          count, 'trip_id')
+      self._last_id_number = self._next_id_number + count - 1
+
   def _Add(self, a, b, migrated_trip):
-    # Validate now, since it wasn't done in _Migrate
-    migrated_trip.Validate(self.feed_merger.merged_schedule.problem_reporter)
+    # Validated by MergeDataSets once the stop times have been copied
+    self._migrated_trips.append(migrated_trip)
     self.feed_merger.Register(a, b, migrated_trip)
 
   def _GetId(self, trip):
     return trip.trip_id
 
+  def _CopyStopTimes(self, schedule, merge_map):
+    """Copy the stop times of the migrated trips of schedule to the merged
+    schedule.
+
+    The rows are streamed from the stop_times table of schedule into the
+    merged schedule with a single executemany call. Like
+    Trip.AddStopTimeObject the stop_sequence values of each trip are
+    renumbered from 1.
+
+    Args:
+      schedule: The old or new transitfeed.Schedule instance.
+      merge_map: The merge map of schedule.
+    """
+    trip_ids = self._migrated_trip_ids.get(schedule)
+    if not trip_ids:
+      return
+    stop_ids = {}
+    for stop in schedule.GetStopList():
+      stop_ids[stop.stop_id] = merge_map[stop].stop_id
+    merged_schedule = self.feed_merger.merged_schedule
+    field_names = transitfeed.StopTime._SQL_FIELD_NAMES
+    trip_index = field_names.index('trip_id')
+    stop_index = field_names.index('stop_id')
+    sequence_index = field_names.index('stop_sequence')
+
+    def GenerateRows():
+      cursor = schedule._connection.cursor()
+      cursor.execute('SELECT %s FROM stop_times ORDER BY trip_id,stop_sequence'
+                     % ','.join(field_names))
+      previous_trip_id = None
+      stop_sequence = 0
+      for row in cursor:
+        original_trip_id = row[trip_index]
+        if original_trip_id not in trip_ids:
+          continue
+        if original_trip_id != previous_trip_id:
+          previous_trip_id = original_trip_id
+          stop_sequence = 0
+        stop_sequence += 1
+        row = list(row)
+        row[trip_index] = trip_ids[original_trip_id]
+        row[stop_index] = stop_ids[row[stop_index]]
+        row[sequence_index] = stop_sequence
+        yield row
+
+    cursor = merged_schedule._connection.cursor()
+    cursor.executemany('INSERT INTO stop_times (%s) VALUES (%s)' % (
+        ','.join(field_names), ','.join(['?'] * len(field_names))),
+                       GenerateRows())
+    merged_schedule._TripsChanged()
+
   def MergeDataSets(self):
+    self._ReserveTripIds()
     self._MergeSameId()
+    self._CopyStopTimes(self.feed_merger.a_schedule,
+                        self.feed_merger.a_merge_map)
+    self._CopyStopTimes(self.feed_merger.b_schedule,
+                        self.feed_merger.b_merge_map)
+    problems = self.feed_merger.merged_schedule.problem_reporter
+    for migrated_trip in self._migrated_trips:
+      migrated_trip.Validate(problems)
     self.feed_merger.problem_reporter.MergeNotImplemented(self)
     return True
 
@@ -1506,6 +2219,8 @@ class FareRuleMerger(DataSetMerger):
   ENTITY_TYPE_NAME = 'fare rule'
   FILE_NAME = 'fare_rules.txt'
   DATASET_NAME = 'Fare Rules'
+  # The zone maps are filled by StopMerger
+  DEPENDENCIES = (FareMerger, RouteMerger, StopMerger)
 
   def MergeDataSets(self):
     """Merge the fare rule datasets.
@@ -1550,6 +2265,103 @@ class FareRuleMerger(DataSetMerger):
     return None
 
 
+def _GetPostfixNumber(entity_id):
+  """Returns the integer ending entity_id, or zero if there is none."""
+  if not entity_id or not entity_id[-1].isdigit():
+    return 0
+  return int(entity_id[len(entity_id.rstrip('0123456789')):])
+
+
+class IdAllocator(object):
+  """Allocates ids which don't collide with the ids of some schedules.
+
+  An allocated id is a base id with '_merged_<number>' appended, where the
+  numbers come from one counter. Before the first id of a kind, such as
+  'trip_id', is allocated the counter is raised to the largest number ending
+  an id of that kind in the schedules. Each kind is scanned at most once and
+  only when needed, so merging feeds whose trip ids don't collide never looks
+  at the trip ids.
+  """
+
+  # Map from id name to a function returning the ids of that kind in a
+  # schedule
+  _ID_GETTERS = {
+      'agency_id': lambda s: [a.agency_id for a in s.GetAgencyList()],
+      'stop_id': lambda s: s.stops.keys(),
+      'zone_id': lambda s: s.GetFareZones(),
+      'route_id': lambda s: s.routes.keys(),
+      'trip_id': lambda s: s.trips.keys(),
+      'service_id': lambda s: s.service_periods.keys(),
+      'fare_id': lambda s: s.fares.keys(),
+      'shape_id': lambda s: [shape.shape_id for shape in s.GetShapeList()],
+      }
+
+  def __init__(self, schedules):
+    """Initialise the allocator.
+
+    Args:
+      schedules: A list of the transitfeed.Schedule instances whose ids
+                 the allocated ids must not collide with.
+    """
+    self._schedules = schedules
+    self._idnum = 0
+    # The id names whose largest postfix number is below the counter
+    self._scanned = set()
+
+  def _Prepare(self, id_name):
+    """Raises the counter above the ids of a kind, or of every kind if
+    id_name is None."""
+    if id_name is None:
+      id_names = self._ID_GETTERS.keys()
+    else:
+      id_names = [id_name]
+    for name in id_names:
+      if name in self._scanned:
+        continue
+      for schedule in self._schedules:
+        for entity_id in self._ID_GETTERS[name](schedule):
+          number = _GetPostfixNumber(entity_id)
+          if number > self._idnum:
+            self._idnum = number
+      self._scanned.add(name)
+
+  def AllocateNumbers(self, count, id_name=None):
+    """Reserves count consecutive numbers for ids of a kind.
+
+    Args:
+      count: The number of ids needed.
+      id_name: The kind of the ids, such as 'trip_id', or None for ids which
+               must not collide with ids of any kind.
+
+    Returns:
+      The first reserved number.
+    """
+    self._Prepare(id_name)
+    first = self._idnum + 1
+    self._idnum += count
+    return first
+
+  def Allocate(self, entity_id=None, id_name=None):
+    """Returns a new id based on entity_id, see AllocateNumbers."""
+    return FormatMergedId(entity_id, self.AllocateNumbers(1, id_name))
+
+  def GetLastNumber(self):
+    """Returns the number of the last allocated id."""
+    return self._idnum
+
+  def SkipTo(self, number):
+    """Makes sure that the numbers up to number are not allocated."""
+    self._idnum = max(self._idnum, number)
+
+
+def FormatMergedId(entity_id, number):
+  """Returns the id allocated for entity_id with a number."""
+  if entity_id:
+    return '%s_merged_%d' % (entity_id, number)
+  else:
+    return 'merged_%d' % number
+
+
 class FeedMerger(object):
   """A class for merging two whole feeds.
 
@@ -1566,10 +2378,12 @@ class FeedMerger(object):
     b_merge_map: A map from new entities to merged entities.
     a_zone_map: A map from old zone ids to merged zone ids.
     b_zone_map: A map from new zone ids to merged zone ids.
+    id_allocator: The IdAllocator used by GenerateId.
+    progress: The transitfeed.ProgressReporter updated as entities are merged.
   """
 
   def __init__(self, a_schedule, b_schedule, merged_schedule,
-               problem_reporter):
+               problem_reporter, progress=None):
     """Initialise the merger.
 
     Once this initialiser has been called, a_schedule and b_schedule should
@@ -1580,6 +2394,8 @@ class FeedMerger(object):
       b_schedule: The new schedule, an instance of transitfeed.Schedule.
       problem_reporter: The problem reporter, an instance of
                         transitfeed.ProblemReporter.
+      progress: A transitfeed.ProgressReporter which is updated as the
+                entities of each data set are merged, or None.
     """
     self.a_schedule = a_schedule
     self.b_schedule = b_schedule
@@ -1589,57 +2405,15 @@ class FeedMerger(object):
     self.a_zone_map = {}
     self.b_zone_map = {}
     self._mergers = []
-    self._idnum = max(self._FindLargestIdPostfixNumber(self.a_schedule),
-                      self._FindLargestIdPostfixNumber(self.b_schedule))
+    self.id_allocator = IdAllocator([self.a_schedule, self.b_schedule])
 
     self.problem_reporter = problem_reporter
-
-  def _FindLargestIdPostfixNumber(self, schedule):
-    """Finds the largest integer used as the ending of an id in the schedule.
-
-    Args:
-      schedule: The schedule to check.
-
-    Returns:
-      The maximum integer used as an ending for an id.
-    """
-    postfix_number_re = re.compile('(\d+)$')
-
-    def ExtractPostfixNumber(entity_id):
-      """Try to extract an integer from the end of entity_id.
-
-      If entity_id is None or if there is no integer ending the id, zero is
-      returned.
-
-      Args:
-        entity_id: An id string or None.
-
-      Returns:
-        An integer ending the entity_id or zero.
-      """
-      if entity_id is None:
-        return 0
-      match = postfix_number_re.search(entity_id)
-      if match is not None:
-        return int(match.group(1))
-      else:
-        return 0
-
-    id_data_sets = {'agency_id': schedule.GetAgencyList(),
-                    'stop_id': schedule.GetStopList(),
-                    'route_id': schedule.GetRouteList(),
-                    'trip_id': schedule.GetTripList(),
-                    'service_id': schedule.GetServicePeriodList(),
-                    'fare_id': schedule.GetFareAttributeList(),
-                    'shape_id': schedule.GetShapeList()}
-
-    max_postfix_number = 0
-    for id_name, entity_list in id_data_sets.items():
-      for entity in entity_list:
-        entity_id = getattr(entity, id_name)
-        postfix_number = ExtractPostfixNumber(entity_id)
-        max_postfix_number = max(max_postfix_number, postfix_number)
-    return max_postfix_number
+    if progress is None:
+      progress = transitfeed.null_progress_reporter
+    self.progress = progress
+    # Updated for each data set by MergeSchedules
+    self._progress_count = 0
+    self._next_progress = sys.maxsize
 
   def GetScheduleName(self, schedule):
     """Returns a single letter identifier for the schedule.
@@ -1658,24 +2432,22 @@ class FeedMerger(object):
     """
     return {self.a_schedule: 'a', self.b_schedule: 'b'}[schedule]
 
-  def GenerateId(self, entity_id=None):
+  def GenerateId(self, entity_id=None, id_name=None):
     """Generate a unique id based on the given id.
 
     This is done by appending a counter which is then incremented. The
     counter is initialised at the maximum number used as an ending for
-    any id in the old and new schedules.
+    any id of the kind id_name in the old and new schedules, see IdAllocator.
 
     Args:
       entity_id: The base id string. This is allowed to be None.
+      id_name: The kind of the id, such as 'stop_id', or None if the id must
+               not collide with ids of any kind.
 
     Returns:
       The generated id.
     """
-    self._idnum += 1
-    if entity_id:
-      return '%s_merged_%d' % (entity_id, self._idnum)
-    else:
-      return 'merged_%d' % self._idnum
+    return self.id_allocator.Allocate(entity_id, id_name)
 
   def Register(self, a, b, migrated_entity):
     """Registers a merge mapping.
@@ -1706,6 +2478,9 @@ class FeedMerger(object):
     if b is not None:
       self.b_merge_map[b] = migrated_entity
       b._migrated_entity = migrated_entity
+    self._progress_count += (a is not None) + (b is not None)
+    if self._progress_count >= self._next_progress:
+      self._next_progress = self.progress.Update(self._progress_count)
 
   def AddMerger(self, merger):
     """Add a DataSetMerger to be run by Merge().
@@ -1751,16 +2526,64 @@ class FeedMerger(object):
     """Merge the schedules.
 
     This is done by running the DataSetMergers that have been added with
-    AddMerger() in the order that they were added.
+    AddMerger() in the order that they were added, except that a merger is
+    run once the mergers listed in its DEPENDENCIES have run. Trips are
+    thus migrated as soon as stops, routes, service periods and shapes are
+    mapped, whatever the order of AddMerger() calls.
 
     Returns:
       True if the merge was successful.
+
+    Raises:
+      LookupError: The DEPENDENCIES of the mergers form a cycle.
     """
-    for merger in self._mergers:
-      if not merger.MergeDataSets():
+    for merger in self._GetMergeOrder():
+      self._progress_count = 0
+      self._next_progress = self.progress.StartPhase(
+          type(merger).__name__, self._CountEntities(merger))
+      succeeded = merger.MergeDataSets()
+      self.progress.EndPhase(self._progress_count)
+      if not succeeded:
         return False
     return True
 
+  def _GetDependencies(self, merger):
+    """Returns the added mergers that merger has to run after."""
+    dependencies = []
+    for cls in getattr(merger, 'DEPENDENCIES', ()):
+      for other in self._mergers:
+        if other is not merger and isinstance(other, cls):
+          dependencies.append(other)
+    return dependencies
+
+  def _GetMergeOrder(self):
+    """Returns the added mergers in the order MergeSchedules runs them."""
+    dependencies = dict((merger, self._GetDependencies(merger))
+                        for merger in self._mergers)
+    pending = list(self._mergers)
+    order = []
+    while pending:
+      for merger in pending:
+        if all(other in order for other in dependencies[merger]):
+          break
+      else:
+        raise LookupError(
+            'DataSetMerger dependencies can not be satisfied: %s' %
+            ', '.join(type(m).__name__ for m in pending))
+      pending.remove(merger)
+      order.append(merger)
+    return order
+
+  def _CountEntities(self, merger):
+    """Returns the number of entities merger will merge or None if unknown."""
+    if not self.progress.enabled:
+      return None
+    try:
+      return (sum(1 for _ in merger._GetIter(self.a_schedule)) +
+              sum(1 for _ in merger._GetIter(self.b_schedule)))
+    except NotImplementedError:
+      return None
+
   def GetMergedSchedule(self):
     """Returns the merged schedule.
 
@@ -1772,13 +2595,127 @@ class FeedMerger(object):
     return self.merged_schedule
 
 
+class MultiFeedMerger(object):
+  """A class for merging any number of feeds.
+
+  The feeds are merged in pairs with FeedMerger, like a tournament: the
+  first with the second, the third with the fourth and so on, then the
+  results of those merges in pairs until one schedule is left. The
+  intermediate schedules stay in memory or temporary databases and are never
+  written as feeds. Every feed is copied once per round, so merging n feeds
+  copies each entity about log2(n) times instead of up to n - 1 times for a
+  chain of pairwise merges. The order of the feeds is kept: in every pair the
+  older feeds are the old schedule and the newer feeds the new one.
+
+  Ids generated for colliding entities share one counter across all of the
+  merges, so their numbers are unique in the whole merged feed.
+
+  Attributes:
+    schedules: The list of transitfeed.Schedule instances to merge, oldest
+      first.
+    problem_reporter: The merge problem reporter used by every merge.
+  """
+
+  def __init__(self, schedules, problem_reporter, memory_db=True,
+               configure_merger=None, progress=None):
+    """Initialise the merger.
+
+    Args:
+      schedules: A list of transitfeed.Schedule instances, oldest first.
+      problem_reporter: The problem reporter, an instance of
+                        MergeProblemReporter.
+      memory_db: Passed to transitfeed.Schedule when creating the merged and
+                 intermediate schedules.
+      configure_merger: A function called with each FeedMerger after its
+                        default DataSetMergers have been added, for example
+                        to set the largest stop distance, or None.
+      progress: A transitfeed.ProgressReporter passed to each FeedMerger, or
+                None.
+    """
+    self.schedules = list(schedules)
+    self.problem_reporter = problem_reporter
+    self._memory_db = memory_db
+    self._configure_merger = configure_merger
+    self._progress = progress
+    self._feed_mergers = []
+    # The indexes in schedules of the inputs of each FeedMerger, as a tuple
+    # (old indexes, new indexes)
+    self._feed_merger_inputs = []
+    self._idnum = 0
+    self._merged_schedule = None
+
+  def MergeSchedules(self):
+    """Merge the schedules.
+
+    Returns:
+      True if all merges were successful.
+    """
+    # Each schedule of a round with the indexes of the inputs it contains
+    level = [(schedule, [i]) for i, schedule in enumerate(self.schedules)]
+    while len(level) > 1:
+      next_level = []
+      for i in range(0, len(level) - 1, 2):
+        (a_schedule, a_inputs), (b_schedule, b_inputs) = level[i:i + 2]
+        self._feed_merger_inputs.append((a_inputs, b_inputs))
+        merged_schedule = self._MergePair(a_schedule, b_schedule)
+        if merged_schedule is None:
+          return False
+        next_level.append((merged_schedule, a_inputs + b_inputs))
+      if len(level) % 2:
+        # The newest schedule is merged in the next round
+        next_level.append(level[-1])
+      level = next_level
+    if level:
+      self._merged_schedule = level[0][0]
+    return True
+
+  def _MergePair(self, a_schedule, b_schedule):
+    """Merge two schedules, returns the merged schedule or None."""
+    feed_merger = FeedMerger(a_schedule, b_schedule,
+                             transitfeed.Schedule(memory_db=self._memory_db),
+                             self.problem_reporter, self._progress)
+    feed_merger.id_allocator.SkipTo(self._idnum)
+    feed_merger.AddDefaultMergers()
+    if self._configure_merger is not None:
+      self._configure_merger(feed_merger)
+    self._feed_mergers.append(feed_merger)
+    succeeded = feed_merger.MergeSchedules()
+    self._idnum = feed_merger.id_allocator.GetLastNumber()
+    if not succeeded:
+      return None
+    return feed_merger.GetMergedSchedule()
+
+  def GetFeedMergerList(self):
+    """Returns the FeedMerger instances used, in the order they ran."""
+    return self._feed_mergers
+
+  def GetFeedMergerInputs(self, feed_merger):
+    """Returns the inputs of a FeedMerger returned by GetFeedMergerList.
+
+    Returns:
+      A tuple (old indexes, new indexes) of the lists of the indexes in
+      schedules of the feeds merged into the old and the new schedule of
+      feed_merger.
+    """
+    return self._feed_merger_inputs[self._feed_mergers.index(feed_merger)]
+
+  def GetMergedSchedule(self):
+    """Returns the merged schedule or None before MergeSchedules() is called.
+
+    With a single input schedule this is the input schedule itself.
+    """
+    return self._merged_schedule
+
+
 def main():
   """Run the merge driver program."""
   usage = \
-"""%prog [options] <input GTFS a.zip> <input GTFS b.zip> <output GTFS.zip>
+"""%prog [options] <input GTFS a.zip> <input GTFS b.zip> [<input GTFS c.zip> ...] <output GTFS.zip>
 
 Merges <input GTFS a.zip> and <input GTFS b.zip> into a new GTFS file
-<output GTFS.zip>.
+<output GTFS.zip>. When more than two input feeds are given they are all
+merged into <output GTFS.zip>, treating each feed as newer than the feeds
+before it.
 
 For more information see
 https://github.com/google/transitfeed/wiki/Merge
@@ -1796,15 +2733,35 @@ https://github.com/google/transitfeed/wiki/Merge
                     default=StopMerger.largest_stop_distance,
                     help='the furthest distance two stops can be apart and '
                     'still be merged, in metres')
+  parser.add_option('--match_stops_by_location',
+                    dest='match_stops_by_location',
+                    action='store_true',
+                    help='merge stops with different stop_ids which are no '
+                    'further apart than --largest_stop_distance and have the '
+                    'same name, zone and location type')
   parser.add_option('--largest_shape_distance',
                     dest='largest_shape_distance',
                     default=ShapeMerger.largest_shape_distance,
                     help='the furthest distance the endpoints of two shapes '
                     'can be apart and the shape still be merged, in metres')
+  parser.add_option('--deduplicate_shapes',
+                    dest='deduplicate_shapes',
+                    action='store_true',
+                    help='replace shapes which are the same as another shape '
+                    'with a different id, or no further than '
+                    '--largest_shape_distance from it, by that shape')
   parser.add_option('--html_output_path',
                     dest='html_output_path',
                     default='merge-results.html',
                     help='write the html output to this file')
+  parser.add_option('--json_output_path',
+                    dest='json_output_path',
+                    help='also write the results as JSON to this file')
+  parser.add_option('--max_problems_shown',
+                    dest='max_problems_shown', type='int',
+                    help='the number of problems listed for each file and '
+                    'kind of problem, the others are only counted. 0 lists '
+                    'all problems.')
   parser.add_option('--no_browser',
                     dest='no_browser',
                     action='store_true',
@@ -1818,43 +2775,86 @@ https://github.com/google/transitfeed/wiki/Merge
   parser.add_option('-m', '--memory_db', dest='memory_db',  action='store_true',
                     help='Use in-memory sqlite db instead of a temporary file. '
                          'It is faster but uses more RAM.')
-  parser.set_defaults(memory_db=False)
+  parser.add_option('--progress', dest='progress', action='store_true',
+                    help='print a progress line with the number of entities '
+                    'processed and entities per second while loading, merging '
+                    'and writing the feeds')
+  parser.set_defaults(memory_db=False, progress=False,
+                      match_stops_by_location=False, deduplicate_shapes=False,
+                      max_problems_shown=1000)
   (options, args) = parser.parse_args()
 
-  if len(args) != 3:
+  if len(args) < 3:
     parser.error('You did not provide all required command line arguments.')
 
-  old_feed_path = os.path.abspath(args[0])
-  new_feed_path = os.path.abspath(args[1])
-  merged_feed_path = os.path.abspath(args[2])
+  input_feed_paths = [os.path.abspath(arg) for arg in args[:-1]]
+  old_feed_path = input_feed_paths[0]
+  new_feed_path = input_feed_paths[-1]
+  merged_feed_path = os.path.abspath(args[-1])
 
   if old_feed_path.find("IWantMyCrash") != -1:
     # See tests/testmerge.py
     raise Exception('For testing the merge crash handler.')
 
-  a_schedule = LoadWithoutErrors(old_feed_path, options.memory_db)
-  b_schedule = LoadWithoutErrors(new_feed_path, options.memory_db)
-  merged_schedule = transitfeed.Schedule(memory_db=options.memory_db)
-  accumulator = HTMLProblemAccumulator()
-  problem_reporter = MergeProblemReporter(accumulator)
-
-  util.CheckVersion(problem_reporter, options.latest_version)
-
-  feed_merger = FeedMerger(a_schedule, b_schedule, merged_schedule,
-                           problem_reporter)
-  feed_merger.AddDefaultMergers()
+  if options.cutoff_date is not None and len(input_feed_paths) > 2:
+    parser.error('--cutoff_date can only be used when merging two feeds.')
 
-  feed_merger.GetMerger(StopMerger).SetLargestStopDistance(float(
-      options.largest_stop_distance))
-  feed_merger.GetMerger(ShapeMerger).SetLargestShapeDistance(float(
-      options.largest_shape_distance))
+  if options.progress:
+    progress = transitfeed.ConsoleProgressReporter()
+  else:
+    progress = None
 
-  if options.cutoff_date is not None:
-    service_period_merger = feed_merger.GetMerger(ServicePeriodMerger)
-    service_period_merger.DisjoinCalendars(options.cutoff_date)
+  accumulator = HTMLProblemAccumulator(options.max_problems_shown or None)
+  problem_reporter = MergeProblemReporter(accumulator)
 
-  if feed_merger.MergeSchedules():
-    feed_merger.GetMergedSchedule().WriteGoogleTransitFeed(merged_feed_path)
+  def ConfigureMerger(feed_merger):
+    feed_merger.GetMerger(StopMerger).SetLargestStopDistance(float(
+        options.largest_stop_distance))
+    feed_merger.GetMerger(StopMerger).SetMatchByLocation(
+        options.match_stops_by_location)
+    feed_merger.GetMerger(ShapeMerger).SetLargestShapeDistance(float(
+        options.largest_shape_distance))
+    feed_merger.GetMerger(ShapeMerger).SetDeduplicateShapes(
+        options.deduplicate_shapes)
+
+  if len(input_feed_paths) == 2:
+    a_schedule = LoadWithoutErrors(old_feed_path, options.memory_db, progress)
+    b_schedule = LoadWithoutErrors(new_feed_path, options.memory_db, progress)
+    merged_schedule = transitfeed.Schedule(memory_db=options.memory_db)
+
+    util.CheckVersion(problem_reporter, options.latest_version)
+
+    feed_merger = FeedMerger(a_schedule, b_schedule, merged_schedule,
+                             problem_reporter, progress)
+    feed_merger.AddDefaultMergers()
+    ConfigureMerger(feed_merger)
+
+    if options.cutoff_date is not None:
+      service_period_merger = feed_merger.GetMerger(ServicePeriodMerger)
+      service_period_merger.DisjoinCalendars(options.cutoff_date)
+
+    succeeded = feed_merger.MergeSchedules()
+  else:
+    schedules = LoadSchedulesWithoutErrors(input_feed_paths, options.memory_db,
+                                           progress)
+
+    util.CheckVersion(problem_reporter, options.latest_version)
+
+    multi_feed_merger = MultiFeedMerger(schedules, problem_reporter,
+                                        options.memory_db, ConfigureMerger,
+                                        progress)
+    succeeded = multi_feed_merger.MergeSchedules()
+    merged_schedule = multi_feed_merger.GetMergedSchedule()
+    # The report shows the statistics of the final merge, or of the merge
+    # which failed, labelled with the feeds merged into each of its sides
+    feed_merger = multi_feed_merger.GetFeedMergerList()[-1]
+    old_inputs, new_inputs = multi_feed_merger.GetFeedMergerInputs(
+        feed_merger)
+    old_feed_path = ', '.join(input_feed_paths[i] for i in old_inputs)
+    new_feed_path = ', '.join(input_feed_paths[i] for i in new_inputs)
+
+  if succeeded:
+    merged_schedule.WriteGoogleTransitFeed(merged_feed_path, progress)
   else:
     merged_feed_path = None
 
@@ -1863,6 +2863,12 @@ https://github.com/google/transitfeed/wiki/Merge
                           old_feed_path, new_feed_path, merged_feed_path)
   output_file.close()
 
+  if options.json_output_path:
+    output_file = file(options.json_output_path, 'w')
+    accumulator.WriteJsonOutput(output_file, feed_merger,
+                                old_feed_path, new_feed_path, merged_feed_path)
+    output_file.close()
+
   if not options.no_browser:
     webbrowser.open('file://%s' % os.path.abspath(options.html_output_path))
 
@@ -23,16 +23,20 @@ from __future__ import print_function
 
 
 import BaseHTTPServer, sys, urlparse
-import bisect
 from gtfsscheduleviewer.marey_graph import MareyGraph
 import gtfsscheduleviewer
+import gzip
 import mimetypes
 import os.path
+import Queue
 import re
 import signal
 import json as simplejson
 import socket
+import StringIO
+import threading
 import time
+import traceback
 import transitfeed
 from transitfeed import util
 import urllib
@@ -46,6 +50,13 @@ if hasattr(signal, 'SIGBREAK'):
 
 mimetypes.add_type('text/plain', '.vbs')
 
+# Responses smaller than this many bytes are sent without compression
+MIN_GZIP_SIZE = 1024
+
+# Makes ETags of this process differ from those of a previous run, which may
+# have had a different feed with the same schedule generation.
+_ETAG_PREFIX = '%x' % int(time.time() * 1000)
+
 
 class ResultEncoder(simplejson.JSONEncoder):
   def default(self, obj):
@@ -61,8 +72,8 @@ class ResultEncoder(simplejson.JSONEncoder):
 # http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/425210/index_txt
 # An alternate approach is shown at
 # http://mail.python.org/pipermail/python-list/2003-July/212751.html
-# but it requires multiple threads. A sqlite object can only be used from one
-# thread.
+# but it requires multiple threads. See ThreadPoolHTTPServer for sharing the
+# schedule, and its sqlite connection, between threads.
 class StoppableHTTPServer(BaseHTTPServer.HTTPServer):
   def server_bind(self):
     BaseHTTPServer.HTTPServer.server_bind(self)
@@ -86,6 +97,234 @@ class StoppableHTTPServer(BaseHTTPServer.HTTPServer):
       self.handle_request()
 
 
+class ThreadPoolHTTPServer(StoppableHTTPServer):
+  """A StoppableHTTPServer which handles requests in a pool of threads.
+
+  Accepted connections wait in a queue of at most queue_size requests for a
+  free worker thread. When the queue is full the server stops accepting
+  connections until a worker takes one. The handlers share server.schedule,
+  which must be made thread safe with Schedule.MakeThreadSafe.
+  """
+
+  def __init__(self, server_address, RequestHandlerClass, num_threads=4,
+               queue_size=32):
+    StoppableHTTPServer.__init__(self, server_address, RequestHandlerClass)
+    self._requests = Queue.Queue(queue_size)
+    self._threads = []
+    for i in range(num_threads):
+      thread = threading.Thread(target=self._HandleQueuedRequests)
+      thread.daemon = True
+      thread.start()
+      self._threads.append(thread)
+
+  def process_request(self, request, client_address):
+    self._requests.put((request, client_address))
+
+  def _HandleQueuedRequests(self):
+    while True:
+      item = self._requests.get()
+      if item is None:
+        return
+      request, client_address = item
+      try:
+        self.finish_request(request, client_address)
+      except Exception:
+        self.handle_error(request, client_address)
+      self.shutdown_request(request)
+
+  def server_close(self):
+    StoppableHTTPServer.server_close(self)
+    for thread in self._threads:
+      self._requests.put(None)
+
+
+class FeedLoader(object):
+  """Loads a feed for a server in a background thread.
+
+  server.schedule stays None until the feed is loaded and the indexes used by
+  the request handlers are built, so the server can accept connections while
+  a large feed loads. GetStatus describes the progress.
+  """
+
+  def __init__(self, server, feed_path):
+    self._server = server
+    self._feed_path = feed_path
+    self._lock = threading.Lock()
+    self._start_time = None
+    self._end_time = None
+    self._status = {'state': 'loading', 'phase': None, 'count': 0,
+                    'total': None}
+
+  def Start(self):
+    """Start loading in a new daemon thread."""
+    thread = threading.Thread(target=self.Run)
+    thread.daemon = True
+    thread.start()
+
+  def Run(self):
+    """Load the feed in the calling thread."""
+    self._start_time = time.time()
+    try:
+      schedule = transitfeed.Schedule(
+          problem_reporter=transitfeed.ProblemReporter())
+      progress = transitfeed.ProgressReporter(callback=self._Progress,
+                                              min_interval=0.5)
+      schedule.Load(self._feed_path, progress=progress)
+      # The loader only reports a feed it can't read, such as a zip file
+      # which is still being written, and returns an empty schedule
+      if not schedule.GetStopList():
+        raise ValueError('No stops found in feed "%s"' % self._feed_path)
+      self._SetStatus(state='indexing', phase=None, count=0, total=None)
+      schedule.BuildIndexes()
+      schedule.MakeThreadSafe()
+      # Requests being handled keep the schedule they started with, see
+      # ScheduleRequestHandler.do_GET
+      self._server.schedule = schedule
+      # Responses cached for a previous schedule can't be requested again
+      self._server.response_cache.Clear()
+      self._end_time = time.time()
+      self._SetStatus(state='ready')
+      print('Loaded feed "%s" in %.1f seconds' %
+            (self._feed_path, self._end_time - self._start_time))
+    except Exception as e:
+      traceback.print_exc()
+      self._end_time = time.time()
+      self._SetStatus(state='error', error=str(e))
+
+  def _Progress(self, name, count, total, rate, finished):
+    self._SetStatus(phase=name, count=count, total=total)
+
+  def _SetStatus(self, **kwargs):
+    self._lock.acquire()
+    try:
+      self._status.update(kwargs)
+    finally:
+      self._lock.release()
+
+  def GetStatus(self):
+    """Return a dict with the state ('loading', 'indexing', 'ready' or
+    'error'), the current phase, its row count and estimated total."""
+    self._lock.acquire()
+    try:
+      status = dict(self._status)
+    finally:
+      self._lock.release()
+    status['elapsed'] = ((self._end_time or time.time()) -
+                         (self._start_time or time.time()))
+    return status
+
+
+class FeedWatcher(object):
+  """Reloads the feed of a server when the feed file or directory changes.
+
+  The new feed is loaded and indexed by a FeedLoader in the watcher's thread
+  while requests are served from the current schedule, then replaces
+  server.schedule. A change is only loaded once the feed has stayed the same
+  for one interval, so a feed which is being copied isn't loaded half
+  written. If the new feed fails to load the current schedule is kept.
+  """
+
+  def __init__(self, server, feed_path, interval=5.0):
+    self._server = server
+    self._feed_path = feed_path
+    self._interval = interval
+    self._loaded_version = None
+    self._pending_version = None
+    self.MarkLoaded()
+
+  def Start(self):
+    """Start watching in a new daemon thread."""
+    thread = threading.Thread(target=self._Run)
+    thread.daemon = True
+    thread.start()
+
+  def _Run(self):
+    while True:
+      time.sleep(self._interval)
+      try:
+        self.CheckForChange()
+      except Exception:
+        traceback.print_exc()
+
+  def MarkLoaded(self):
+    """Treat the feed as it is now as loaded, for example after the server
+    wrote its own schedule to the feed path."""
+    self._loaded_version = self._GetFeedVersion()
+    self._pending_version = None
+
+  def CheckForChange(self):
+    """Reload the feed if it changed and stayed the same since the previous
+    call. Return True if the feed was reloaded."""
+    version = self._GetFeedVersion()
+    if version is None or version == self._loaded_version:
+      self._pending_version = None
+      return False
+    if version != self._pending_version:
+      self._pending_version = version
+      return False
+    print('Feed "%s" changed, reloading...' % self._feed_path)
+    loader = FeedLoader(self._server, self._feed_path)
+    self._server.loader = loader
+    loader.Run()
+    # A feed which failed to load is only tried again once it changes
+    self._loaded_version = version
+    self._pending_version = None
+    return True
+
+  def _GetFeedVersion(self):
+    """Return the modification times and sizes of the feed's files, or None
+    if the feed can't be read right now."""
+    try:
+      if os.path.isdir(self._feed_path):
+        paths = [os.path.join(self._feed_path, name)
+                 for name in sorted(os.listdir(self._feed_path))]
+      else:
+        paths = [self._feed_path]
+      version = []
+      for path in paths:
+        stat = os.stat(path)
+        version.append((path, stat.st_mtime, stat.st_size))
+      return tuple(version)
+    except OSError:
+      return None
+
+
+def GzipETag(etag):
+  """Return the ETag of the gzip encoded body of a response with etag.
+
+  Caches must not treat the compressed and the uncompressed body as the same
+  representation, so they get different ETags."""
+  return etag[:-1] + '-gzip"'
+
+
+class CachedResponse(object):
+  """The body of a response which may be sent many times.
+
+  Attributes:
+    content: the uncompressed body as a str
+    content_type: value of the Content-Type header
+    etag: value of the ETag header, including the double quotes
+    gzip_etag: value of the ETag header when the body is sent compressed
+  """
+
+  def __init__(self, content, content_type, etag):
+    self.content = content
+    self.content_type = content_type
+    self.etag = etag
+    self.gzip_etag = GzipETag(etag)
+    self._gzipped = None
+
+  def GetGzipped(self):
+    """Return content compressed with gzip, compressing it on the first call."""
+    if self._gzipped is None:
+      buf = StringIO.StringIO()
+      gzip_file = gzip.GzipFile(fileobj=buf, mode='wb')
+      gzip_file.write(self.content)
+      gzip_file.close()
+      self._gzipped = buf.getvalue()
+    return self._gzipped
+
+
 def StopToTuple(stop):
   """Return tuple as expected by javascript function addStopMarkerFromList"""
   return (stop.stop_id, stop.stop_name, float(stop.stop_lat),
@@ -93,6 +332,22 @@ def StopToTuple(stop):
 
 
 class ScheduleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  # JSON handlers, without the handle_json_GET_ prefix, whose result depends
+  # only on the schedule and the parameters. Their responses are kept in
+  # server.response_cache and revalidated with an ETag made from the
+  # schedule generation. Handlers with side effects must not be listed.
+  cached_json_handlers = frozenset([
+      'boundboxstops', 'neareststops', 'routepatterns', 'routerow', 'routes',
+      'stopsearch', 'stoptrips', 'tile', 'tripsdata', 'tripshape',
+      'tripstoptimes', 'triprows'])
+
+  # Set by send_error, so that no JSON is sent after an error page
+  error_sent = False
+
+  def send_error(self, *args, **kwargs):
+    self.error_sent = True
+    BaseHTTPServer.BaseHTTPRequestHandler.send_error(self, *args, **kwargs)
+
   def do_GET(self):
     scheme, host, path, x, params, fragment = urlparse.urlparse(self.path)
     parsed_params = {}
@@ -104,9 +359,23 @@ class ScheduleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
       else:
         parsed_params[k] = ''
 
+    # The handlers use this snapshot so that a request which is being handled
+    # while FeedWatcher reloads the feed finishes with the old schedule
+    self.schedule = self.server.schedule
+    if (self.schedule is None and path != '/json/status' and
+        not path.startswith('/file/')):
+      return self.SendNotReady()
+
     if path == '/':
       return self.handle_GET_home()
 
+    # Tiles may also be requested as /tile/<zoom>/<x>/<y>.json
+    m = re.match(r'/tile/(\d{1,2})/(\d{1,9})/(\d{1,9})\.json$', path)
+    if m:
+      parsed_params.update(zip(('z', 'x', 'y'), m.groups()))
+      return self.handle_json_wrapper_GET(self.handle_json_GET_tile,
+                                          parsed_params)
+
     m = re.match(r'/json/([a-z]{1,64})', path)
     if m:
       handler_name = 'handle_json_GET_%s' % m.group(1)
@@ -118,9 +387,8 @@ class ScheduleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     m = re.match(r'/file/([a-z0-9_-]{1,64}\.?[a-z0-9_-]{1,64})$', path)
     if m and m.group(1):
       try:
-        f, mime_type = self.OpenFile(m.group(1))
-        return self.handle_static_file_GET(f, mime_type)
-      except IOError as e:
+        return self.handle_static_file_GET(m.group(1))
+      except (IOError, OSError) as e:
         print("Error: unable to open %s" % m.group(1))
         # Ignore and treat as 404
 
@@ -133,6 +401,16 @@ class ScheduleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
     return self.handle_GET_default(parsed_params, path)
 
+  def SendNotReady(self):
+    """Tell the client that the feed is still loading."""
+    content = 'The feed is loading, see /json/status for progress.\n'
+    self.send_response(503)
+    self.send_header('Content-Type', 'text/plain')
+    self.send_header('Content-Length', str(len(content)))
+    self.send_header('Retry-After', '5')
+    self.end_headers()
+    self.wfile.write(content)
+
   def OpenFile(self, filename):
     """Try to open filename in the static files directory of this server.
     Return a tuple (file object, string mime_type) or raise an exception."""
@@ -149,19 +427,73 @@ class ScheduleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
   def handle_GET_default(self, parsed_params, path):
     self.send_error(404)
 
-  def handle_static_file_GET(self, fh, mime_type):
-    content = fh.read()
+  def handle_static_file_GET(self, filename):
+    """Send a file of the static files directory, reading it only when it
+    isn't in server.response_cache or has been modified."""
+    stat = os.stat(os.path.join(self.server.file_dir, filename))
+    key = ('file', filename, stat.st_mtime, stat.st_size)
+    response = self.server.response_cache.Get(key)
+    if response is None:
+      f, mime_type = self.OpenFile(filename)
+      try:
+        content = f.read()
+      finally:
+        f.close()
+      etag = '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+      response = CachedResponse(content, mime_type, etag)
+      self.server.response_cache.Set(key, response)
+    self.SendCachedResponse(response, 'max-age=3600')
+
+  def SendCachedResponse(self, response, cache_control):
+    """Send a CachedResponse, or 304 if the client has the same ETag.
+
+    The body is compressed with gzip if the client accepts it.
+    """
+    content = response.content
+    compress = len(content) >= MIN_GZIP_SIZE and self.AcceptsGzip()
+    if compress:
+      etag = response.gzip_etag
+    else:
+      etag = response.etag
+    if self.ClientHasETag(etag):
+      self.SendNotModified(etag, cache_control)
+      return
+    if compress:
+      content = response.GetGzipped()
     self.send_response(200)
-    self.send_header('Content-Type', mime_type)
+    self.send_header('Content-Type', response.content_type)
     self.send_header('Content-Length', str(len(content)))
+    self.send_header('ETag', etag)
+    self.send_header('Cache-Control', cache_control)
+    self.send_header('Vary', 'Accept-Encoding')
+    if compress:
+      self.send_header('Content-Encoding', 'gzip')
     self.end_headers()
     self.wfile.write(content)
 
+  def AcceptsGzip(self):
+    """Return True if the client accepts a gzip encoded body."""
+    return 'gzip' in self.headers.get('Accept-Encoding', '')
+
+  def ClientHasETag(self, etag):
+    """Return True if the If-None-Match request header matches etag."""
+    if_none_match = self.headers.get('If-None-Match')
+    if not if_none_match:
+      return False
+    return any(t.strip() in (etag, '*') for t in if_none_match.split(','))
+
+  def SendNotModified(self, etag, cache_control):
+    self.send_response(304)
+    self.send_header('ETag', etag)
+    self.send_header('Cache-Control', cache_control)
+    self.send_header('Vary', 'Accept-Encoding')
+    self.end_headers()
+
   def AllowEditMode(self):
     return False
 
   def handle_GET_home(self):
-    schedule = self.server.schedule
+    schedule = self.schedule
     (min_lat, min_lon, max_lat, max_lon) = schedule.GetStopBoundingBox()
     forbid_editing = ('true', 'false')[self.AllowEditMode()]
 
@@ -187,8 +519,8 @@ class ScheduleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
   def handle_json_GET_routepatterns(self, params):
     """Given a route_id generate a list of patterns of the route. For each
     pattern include some basic information and a few sample trips."""
-    schedule = self.server.schedule
-    route = schedule.GetRoute(params.get('route', None))
+    schedule = self.schedule
+    route = schedule.routes.get(params.get('route', None))
     if not route:
       self.send_error(404)
       return
@@ -196,70 +528,38 @@ class ScheduleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     date = params.get('date', "")
     sample_size = 3  # For each pattern return the start time for this many trips
 
-    pattern_id_trip_dict = route.GetPatternIdTripDict()
+    pattern_index = route.GetPatternIndex()
     patterns = []
 
-    for pattern_id, trips in pattern_id_trip_dict.items():
-      time_stops = trips[0].GetTimeStops()
-      if not time_stops:
-        continue
-      has_non_zero_trip_type = False;
-
-      # Iterating over a copy so we can remove from trips inside the loop
-      trips_with_service = []
-      for trip in trips:
-        service_id = trip.service_id
-        service_period = schedule.GetServicePeriod(service_id)
-
-        if date and not service_period.IsActiveOn(date):
-          continue
-        trips_with_service.append(trip)
-
-        if trip['trip_type'] and trip['trip_type'] != '0':
-          has_non_zero_trip_type = True
-
-      # We're only interested in the trips that do run on the specified date
-      trips = trips_with_service
+    for pattern_id in pattern_index.GetPatternIds():
+      time_stops = pattern_index.GetTimeStops(pattern_id)
+      # Only the trips that run on the specified date, sorted by start time
+      pattern_trips = pattern_index.GetPatternTrips(pattern_id, date)
 
       name = u'%s to %s, %d stops' % (time_stops[0][2].stop_name, time_stops[-1][2].stop_name, len(time_stops))
-      transitfeed.SortListOfTripByTime(trips)
 
-      num_trips = len(trips)
-      if num_trips <= sample_size:
-        start_sample_index = 0
-        num_after_sample = 0
-      else:
-        # Will return sample_size trips that start after the 'time' param.
-
-        # Linear search because I couldn't find a built-in way to do a binary
-        # search with a custom key.
-        start_sample_index = len(trips)
-        for i, trip in enumerate(trips):
-          if trip.GetStartTime() >= time:
-            start_sample_index = i
-            break
-
-        num_after_sample = num_trips - (start_sample_index + sample_size)
-        if num_after_sample < 0:
-          # Less than sample_size trips start after 'time' so return all the
-          # last sample_size trips.
-          num_after_sample = 0
-          start_sample_index = num_trips - sample_size
-
-      sample = []
-      for t in trips[start_sample_index:start_sample_index + sample_size]:
-        sample.append( (t.GetStartTime(), t.trip_id) )
+      # Returns sample_size trips that start after the 'time' param or, if
+      # less than sample_size trips start after 'time', the last sample_size
+      # trips.
+      start_sample_index, sample, num_after_sample = (
+          pattern_trips.GetSample(time, sample_size))
 
       patterns.append((name, pattern_id, start_sample_index, sample,
-                       num_after_sample, (0,1)[has_non_zero_trip_type]))
+                       num_after_sample,
+                       (0,1)[pattern_trips.has_non_zero_trip_type]))
 
     patterns.sort()
     return patterns
 
   def handle_json_wrapper_GET(self, handler, parsed_params):
     """Call handler and output the return value in JSON."""
-    schedule = self.server.schedule
+    schedule = self.schedule
+    name = handler.__name__[len('handle_json_GET_'):]
+    if name in self.cached_json_handlers:
+      return self.handle_cached_json_GET(name, handler, parsed_params)
     result = handler(parsed_params)
+    if self.error_sent:
+      return
     content = ResultEncoder().encode(result)
     self.send_response(200)
     self.send_header('Content-Type', 'text/plain')
@@ -267,9 +567,40 @@ class ScheduleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     self.end_headers()
     self.wfile.write(content)
 
+  def handle_cached_json_GET(self, name, handler, parsed_params):
+    """Like handle_json_wrapper_GET but reuse responses for the same
+    parameters until the schedule changes."""
+    generation = self.schedule.GetGeneration()
+    etag = '"%s-%d"' % (_ETAG_PREFIX, generation)
+    # Whether the body would be compressed isn't known before it is made, so
+    # accept the ETag of either body the client may have
+    etags = [etag]
+    if self.AcceptsGzip():
+      etags.append(GzipETag(etag))
+    for client_etag in etags:
+      if self.ClientHasETag(client_etag):
+        self.SendNotModified(client_etag, 'no-cache')
+        return
+    key = (name, tuple(sorted(parsed_params.items())), generation)
+    response = self.server.response_cache.Get(key)
+    if response is None:
+      result = handler(parsed_params)
+      if self.error_sent:
+        return
+      response = CachedResponse(ResultEncoder().encode(result), 'text/plain',
+                                etag)
+      self.server.response_cache.Set(key, response)
+    self.SendCachedResponse(response, 'no-cache')
+
+  def handle_json_GET_status(self, params):
+    """Return the progress of loading the feed, see FeedLoader.GetStatus."""
+    if self.server.loader:
+      return self.server.loader.GetStatus()
+    return {'state': 'ready'}
+
   def handle_json_GET_routes(self, params):
     """Return a list of all routes."""
-    schedule = self.server.schedule
+    schedule = self.schedule
     result = []
     for r in schedule.GetRouteList():
       result.append( (r.route_id, r.route_short_name, r.route_long_name) )
@@ -277,14 +608,14 @@ class ScheduleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     return result
 
   def handle_json_GET_routerow(self, params):
-    schedule = self.server.schedule
+    schedule = self.schedule
     route = schedule.GetRoute(params.get('route', None))
     return [transitfeed.Route._FIELD_NAMES, route.GetFieldValuesTuple()]
 
   def handle_json_GET_triprows(self, params):
     """Return a list of rows from the feed file that are related to this
     trip."""
-    schedule = self.server.schedule
+    schedule = self.schedule
     try:
       trip = schedule.GetTrip(params.get('trip', None))
     except KeyError:
@@ -296,7 +627,7 @@ class ScheduleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     return [['trips.txt', trip_row], ['routes.txt', route_row]]
 
   def handle_json_GET_tripstoptimes(self, params):
-    schedule = self.server.schedule
+    schedule = self.schedule
     try:
       trip = schedule.GetTrip(params.get('trip'))
     except KeyError:
@@ -313,7 +644,7 @@ class ScheduleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     return [stops, arrival_times, departure_times]
 
   def handle_json_GET_tripshape(self, params):
-    schedule = self.server.schedule
+    schedule = self.schedule
     try:
       trip = schedule.GetTrip(params.get('trip'))
     except KeyError:
@@ -334,9 +665,115 @@ class ScheduleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
       polyline_data['color'] = '#' + route.route_color
     return polyline_data
 
+  def handle_json_GET_tripsdata(self, params):
+    """Return the stop times and shapes of the comma separated trip_ids in
+    'trips' with a few database queries.
+
+    Stops and shapes used by several trips are included once. Trips refer to
+    them by their offset in the 'stops' and 'shapes' lists. Trips without a
+    shape_id get a line through their stops, shared by trips of the same
+    pattern. With 'encoded' the points of each shape are sent as a string
+    encoded with EncodePolyline instead of a list of [lat, lng] pairs.
+    Unknown trip_ids are listed in 'missing'.
+    """
+    schedule = self.schedule
+    trip_ids = [t for t in params.get('trips', '').split(',') if t]
+    encoded = bool(params.get('encoded'))
+    trips = []
+    missing = []
+    for trip_id in trip_ids:
+      trip = schedule.trips.get(trip_id)
+      if trip is None:
+        missing.append(trip_id)
+      else:
+        trips.append(trip)
+    all_time_stops = schedule.GetTimeStopsOfTrips(t.trip_id for t in trips)
+
+    stops = []
+    stop_offsets = {}
+    shapes = []
+    shape_offsets = {}
+    trips_data = []
+    for trip in trips:
+      time_stops = all_time_stops[trip.trip_id]
+      trip_stops = []
+      for arr, dep, stop in time_stops:
+        offset = stop_offsets.get(stop.stop_id)
+        if offset is None:
+          offset = stop_offsets[stop.stop_id] = len(stops)
+          stops.append(StopToTuple(stop))
+        trip_stops.append(offset)
+
+      # A trip whose route is missing is drawn without the route_color
+      route = schedule.routes.get(trip.route_id)
+      color = route and route.route_color
+      shape = None
+      if trip.shape_id:
+        try:
+          shape = schedule.GetShape(trip.shape_id)
+        except KeyError:
+          pass
+      if shape:
+        shape_key = ('shape', trip.shape_id, color)
+      else:
+        shape_key = ('pattern', trip.pattern_id, color)
+      shape_offset = shape_offsets.get(shape_key)
+      if shape_offset is None:
+        if shape:
+          points = [(lat, lon) for (lat, lon, dist) in shape.points]
+        else:
+          points = [(stop.stop_lat, stop.stop_lon)
+                    for arr, dep, stop in time_stops]
+        shape_data = {}
+        if encoded:
+          shape_data['encoded'] = transitfeed.EncodePolyline(points)
+        else:
+          shape_data['points'] = points
+        if color:
+          shape_data['color'] = '#' + color
+        shape_offset = shape_offsets[shape_key] = len(shapes)
+        shapes.append(shape_data)
+
+      trips_data.append({'trip_id': trip.trip_id,
+                         'stops': trip_stops,
+                         'arrival_times': [ts[0] for ts in time_stops],
+                         'departure_times': [ts[1] for ts in time_stops],
+                         'shape': shape_offset})
+    return {'stops': stops, 'shapes': shapes, 'trips': trips_data,
+            'missing': missing}
+
+  def handle_json_GET_tile(self, params):
+    """Return the stops and shapes in the map tile 'z', 'x', 'y'.
+
+    Stops closer than a few pixels to each other are thinned and shapes are
+    simplified to the resolution of the tile, so a tile covering a whole feed
+    stays small."""
+    schedule = self.schedule
+    try:
+      zoom = int(params.get('z'))
+      x = int(params.get('x'))
+      y = int(params.get('y'))
+    except (TypeError, ValueError):
+      self.send_error(400)
+      return
+    if not (0 <= zoom <= 30 and 0 <= x < (1 << zoom) and 0 <= y < (1 << zoom)):
+      self.send_error(404)
+      return
+    tile_index = schedule.GetTileIndex()
+    shapes = []
+    for shape_id, color, points in tile_index.GetTileShapes(zoom, x, y):
+      polyline_data = {'shape_id': shape_id,
+                       'points': [(round(lat, 6), round(lng, 6))
+                                  for lat, lng in points]}
+      if color:
+        polyline_data['color'] = '#' + color
+      shapes.append(polyline_data)
+    stops = [StopToTuple(s) for s in tile_index.GetTileStops(zoom, x, y)]
+    return {'stops': stops, 'shapes': shapes}
+
   def handle_json_GET_neareststops(self, params):
     """Return a list of the nearest 'limit' stops to 'lat', 'lon'"""
-    schedule = self.server.schedule
+    schedule = self.schedule
     lat = float(params.get('lat'))
     lon = float(params.get('lon'))
     limit = int(params.get('limit'))
@@ -347,7 +784,7 @@ class ScheduleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     """Return a list of up to 'limit' stops within bounding box with 'n','e'
     and 's','w' in the NE and SW corners. Does not handle boxes crossing
     longitude line 180."""
-    schedule = self.server.schedule
+    schedule = self.schedule
     n = float(params.get('n'))
     e = float(params.get('e'))
     s = float(params.get('s'))
@@ -357,44 +794,28 @@ class ScheduleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     return [StopToTuple(s) for s in stops]
 
   def handle_json_GET_stopsearch(self, params):
-    schedule = self.server.schedule
-    query = params.get('q', None).lower()
+    """Return up to 'limit' stops matching the text 'q', best match first."""
+    schedule = self.schedule
+    query = params.get('q', '')
+    limit = int(params.get('limit', 100))
     matches = []
-    for s in schedule.GetStopList():
-      if s.stop_id.lower().find(query) != -1 or s.stop_name.lower().find(query) != -1:
-        matches.append(StopToTuple(s))
+    for s in schedule.GetStopSearchIndex().Search(query, limit=limit):
+      matches.append(StopToTuple(s))
     return matches
 
   def handle_json_GET_stoptrips(self, params):
     """Given a stop_id and time in seconds since midnight return the next
     trips to visit the stop."""
-    schedule = self.server.schedule
+    schedule = self.schedule
     stop = schedule.GetStop(params.get('stop', None))
     time = int(params.get('time', 0))
     date = params.get('date', "")
 
-    time_trips = stop.GetStopTimeTrips(schedule)
-    time_trips.sort()  # OPT: use bisect.insort to make this O(N*ln(N)) -> O(N)
-    # Keep the first 5 after param 'time'.
-    # Need make a tuple to find correct bisect point
-    time_trips = time_trips[bisect.bisect_left(time_trips, (time, 0)):]
-    time_trips = time_trips[:5]
     # TODO: combine times for a route to show next 2 departure times
     result = []
-    for time, (trip, index), tp in time_trips:
-      service_id = trip.service_id
-      service_period = schedule.GetServicePeriod(service_id)
-      if date and not service_period.IsActiveOn(date):
-        continue
-      headsign = None
-      # Find the most recent headsign from the StopTime objects
-      for stoptime in trip.GetStopTimes()[index::-1]:
-        if stoptime.stop_headsign:
-          headsign = stoptime.stop_headsign
-          break
-      # If stop_headsign isn't found, look for a trip_headsign
-      if not headsign:
-        headsign = trip.trip_headsign
+    departures = schedule.GetDepartureIndex().GetDepartures(
+        stop.stop_id, time=time, date=date, limit=5)
+    for time, trip, index, tp, headsign in departures:
       route = schedule.GetRoute(trip.route_id)
       trip_name = ''
       if route.route_short_name:
@@ -412,38 +833,38 @@ class ScheduleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
   def handle_GET_ttablegraph(self,params):
     """Draw a Marey graph in SVG for a pattern (collection of trips in a route
     that visit the same sequence of stops)."""
-    schedule = self.server.schedule
-    marey = MareyGraph()
-    trip = schedule.GetTrip(params.get('trip', None))
-    route = schedule.GetRoute(trip.route_id)
+    schedule = self.schedule
+    trip = schedule.trips.get(params.get('trip', None))
     height = int(params.get('height', 300))
+    route = trip and schedule.routes.get(trip.route_id)
 
     if not route:
       print('no such route')
       self.send_error(404)
       return
 
-    pattern_id_trip_dict = route.GetPatternIdTripDict()
+    pattern_index = route.GetPatternIndex()
     pattern_id = trip.pattern_id
-    if pattern_id not in pattern_id_trip_dict:
-      print('no pattern %s found in %s' % (pattern_id, pattern_id_trip_dict.keys()))
+    if pattern_id not in pattern_index.GetPatternIds():
+      print('no pattern %s found in %s' % (pattern_id,
+                                           pattern_index.GetPatternIds()))
       self.send_error(404)
       return
-    triplist = pattern_id_trip_dict[pattern_id]
-
-    pattern_start_time = min((t.GetStartTime() for t in triplist))
-    pattern_end_time = max((t.GetEndTime() for t in triplist))
 
-    marey.SetSpan(pattern_start_time,pattern_end_time)
-    marey.Draw(triplist[0].GetPattern(), triplist, height)
-
-    content = marey.Draw()
-
-    self.send_response(200)
-    self.send_header('Content-Type', 'image/svg+xml')
-    self.send_header('Content-Length', str(len(content)))
-    self.end_headers()
-    self.wfile.write(content)
+    # The graph only depends on the pattern, the height and the schedule so
+    # it is shared by all trips of the pattern
+    generation = schedule.GetGeneration()
+    etag = '"%s-%d"' % (_ETAG_PREFIX, generation)
+    key = ('ttablegraph', route.route_id, pattern_id, height, generation)
+    response = self.server.response_cache.Get(key)
+    if response is None:
+      timetable = pattern_index.GetTimetable(pattern_id)
+      marey = MareyGraph()
+      marey.SetSpan(timetable.start_time or 0, timetable.end_time or 0)
+      marey.Draw(timetable=timetable, height=height)
+      response = CachedResponse(marey.Draw(), 'image/svg+xml', etag)
+      self.server.response_cache.Set(key, response)
+    self.SendCachedResponse(response, 'no-cache')
 
 
 def FindPy2ExeBase():
@@ -509,10 +930,31 @@ https://github.com/google/transitfeed/wiki/ScheduleViewer
   parser.add_option('-n', '--noprompt', action='store_false',
                     dest='manual_entry',
                     help='disable interactive prompts')
+  parser.add_option('--threads', dest='threads', type='int',
+                    help='number of threads handling requests, or 0 to '
+                    'handle one request at a time')
+  parser.add_option('--cache_size', dest='cache_size', type='int',
+                    help='number of responses kept in memory, or 0 to '
+                    'disable the cache')
+  parser.add_option('--background_load', dest='background_load',
+                    action='store_true',
+                    help='start serving at once and load the feed in the '
+                    'background, reporting progress at /json/status')
+  parser.add_option('--watch', dest='watch', action='store_true',
+                    help='reload the feed without restarting when the feed '
+                    'file changes')
+  parser.add_option('--watch_interval', dest='watch_interval', type='float',
+                    help='seconds between checks of the feed file with '
+                    '--watch')
   parser.set_defaults(port=8765,
                       host='maps.google.com',
                       file_dir=FindDefaultFileDir(),
-                      manual_entry=True)
+                      manual_entry=True,
+                      threads=4,
+                      cache_size=256,
+                      background_load=False,
+                      watch=False,
+                      watch_interval=5.0)
   (options, args) = parser.parse_args()
 
   if not os.path.isfile(os.path.join(options.file_dir, 'index.html')):
@@ -538,18 +980,42 @@ https://github.com/google/transitfeed/wiki/ScheduleViewer
 
   util.CheckVersion(transitfeed.ProblemReporter())
 
-  schedule = transitfeed.Schedule(problem_reporter=transitfeed.ProblemReporter())
-  print('Loading data from feed "%s"...' % options.feed_filename)
-  print('(this may take a few minutes for larger cities)')
-  schedule.Load(options.feed_filename)
-
-  server = StoppableHTTPServer(server_address=('', options.port),
-                               RequestHandlerClass=RequestHandlerClass)
+  if options.background_load:
+    schedule = None
+  else:
+    schedule = transitfeed.Schedule(
+        problem_reporter=transitfeed.ProblemReporter())
+    print('Loading data from feed "%s"...' % options.feed_filename)
+    print('(this may take a few minutes for larger cities)')
+    schedule.Load(options.feed_filename)
+
+  if options.threads > 0:
+    if schedule:
+      schedule.MakeThreadSafe()
+    server = ThreadPoolHTTPServer(server_address=('', options.port),
+                                  RequestHandlerClass=RequestHandlerClass,
+                                  num_threads=options.threads)
+  else:
+    server = StoppableHTTPServer(server_address=('', options.port),
+                                 RequestHandlerClass=RequestHandlerClass)
   server.key = options.key
   server.schedule = schedule
   server.file_dir = options.file_dir
   server.host = options.host
   server.feed_path = options.feed_filename
+  server.response_cache = util.LruCache(options.cache_size)
+  server.loader = None
+  server.watcher = None
+  if options.watch:
+    server.watcher = FeedWatcher(server, options.feed_filename,
+                                 interval=options.watch_interval)
+  if options.background_load:
+    server.loader = FeedLoader(server, options.feed_filename)
+    print('Loading data from feed "%s" in the background...' %
+          options.feed_filename)
+    server.loader.Start()
+  if server.watcher:
+    server.watcher.Start()
 
   print ("To view, point your browser at http://localhost:%d/" %
          (server.server_port))
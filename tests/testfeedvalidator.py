@@ -20,6 +20,7 @@
 from __future__ import absolute_import
 import datetime
 import feedvalidator
+import json
 import os.path
 import re
 from tests import util
@@ -284,6 +285,9 @@ class MockOptions:
     self.service_gap_interval = None
     self.extension = None
     self.error_types_ignore_list = None
+    self.phase_stats = None
+    self.progress = False
+    self.output_format = 'html'
 
 
 class FeedValidatorTestCase(util.TempDirTestCaseBase):
@@ -306,6 +310,60 @@ class FeedValidatorTestCase(util.TempDirTestCaseBase):
         new_zipfile_mem, options, output_file)
     self.assertMatchesRegex(filename, output_file.getvalue())
 
+  def testPhaseStats(self):
+    options = MockOptions()
+    options.phase_stats = 'phase-stats.json'
+    feedvalidator.RunValidationOutputToFile(
+        self.GetPath('tests', 'data', 'good_feed.zip'), options, StringIO())
+    phases = json.load(open('phase-stats.json'))
+    names = [p['name'] for p in phases]
+    self.assertTrue('stop_times.txt' in names)
+    self.assertTrue('ValidateTrips' in names)
+
+
+class JsonLinesProblemAccumulatorTestCase(util.TestCase):
+  def testBatchedOutput(self):
+    output = StringIO()
+    accumulator = feedvalidator.JsonLinesProblemAccumulator(
+        output, ignore_types=['UnusedStop'], batch_size=2)
+    problems = transitfeed.ProblemReporter(accumulator)
+    problems.SetFileContext('stops.txt', 3, ['s1', 'bad'], ['stop_id', 'x'])
+    problems.InvalidValue('stop_lat', 'bad', 'Not a number')
+    self.assertEquals('', output.getvalue())
+    problems.ClearContext()
+    problems.UnusedStop('s1', 'Stop 1')
+    problems.OtherProblem('\xff not utf-8', type=transitfeed.TYPE_WARNING)
+    lines = output.getvalue().splitlines()
+    self.assertEquals(2, len(lines))
+    invalid_value = json.loads(lines[0])
+    self.assertEquals('InvalidValue', invalid_value['class'])
+    self.assertEquals('error', invalid_value['type'])
+    self.assertEquals('stops.txt', invalid_value['file'])
+    self.assertEquals(3, invalid_value['row'])
+    self.assertEquals({'column_name': 'stop_lat', 'value': 'bad',
+                       'reason': 'Not a number'}, invalid_value['fields'])
+    other = json.loads(lines[1])
+    self.assertEquals('warning', other['type'])
+    self.assertEquals(None, other['file'])
+    problems.OtherProblem('last')
+    accumulator.Flush()
+    self.assertEquals(3, len(output.getvalue().splitlines()))
+    self.assertEquals(2, accumulator.ErrorCount())
+    self.assertEquals(1, accumulator.WarningCount())
+
+
+class JsonLinesOutputTestCase(util.TempDirTestCaseBase):
+  def testGoodFeed(self):
+    options = MockOptions()
+    options.output_format = 'jsonl'
+    exit_code = feedvalidator.RunValidationOutputToJsonLines(
+        self.GetPath('tests', 'data', 'good_feed.zip'), options,
+        'validation-results.jsonl')
+    problems = [json.loads(line)
+                for line in open('validation-results.jsonl')]
+    self.assertEquals(1, exit_code)
+    self.assertEquals(['ExpirationDate'], [p['class'] for p in problems])
+
 
 class LimitPerTypeProblemReporterTestCase(util.TestCase):
 
@@ -418,6 +476,37 @@ class LimitPerTypeProblemReporterTestCase(util.TestCase):
     self.assertProblemsAttribute(transitfeed.TYPE_WARNING,
         "StopsTooClose", "stop_id_a", "sa5 sa4 sa3")
 
+  def testOverLimitProblemsAreNotBuilt(self):
+    self.problems = self.CreateLimitPerTypeProblemReporter(2)
+    self.accumulator = self.problems.GetAccumulator()
+    built = []
+    original_report = self.accumulator._Report
+    def RecordingReport(e):
+      built.append(e.value)
+      original_report(e)
+    self.accumulator._Report = RecordingReport
+    for i in range(10):
+      self.problems.InvalidValue("stop_lat", "v%d" % i)
+    # Adding the second problem shows the exceptions can't be compared so
+    # once the list is full no problem is built but each is still counted.
+    self.assertEquals(["v0", "v1"], built)
+    self.assertEquals(10, self.accumulator.ErrorCount())
+    bounded_list = self.accumulator.ProblemList(
+        transitfeed.TYPE_ERROR, "InvalidValue")
+    self.assertEquals(8, bounded_list.dropped_count)
+    self.assertProblemsAttribute(transitfeed.TYPE_ERROR, "InvalidValue",
+        "value", "v0 v1")
+
+  def testIgnoredProblemsAreNotBuilt(self):
+    accumulator = feedvalidator.LimitPerTypeProblemAccumulator(
+        5, ignore_types=["InvalidValue"])
+    def FailingReport(e):
+      self.fail("%s was built" % e.__class__.__name__)
+    accumulator._Report = FailingReport
+    problems = transitfeed.ProblemReporter(accumulator)
+    problems.InvalidValue("stop_lat", "x")
+    self.assertEquals(0, accumulator.ErrorCount())
+
 
 if __name__ == '__main__':
   unittest.main()
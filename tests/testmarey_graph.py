@@ -0,0 +1,66 @@
+#!/usr/bin/python2.5
+
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the gtfsscheduleviewer.marey_graph module."""
+from __future__ import absolute_import
+
+from gtfsscheduleviewer.marey_graph import MareyGraph
+from tests import util
+import transitfeed
+
+
+class TravelTimesTestCase(util.TestCase):
+
+  def testUntimedStops(self):
+    # An untimed stop used to count as 0 seconds since midnight, making the
+    # gap to the next station as large as the time of day
+    timetable = transitfeed.PatternTimetable(
+        [], [None], [[36000, None, 36600, 36500]],
+        [[36060, None, 36660, 36500]])
+    self.assertEquals([MareyGraph._DUMMY_SEPARATOR,
+                       MareyGraph._DUMMY_SEPARATOR,
+                       MareyGraph._DUMMY_SEPARATOR],
+                      MareyGraph()._TravelTimes(timetable))
+
+  def testTimedStops(self):
+    timetable = transitfeed.PatternTimetable(
+        [], [None, None], [[0, 100, 400], [0, 200, 300]],
+        [[50, 150, 400], [0, 200, 300]])
+    self.assertEquals([50, 250], MareyGraph()._TravelTimes(timetable))
+    self.assertEquals([200, 100], MareyGraph()._TravelTimes(timetable, 1))
+
+  def testNoTrips(self):
+    timetable = transitfeed.PatternTimetable([], [], [], [])
+    self.assertEquals([], MareyGraph()._TravelTimes(timetable))
+
+
+class DrawTestCase(util.TestCase):
+
+  def testDrawTrips(self):
+    schedule = transitfeed.Loader(
+        util.DataPath('good_feed'),
+        problems=util.GetTestFailureProblemReporter(self)).Load()
+    trips = [schedule.GetTrip('CITY1'), schedule.GetTrip('CITY2')]
+    marey = MareyGraph()
+    svg = marey.Draw(triplist=trips)
+    self.assertTrue('id="CITY1"' in svg)
+    self.assertTrue('id="CITY2"' in svg)
+    # Stations spaced by the travel times of CITY1, 5 minutes between each
+    # departure and the next arrival
+    stations = marey._stations
+    self.assertEquals(5, len(stations))
+    gaps = [b - a for a, b in zip(stations, stations[1:])]
+    self.assertTrue(max(gaps) - min(gaps) <= 1)
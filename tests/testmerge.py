@@ -20,8 +20,11 @@ from __future__ import print_function
 
 __author__ = 'timothy.stranex@gmail.com (Timothy Stranex)'
 
+import datetime
+import json
 import merge
 import os.path
+import random
 import re
 from tests import util
 import transitfeed
@@ -143,6 +146,38 @@ class TestApproximateDistanceBetweenPoints(util.TestCase):
     self.assert_(merge.ApproximateDistanceBetweenPoints(p1, p2) > 1e4)
 
 
+class TestFindStopPairsWithinDistance(util.TestCase):
+
+  def _BruteForcePairs(self, a_stops, b_stops, distance):
+    pairs = []
+    for a in a_stops:
+      for b in b_stops:
+        d = transitfeed.ApproximateDistanceBetweenStops(a, b)
+        if d <= distance:
+          pairs.append((d, a.stop_id, b.stop_id))
+    return sorted(pairs)
+
+  def testSameAsComparingAllPairs(self):
+    rand = random.Random(42)
+    for lat in (0.0, 47.0, -70.0):
+      a_stops = [transitfeed.Stop(lat + rand.uniform(0, 0.01),
+                                  rand.uniform(-0.01, 0.01), stop_id='a%d' % i)
+                 for i in range(200)]
+      b_stops = [transitfeed.Stop(lat + rand.uniform(0, 0.01),
+                                  rand.uniform(-0.01, 0.01), stop_id='b%d' % i)
+                 for i in range(200)]
+      for distance in (10.0, 50.0):
+        pairs = merge.FindStopPairsWithinDistance(a_stops, b_stops, distance)
+        self.assertEquals(self._BruteForcePairs(a_stops, b_stops, distance),
+                          [(d, a.stop_id, b.stop_id) for d, a, b in pairs])
+
+  def testStopsWithoutLocation(self):
+    a = transitfeed.Stop(30.0, 30.0, stop_id='a')
+    b = transitfeed.Stop(stop_id='b')
+    self.assertEquals([], merge.FindStopPairsWithinDistance([a], [b], 10.0))
+    self.assertEquals([], merge.FindStopPairsWithinDistance([], [a], 10.0))
+
+
 class TestSchemedMerge(util.TestCase):
 
   class TestEntity:
@@ -331,6 +366,48 @@ class TestFeedMerger(util.TestCase):
     self.assert_(not self.fm.MergeSchedules())
     self.assertEquals(self.called, range(6))
 
+  def _AddDependentMergers(self, should_fail=None):
+    """Add mergers 3 to 0 where 2 depends on 0 and 3 depends on 1 and 2."""
+    class Merger0(TestFeedMerger.Merger):
+      pass
+
+    class Merger1(TestFeedMerger.Merger):
+      pass
+
+    class Merger2(TestFeedMerger.Merger):
+      DEPENDENCIES = (Merger0,)
+
+    class Merger3(TestFeedMerger.Merger):
+      DEPENDENCIES = (Merger1, Merger2)
+
+    for n, cls in reversed(list(enumerate([Merger0, Merger1, Merger2,
+                                           Merger3]))):
+      self.fm.AddMerger(cls(self, n, n == should_fail))
+
+  def testDependencies(self):
+    self._AddDependentMergers()
+    self.assert_(self.fm.MergeSchedules())
+    # Otherwise in the order the mergers were added
+    self.assertEquals([1, 0, 2, 3], self.called)
+
+  def testDependencies_StopsAfterError(self):
+    self._AddDependentMergers(should_fail=0)
+    self.assert_(not self.fm.MergeSchedules())
+    self.assertEquals([1, 0], self.called)
+
+  def testDependencyCycle(self):
+    class MergerA(TestFeedMerger.Merger):
+      pass
+
+    class MergerB(TestFeedMerger.Merger):
+      DEPENDENCIES = (MergerA,)
+
+    MergerA.DEPENDENCIES = (MergerB,)
+    self.fm.AddMerger(MergerA(self, 0))
+    self.fm.AddMerger(MergerB(self, 1))
+    self.assertRaises(LookupError, self.fm.MergeSchedules)
+    self.assertEquals([], self.called)
+
   def testRegister(self):
     s1 = transitfeed.Stop(stop_id='1')
     s2 = transitfeed.Stop(stop_id='2')
@@ -405,6 +482,165 @@ class TestFeedMerger(util.TestCase):
   def testGetMerger_Error(self):
     self.assertRaises(LookupError, self.fm.GetMerger, TestFeedMerger.Merger)
 
+  def testProgress(self):
+    reports = []
+    def Callback(name, count, total, rate, finished):
+      reports.append((name, count, total, finished))
+    progress = transitfeed.ProgressReporter(Callback, update_every=1,
+                                            min_interval=0)
+    a_schedule = transitfeed.Schedule()
+    for i in range(3):
+      a_schedule.AddAgency('agency %d' % i, 'http://agency',
+                           'Africa/Johannesburg', agency_id='agency_%d' % i)
+    accumulator = TestingProblemAccumulator()
+    feed_merger = merge.FeedMerger(a_schedule, transitfeed.Schedule(),
+                                   transitfeed.Schedule(),
+                                   TestingProblemReporter(accumulator),
+                                   progress)
+    feed_merger.AddMerger(merge.AgencyMerger(feed_merger))
+    self.assert_(feed_merger.MergeSchedules())
+    self.assertEquals([('AgencyMerger', 1, 3, False),
+                       ('AgencyMerger', 2, 3, False),
+                       ('AgencyMerger', 3, 3, False),
+                       ('AgencyMerger', 3, 3, True)], reports)
+
+  def testProgressEndedOnFailure(self):
+    reports = []
+    def Callback(name, count, total, rate, finished):
+      reports.append((name, finished))
+    progress = transitfeed.ProgressReporter(Callback, update_every=1,
+                                            min_interval=0)
+    class FailingMerger(merge.DataSetMerger):
+      def MergeDataSets(self):
+        return False
+    feed_merger = merge.FeedMerger(transitfeed.Schedule(),
+                                   transitfeed.Schedule(),
+                                   transitfeed.Schedule(),
+                                   TestingProblemReporter(
+                                       TestingProblemAccumulator()),
+                                   progress)
+    feed_merger.AddMerger(FailingMerger(feed_merger))
+    feed_merger.AddMerger(merge.AgencyMerger(feed_merger))
+    self.assertFalse(feed_merger.MergeSchedules())
+    self.assertEquals([('FailingMerger', True)], reports)
+
+
+class TestIdAllocator(util.TestCase):
+
+  def setUp(self):
+    self.a_schedule = transitfeed.Schedule()
+    self.a_schedule.AddStopObject(
+        transitfeed.Stop(30.0, 30.0, stop_id='stop7'))
+    self.b_schedule = transitfeed.Schedule()
+    self.b_schedule.AddStopObject(
+        transitfeed.Stop(30.0, 30.0, stop_id='stop12x'))
+    self.b_schedule.AddServicePeriodObject(
+        transitfeed.ServicePeriod('week42'), validate=False)
+    self.allocator = merge.IdAllocator([self.a_schedule, self.b_schedule])
+
+  def testAllocateScansOnlyTheKind(self):
+    self.assertEquals('s_merged_8', self.allocator.Allocate('s', 'stop_id'))
+    self.assertEquals('s_merged_43',
+                      self.allocator.Allocate('s', 'service_id'))
+    self.assertEquals('s_merged_44', self.allocator.Allocate('s', 'stop_id'))
+
+  def testAllocateAnyKind(self):
+    self.assertEquals('merged_43', self.allocator.Allocate())
+
+  def testAllocateNumbers(self):
+    self.assertEquals(8, self.allocator.AllocateNumbers(3, 'stop_id'))
+    self.assertEquals(10, self.allocator.GetLastNumber())
+    self.assertEquals('x_merged_11', self.allocator.Allocate('x', 'stop_id'))
+
+  def testSkipTo(self):
+    self.allocator.SkipTo(100)
+    self.assertEquals('x_merged_101', self.allocator.Allocate('x', 'stop_id'))
+    self.allocator.SkipTo(50)
+    self.assertEquals('x_merged_102', self.allocator.Allocate('x', 'stop_id'))
+
+
+class TestMultiFeedMerger(util.TestCase):
+
+  def setUp(self):
+    self.accumulator = TestingProblemAccumulator()
+    self.accumulator.ExpectProblemClass(merge.MergeNotImplemented)
+    self.accumulator.ExpectProblemClass(merge.SameIdButNotMerged)
+    self.problem_reporter = TestingProblemReporter(self.accumulator)
+
+  def _CreateSchedules(self, count):
+    """Return count schedules with the same agency and a stop 'shared' which
+    is at a different location in each schedule."""
+    schedules = []
+    for i in range(count):
+      schedule = transitfeed.Schedule()
+      schedule.AddAgency('agency', 'http://agency', 'Africa/Johannesburg',
+                         agency_id='agency')
+      schedule.AddStop(30.0 + i, 30.0, 'shared', stop_id='shared')
+      schedule.AddStop(30.0 + i, 31.0, 'stop %d' % i, stop_id='stop_%d' % i)
+      schedules.append(schedule)
+    return schedules
+
+  def testMergeSchedules(self):
+    schedules = self._CreateSchedules(5)
+    multi_feed_merger = merge.MultiFeedMerger(schedules,
+                                              self.problem_reporter)
+    self.assert_(multi_feed_merger.MergeSchedules())
+    merged_schedule = multi_feed_merger.GetMergedSchedule()
+    self.assertEquals(1, len(merged_schedule.GetAgencyList()))
+    stops = merged_schedule.GetStopList()
+    self.assertEquals(10, len(stops))
+    self.assertEquals(10, len(set(stop.stop_id for stop in stops)))
+    self.assertEquals(
+        ['stop_%d' % i for i in range(5)],
+        sorted(s.stop_id for s in stops if s.stop_name.startswith('stop')))
+    # 5 feeds are merged in 3 rounds with 4 pairwise merges
+    feed_mergers = multi_feed_merger.GetFeedMergerList()
+    self.assertEquals(4, len(feed_mergers))
+    self.assertEquals([([0], [1]), ([2], [3]), ([0, 1], [2, 3]),
+                       ([0, 1, 2, 3], [4])],
+                      [multi_feed_merger.GetFeedMergerInputs(feed_merger)
+                       for feed_merger in feed_mergers])
+
+  def testNewestFeedIsNewSchedule(self):
+    schedules = self._CreateSchedules(3)
+    multi_feed_merger = merge.MultiFeedMerger(schedules,
+                                              self.problem_reporter)
+    self.assert_(multi_feed_merger.MergeSchedules())
+    last_merger = multi_feed_merger.GetFeedMergerList()[-1]
+    self.assert_(last_merger.b_schedule is schedules[2])
+    # The only stop keeping the id 'shared' is the one of the newest feed
+    merged_schedule = multi_feed_merger.GetMergedSchedule()
+    self.assertEquals(32.0, merged_schedule.GetStop('shared').stop_lat)
+
+  def testGeneratedIdsUnique(self):
+    schedules = self._CreateSchedules(4)
+    multi_feed_merger = merge.MultiFeedMerger(schedules,
+                                              self.problem_reporter)
+    self.assert_(multi_feed_merger.MergeSchedules())
+    # The counter is shared by the merges so the generated ids of the first
+    # round don't repeat in the second
+    generated = [s.stop_id for s in
+                 multi_feed_merger.GetMergedSchedule().GetStopList()
+                 if '_merged_' in s.stop_id]
+    numbers = [int(stop_id[stop_id.rfind('_') + 1:]) for stop_id in generated]
+    self.assertEquals(len(numbers), len(set(numbers)))
+
+  def testSingleSchedule(self):
+    schedules = self._CreateSchedules(1)
+    multi_feed_merger = merge.MultiFeedMerger(schedules,
+                                              self.problem_reporter)
+    self.assert_(multi_feed_merger.MergeSchedules())
+    self.assert_(multi_feed_merger.GetMergedSchedule() is schedules[0])
+    self.assertEquals([], multi_feed_merger.GetFeedMergerList())
+
+  def testConfigureMerger(self):
+    configured = []
+    multi_feed_merger = merge.MultiFeedMerger(
+        self._CreateSchedules(3), self.problem_reporter,
+        configure_merger=configured.append)
+    self.assert_(multi_feed_merger.MergeSchedules())
+    self.assertEquals(multi_feed_merger.GetFeedMergerList(), configured)
+
 
 class TestServicePeriodMerger(util.TestCase):
 
@@ -448,6 +684,56 @@ class TestServicePeriodMerger(util.TestCase):
                         '20080101', '20090101')
     self.assert_(not self.spm.CheckDisjointCalendars())
 
+  def testCheckDisjoint_OverlappingRangesDifferentDays(self):
+    self._AddTwoPeriods('20080101', '20080301',
+                        '20080101', '20080301')
+    self.sp1.day_of_week = [True] * 5 + [False] * 2
+    self.sp2.day_of_week = [False] * 5 + [True] * 2
+    self.assert_(self.spm.CheckDisjointCalendars())
+
+  def testCheckDisjoint_RemovedDate(self):
+    # 20080105 is a Saturday
+    self._AddTwoPeriods('20071201', '20080105',
+                        '20080105', '20080301')
+    self.assertEquals(['20080105'], self.spm.GetOverlappingDates())
+    self.sp2.SetDateHasService('20080105', False)
+    self.assert_(self.spm.CheckDisjointCalendars())
+
+  def testCheckDisjoint_AddedDate(self):
+    self._AddTwoPeriods('20071213', '20071231',
+                        '20080101', '20080201')
+    self.sp2.SetDateHasService('20071225')
+    self.sp2.SetDateHasService('20071126')
+    self.assertEquals(['20071225'], self.spm.GetOverlappingDates())
+
+  def testGetOverlappingDates_MatchesActiveDates(self):
+    random.seed(45)
+    for i in range(5):
+      for schedule in (self.fm.a_schedule, self.fm.b_schedule):
+        start = datetime.date(2008, 1, 1) + datetime.timedelta(
+            random.randint(0, 60))
+        end = start + datetime.timedelta(random.randint(0, 60))
+        service_period = transitfeed.ServicePeriod(
+            '%s_%d' % (id(schedule), i))
+        service_period.SetStartDate(start.strftime('%Y%m%d'))
+        service_period.SetEndDate(end.strftime('%Y%m%d'))
+        for day in range(7):
+          service_period.SetDayOfWeekHasService(day, random.random() < 0.3)
+        for j in range(5):
+          date = datetime.date(2008, 1, 1) + datetime.timedelta(
+              random.randint(0, 120))
+          service_period.SetDateHasService(date.strftime('%Y%m%d'),
+                                           random.random() < 0.5)
+        schedule.AddServicePeriodObject(service_period, validate=False)
+    a_dates = set()
+    for service_period in self.fm.a_schedule.GetServicePeriodList():
+      a_dates.update(service_period.ActiveDates())
+    b_dates = set()
+    for service_period in self.fm.b_schedule.GetServicePeriodList():
+      b_dates.update(service_period.ActiveDates())
+    self.assertEquals(sorted(a_dates & b_dates),
+                      self.spm.GetOverlappingDates())
+
   def testDisjoinCalendars(self):
     self._AddTwoPeriods('20071213', '20080201',
                         '20080101', '20080301')
@@ -498,6 +784,11 @@ class TestServicePeriodMerger(util.TestCase):
     self.accumulator.ExpectProblemClass(merge.CalendarsNotDisjoint)
     self.assertEquals(self.spm.MergeDataSets(), False)
     self.accumulator.assertExpectedProblemsReported(self)
+    problem = self.accumulator.problems[0]
+    self.assert_(problem.FormatProblem().endswith(
+        'Both feeds have service on 20080101, 20080102, 20080103, 20080104, '
+        '20080105, 20080106, 20080107, 20080108, 20080109, 20080110 and 357 '
+        'more dates.'))
 
   def testMerge_NotRequiredAndNotDisjoint(self):
     self._AddTwoPeriods('20070101', '20090101',
@@ -649,6 +940,37 @@ class TestStopMerger(util.TestCase):
     # check that the zone_id is preserved
     self.assertEquals(self.fm.a_merge_map[self.s1].zone_id, self.s1.zone_id)
 
+  def testMergeByLocation(self):
+    self.s2.stop_name = self.s1.stop_name
+    self.s2.stop_lat = 30.00005
+    # A stop with the same name further away
+    s3 = transitfeed.Stop(30.0001, 30.0, self.s1.stop_name, 's3')
+    s3.zone_id = 'zone1'
+    self.fm.a_schedule.AddStopObject(self.s1)
+    self.fm.b_schedule.AddStopObject(s3)
+    self.fm.b_schedule.AddStopObject(self.s2)
+    self.sm.SetMatchByLocation(True)
+    self.sm.SetLargestStopDistance(20.0)
+    self.fm.MergeSchedules()
+
+    merged_schedule = self.fm.GetMergedSchedule()
+    self.assertEquals(len(merged_schedule.GetStopList()), 2)
+    self.assertEquals(self.fm.a_merge_map[self.s1],
+                      self.fm.b_merge_map[self.s2])
+    self.assertEquals(self.fm.a_merge_map[self.s1].stop_id, 's2')
+    self.assertEquals(self.fm.b_merge_map[s3].stop_id, 's3')
+    self.assertEquals(self.sm.GetMergeStats(), (1, 0, 1))
+
+  def testMergeByLocation_TooFar(self):
+    self.s2.stop_name = self.s1.stop_name
+    self.s2.stop_lat = 30.001
+    self.fm.a_schedule.AddStopObject(self.s1)
+    self.fm.b_schedule.AddStopObject(self.s2)
+    self.sm.SetMatchByLocation(True)
+    self.fm.MergeSchedules()
+    self.assertEquals(len(self.fm.GetMergedSchedule().GetStopList()), 2)
+    self.assertEquals(self.sm.GetMergeStats(), (0, 1, 1))
+
   def testNoMerge_DifferentId(self):
     self.fm.a_schedule.AddStopObject(self.s1)
     self.fm.b_schedule.AddStopObject(self.s2)
@@ -1073,6 +1395,81 @@ class TestTripMerger(util.TestCase):
     self.assertEquals(len(t1_in_b_merged), 1)
     self.assertEquals(t1_in_b_merged[0].original_trip_id, 't1')
 
+  def _AddT1ToB(self):
+    """Adds a trip with the trip_id of t1 to the new schedule."""
+    t1_in_b = transitfeed.Trip(field_dict=self.t1)
+    t1_in_b.shape_id = None
+    t1_in_b.service_id = 's2'
+    s2 = transitfeed.ServicePeriod('s2')
+    s2.start_date = '20080101'
+    s2.end_date = '20080131'
+    s2.SetWeekdayService()
+    self.fm.b_schedule.AddAgencyObject(transitfeed.Agency(field_dict=self.a1))
+    self.fm.b_schedule.AddRouteObject(transitfeed.Route(field_dict=self.r1))
+    self.fm.b_schedule.AddServicePeriodObject(s2)
+    self.fm.b_schedule.AddTripObject(t1_in_b, validate=False)
+    return t1_in_b
+
+  def testCollidingTripIds(self):
+    t1_in_b = self._AddT1ToB()
+    self.accumulator.ExpectProblemClass(merge.MergeNotImplemented)
+    self.assert_(self.fm.MergeSchedules())
+    # Both trips get an id numbered after the largest trip_id number, t2
+    self.assertEquals('t1_merged_3', self.fm.a_merge_map[self.t1].trip_id)
+    self.assertEquals('t1_merged_4', self.fm.b_merge_map[t1_in_b].trip_id)
+    self.assertEquals('t2', self.fm.a_merge_map[self.t2].trip_id)
+
+  def testMergersAddedInAnyOrder(self):
+    fm = merge.FeedMerger(self.fm.a_schedule, self.fm.b_schedule,
+                          transitfeed.Schedule(), self.problem_reporter)
+    for cls in (merge.TripMerger, merge.ShapeMerger, merge.ServicePeriodMerger,
+                merge.RouteMerger, merge.StopMerger, merge.AgencyMerger):
+      fm.AddMerger(cls(fm))
+    self.accumulator.ExpectProblemClass(merge.MergeNotImplemented)
+    self.assert_(fm.MergeSchedules())
+    t1 = fm.a_merge_map[self.t1]
+    self.assertEquals(fm.a_merge_map[self.r1].route_id, t1.route_id)
+    self.assertEquals('shape1', t1.shape_id)
+    self.assertEquals([fm.a_merge_map[self.stop]],
+                      [st.stop for st in t1.GetStopTimes()])
+
+  def testStopTimesCopied(self):
+    stop2 = transitfeed.Stop(30.001, 30.0, stop_id='stop2')
+    self.fm.a_schedule.AddStopObject(stop2)
+    self.t2.AddStopTime(self.stop, arrival_secs=60, departure_secs=90,
+                        stop_headsign='To stop2')
+    self.t2.AddStopTime(stop2, arrival_secs=120, departure_secs=120)
+    t1_in_b = transitfeed.Trip(field_dict=self.t1)
+    t1_in_b.shape_id = None
+    s_in_b = transitfeed.ServicePeriod('s1')
+    s_in_b.start_date = '20080101'
+    s_in_b.end_date = '20080131'
+    s_in_b.SetWeekdayService()
+    self.fm.b_schedule.AddAgencyObject(transitfeed.Agency(field_dict=self.a1))
+    self.fm.b_schedule.AddRouteObject(transitfeed.Route(field_dict=self.r1))
+    self.fm.b_schedule.AddServicePeriodObject(s_in_b, validate=False)
+    stop_in_b = transitfeed.Stop(30.0, 30.0, stop_id='stop_b')
+    self.fm.b_schedule.AddStopObject(stop_in_b)
+    self.fm.b_schedule.AddTripObject(t1_in_b, validate=False)
+    t1_in_b.AddStopTime(stop_in_b, arrival_secs=300, departure_secs=300)
+    self.accumulator.ExpectProblemClass(merge.MergeNotImplemented)
+    self.assert_(self.fm.MergeSchedules())
+
+    t2 = self.fm.a_merge_map[self.t2]
+    self.assertEquals(
+        [(60, 90, self.fm.a_merge_map[self.stop], 1, 'To stop2'),
+         (120, 120, self.fm.a_merge_map[stop2], 2, None)],
+        [(st.arrival_secs, st.departure_secs, st.stop, st.stop_sequence,
+          st.stop_headsign) for st in t2.GetStopTimes()])
+    # t1 of the new feed has a new trip_id which its stop times use
+    t1_in_b_merged = self.fm.b_merge_map[t1_in_b]
+    self.assertNotEquals('t1', t1_in_b_merged.trip_id)
+    self.assertEquals([300], [st.arrival_secs
+                              for st in t1_in_b_merged.GetStopTimes()])
+    self.assertEquals(
+        [0], [st.arrival_secs
+              for st in self.fm.a_merge_map[self.t1].GetStopTimes()])
+
 
 class TestFareMerger(util.TestCase):
 
@@ -1237,6 +1634,151 @@ class TestShapeMerger(util.TestCase):
     self.assertEquals(len(self.fm.GetMergedSchedule().GetShapeList()), 1)
 
 
+  def _CopyShape(self, shape, shape_id, lat_offset=0.0):
+    copy = transitfeed.Shape(shape_id)
+    for lat, lon, distance in shape.points:
+      copy.AddPoint(lat + lat_offset, lon, distance)
+    return copy
+
+  def testDeduplicate_SamePoints(self):
+    self.fm.a_schedule.AddShapeObject(self.s1)
+    s1_in_b = self._CopyShape(self.s1, 'other_id')
+    self.fm.b_schedule.AddShapeObject(s1_in_b)
+    self.fm.b_schedule.AddShapeObject(self.s2)
+    self.sm.SetDeduplicateShapes(True)
+    self.accumulator.ExpectProblemClass(merge.ShapesDeduplicated)
+    self.fm.MergeSchedules()
+    merged_shapes = self.fm.merged_schedule.GetShapeList()
+    self.assertEquals(['s1', 's2'], sorted(s.shape_id for s in merged_shapes))
+    self.assert_(self.fm.b_merge_map[s1_in_b] is self.fm.a_merge_map[self.s1])
+    count, bytes_saved = self.sm.GetDeduplicationStats()
+    self.assertEquals(1, count)
+    self.assertEquals(len('other_id,30.0,30.0,1,\r\n'
+                          'other_id,40.0,30.0,2,\r\n'
+                          'other_id,50.0,50.0,3,\r\n'), bytes_saved)
+    self.accumulator.assertExpectedProblemsReported(self)
+
+  def testDeduplicate_WithinTolerance(self):
+    self.fm.a_schedule.AddShapeObject(self.s1)
+    # About 1m north of s1
+    s1_moved = self._CopyShape(self.s1, 'moved', 0.00001)
+    self.fm.b_schedule.AddShapeObject(s1_moved)
+    self.sm.SetDeduplicateShapes(True)
+    self.accumulator.ExpectProblemClass(merge.ShapesDeduplicated)
+    self.fm.MergeSchedules()
+    self.assertEquals(1, len(self.fm.merged_schedule.GetShapeList()))
+    self.assertEquals('s1', self.fm.b_merge_map[s1_moved].shape_id)
+
+  def testDeduplicate_ExtraVertex(self):
+    s4 = transitfeed.Shape('s4')
+    s4.AddPoint(30.0, 30.0)
+    s4.AddPoint(30.001, 30.0)
+    s5 = transitfeed.Shape('s5')
+    s5.AddPoint(30.0, 30.0)
+    s5.AddPoint(30.0005, 30.0)
+    s5.AddPoint(30.001, 30.0)
+    self.fm.a_schedule.AddShapeObject(s4)
+    self.fm.b_schedule.AddShapeObject(s5)
+    self.sm.SetDeduplicateShapes(True)
+    self.accumulator.ExpectProblemClass(merge.ShapesDeduplicated)
+    self.fm.MergeSchedules()
+    self.assertEquals(['s4'], [s.shape_id for s in
+                               self.fm.merged_schedule.GetShapeList()])
+    self.assert_(self.fm.b_merge_map[s5] is self.fm.a_merge_map[s4])
+
+  def testDeduplicate_DifferentDistances(self):
+    s4 = transitfeed.Shape('s4')
+    s4.AddPoint(30.0, 30.0, 0.0)
+    s4.AddPoint(30.00001, 30.0, 1.0)
+    s5 = transitfeed.Shape('s5')
+    s5.AddPoint(30.0, 30.0, 0.0)
+    s5.AddPoint(30.00001, 30.0, 1000.0)
+    self.fm.a_schedule.AddShapeObject(s4)
+    self.fm.b_schedule.AddShapeObject(s5)
+    self.sm.SetDeduplicateShapes(True)
+    self.fm.MergeSchedules()
+    self.assertEquals(2, len(self.fm.merged_schedule.GetShapeList()))
+    self.assertEquals((0, 0), self.sm.GetDeduplicationStats())
+
+  def testDeduplicate_DifferentPath(self):
+    # s1 and s2 have the same endpoints
+    self.fm.a_schedule.AddShapeObject(self.s1)
+    self.fm.b_schedule.AddShapeObject(self.s2)
+    self.sm.SetDeduplicateShapes(True)
+    self.fm.MergeSchedules()
+    self.assertEquals(2, len(self.fm.merged_schedule.GetShapeList()))
+
+  def testDeduplicate_Disabled(self):
+    self.fm.a_schedule.AddShapeObject(self.s1)
+    self.fm.b_schedule.AddShapeObject(self._CopyShape(self.s1, 'other_id'))
+    self.fm.MergeSchedules()
+    self.assertEquals(2, len(self.fm.merged_schedule.GetShapeList()))
+
+
+class TestGetGridCellSize(util.TestCase):
+
+  def testCellsWideEnough(self):
+    lat_cell, lng_cell = merge.GetGridCellSize(100.0, 60.0)
+    self.assert_(merge.ApproximateDistanceBetweenPoints(
+        (60.0, 30.0), (60.0 + lat_cell, 30.0)) >= 100.0)
+    self.assert_(merge.ApproximateDistanceBetweenPoints(
+        (60.0, 30.0), (60.0, 30.0 + lng_cell)) >= 100.0)
+    # A degree of longitude at 60 degrees is half as long as at the equator
+    self.assertAlmostEqual(2.0, lng_cell / lat_cell)
+
+  def testPole(self):
+    lat_cell, lng_cell = merge.GetGridCellSize(0.0, 90.0)
+    self.assert_(lat_cell > 0)
+    self.assertAlmostEqual(100.0, lng_cell / lat_cell)
+
+
+class TestDiscreteFrechetDistance(util.TestCase):
+
+  def testSamePolyline(self):
+    points = [(30.0, 30.0), (30.001, 30.0), (30.001, 30.001)]
+    self.assertEquals(0.0, merge.DiscreteFrechetDistance(points, points))
+
+  def testExtraVertex(self):
+    # The same geometry with a vertex in the middle of a segment
+    a_points = [(30.0, 30.0), (30.001, 30.0), (30.001, 30.001)]
+    b_points = [(30.0, 30.0), (30.0005, 30.0), (30.001, 30.0),
+                (30.001, 30.001)]
+    self.assertAlmostEqual(
+        0.0, merge.DiscreteFrechetDistance(a_points, b_points), delta=0.01)
+    self.assertAlmostEqual(
+        0.0, merge.DiscreteFrechetDistance(b_points, a_points, 1.0),
+        delta=0.01)
+
+  def testMovedExtraVertex(self):
+    # About 1m east of a_points, with a vertex in the middle of a segment
+    a_points = [(30.0, 30.0), (30.001, 30.0)]
+    b_points = [(30.0, 30.00001), (30.0005, 30.00001), (30.001, 30.00001)]
+    distance = merge.DiscreteFrechetDistance(a_points, b_points, 10.0)
+    self.assertAlmostEqual(
+        merge.ApproximateDistanceBetweenPoints((30.0, 30.0), (30.0, 30.00001)),
+        distance, delta=0.1)
+
+  def testDifferentPath(self):
+    # The same endpoints, about 50m apart in the middle
+    a_points = [(30.0, 30.0), (30.0005, 30.0), (30.001, 30.0)]
+    b_points = [(30.0, 30.0), (30.0005, 30.0005), (30.001, 30.0)]
+    self.assertEquals(
+        float('inf'), merge.DiscreteFrechetDistance(a_points, b_points, 10.0))
+    self.assert_(merge.DiscreteFrechetDistance(a_points, b_points) > 10.0)
+
+  def testDirection(self):
+    a_points = [(30.0, 30.0), (30.001, 30.0)]
+    distance = merge.DiscreteFrechetDistance(a_points,
+                                             list(reversed(a_points)))
+    self.assertAlmostEqual(
+        merge.ApproximateDistanceBetweenPoints(*a_points), distance, delta=0.5)
+
+  def testMaxDistance(self):
+    a_points = [(30.0, 30.0), (30.001, 30.0), (30.002, 30.0)]
+    b_points = [(30.01, 30.0), (30.011, 30.0), (30.012, 30.0)]
+    self.assert_(merge.DiscreteFrechetDistance(a_points, b_points, 10.0) > 10.0)
+
+
 class TestFareRuleMerger(util.TestCase):
 
   def setUp(self):
@@ -1475,6 +2017,47 @@ class TestHTMLProblemAccumulator(util.TestCase):
     self.assert_(html.startswith('<html>'))
     self.assert_(html.endswith('</html>'))
 
+  def _ReportSameIdButNotMerged(self, accumulator, count):
+    problem_reporter = merge.MergeProblemReporter(accumulator)
+    for i in range(count):
+      problem_reporter.SameIdButNotMerged(self.dataset_merger, 'id%d' % i,
+                                          'unknown reason')
+    problem_reporter.FareRulesBroken(self.dataset_merger)
+
+  def testMaxSamples(self):
+    accumulator = merge.HTMLProblemAccumulator(max_samples=3)
+    self._ReportSameIdButNotMerged(accumulator, 10)
+    output_file = StringIO()
+    accumulator.WriteOutput(output_file, self.feed_merger, 'old', 'new', None)
+    html = output_file.getvalue()
+    self.assert_("id 'id2'" in html)
+    self.assert_("id 'id3'" not in html)
+    self.assert_('7 more SameIdButNotMerged problems are not listed' in html)
+    self.assert_('unable to handle fare rules' in html)
+    self.assert_('warnings: 11' in html)
+
+  def testJsonOutput(self):
+    accumulator = merge.HTMLProblemAccumulator(max_samples=2)
+    self._ReportSameIdButNotMerged(accumulator, 5)
+    self.problem_reporter = merge.MergeProblemReporter(accumulator)
+    self.problem_reporter.CalendarsNotDisjoint(self.dataset_merger)
+    output_file = StringIO()
+    accumulator.WriteJsonOutput(output_file, self.feed_merger,
+                                'old', 'new', 'merged')
+    results = json.loads(output_file.getvalue())
+    self.assertEquals('old', results['old_feed'])
+    self.assertEquals('merged', results['merged_feed'])
+    self.assertEquals({'errors': 1, 'warnings': 6, 'notices': 0},
+                      results['counts'])
+    self.assertEquals(
+        [('error', 'CalendarsNotDisjoint', 1, 1),
+         ('warning', 'FareRulesBroken', 1, 1),
+         ('warning', 'SameIdButNotMerged', 5, 2)],
+        [(c['type'], c['class'], c['count'], len(c['samples']))
+         for c in results['problems']])
+    self.assertEquals('trips.txt', results['problems'][0]['file'])
+    self.assertEquals([], results['notices'])
+
 
 class MergeInSubprocessTestCase(util.TempDirTestCaseBase):
   def CopyAndModifyTestData(self, zip_path, modify_file, old, new):
@@ -1535,6 +2118,32 @@ class MergeInSubprocessTestCase(util.TempDirTestCaseBase):
         expected_retcode=2)
 
 
+  def testMergeFourFeedsReportLabels(self):
+    # Copies of good_feed.zip with service in different years, so that their
+    # service periods are disjoint
+    paths = []
+    for year in ('2008', '2009', '2010', '2011'):
+      content_dict = self.ConvertZipToDict(
+          zipfile.ZipFile(self.GetPath('tests/data/good_feed.zip')))
+      content_dict['calendar.txt'] = content_dict['calendar.txt'].replace(
+          '20070101', year + '0101').replace('20111231', year + '1231')
+      content_dict['calendar_dates.txt'] = content_dict[
+          'calendar_dates.txt'].replace('2007', year)
+      path = os.path.join(self.tempdirpath, '%s.zip' % year)
+      open(path, 'wb').write(self.ConvertDictToZip(content_dict).getvalue())
+      paths.append(path)
+    self.CheckCallWithPath(
+        [self.GetPath('merge.py'), '--no_browser'] + paths +
+        [os.path.join(self.tempdirpath, 'merged.zip')],
+        expected_retcode=0)
+    htmlout = open('merge-results.html').read()
+    # The final merge has the first two feeds on the old side and the last
+    # two on the new side
+    self.assertTrue('Old feed: <code>%s, %s</code>' % tuple(paths[:2])
+                    in htmlout)
+    self.assertTrue('New feed: <code>%s, %s</code>' % tuple(paths[2:])
+                    in htmlout)
+
   def testCheckVersionIsRun(self):
     future_good_feed = self.CopyAndModifyTestData(
         self.GetPath('tests/data/good_feed.zip'), 'calendar.txt',
@@ -0,0 +1,296 @@
+#!/usr/bin/python2.5
+
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the schedule_viewer module."""
+from __future__ import absolute_import
+
+import gzip
+import json
+import os.path
+import schedule_viewer
+import shutil
+import sys
+import tempfile
+from tests import util
+import transitfeed
+from transitfeed.compat import StringIO
+
+
+class FakeServer(object):
+  """The attributes of a server used by ScheduleRequestHandler."""
+
+  def __init__(self, schedule):
+    self.schedule = schedule
+    self.file_dir = schedule_viewer.FindDefaultFileDir()
+    self.key = 'key'
+    self.host = 'maps.google.com'
+    self.response_cache = transitfeed.util.LruCache(16)
+    self.loader = None
+    self.watcher = None
+
+
+class RequestHandler(schedule_viewer.ScheduleRequestHandler):
+  """Handles one GET request without a socket, writing to a StringIO."""
+
+  def __init__(self, server, path, headers):
+    self.server = server
+    self.path = path
+    self.headers = headers
+    self.command = 'GET'
+    self.request_version = 'HTTP/1.0'
+    self.requestline = 'GET %s HTTP/1.0' % path
+    self.client_address = ('127.0.0.1', 0)
+    self.wfile = StringIO()
+
+  def log_message(self, format, *args):
+    pass
+
+
+class Response(object):
+  def __init__(self, output):
+    head, self.body = output.split('\r\n\r\n', 1)
+    lines = head.split('\r\n')
+    self.status = int(lines[0].split()[1])
+    self.headers = {}
+    for line in lines[1:]:
+      name, value = line.split(':', 1)
+      self.headers[name.strip()] = value.strip()
+
+  def GetJson(self):
+    if self.headers.get('Content-Encoding') == 'gzip':
+      body = gzip.GzipFile(fileobj=StringIO(self.body)).read()
+    else:
+      body = self.body
+    return json.loads(body)
+
+
+class ScheduleViewerTestCase(util.TestCase):
+
+  def setUp(self):
+    self.schedule = transitfeed.Loader(
+        util.DataPath('good_feed'),
+        problems=util.GetTestFailureProblemReporter(self)).Load()
+    self.server = FakeServer(self.schedule)
+
+  def Get(self, path, headers=None):
+    handler = RequestHandler(self.server, path, headers or {})
+    handler.do_GET()
+    return Response(handler.wfile.getvalue())
+
+
+  def assertOnlyErrorPage(self, response):
+    """Check that no JSON response follows the error page."""
+    self.assertFalse('HTTP/' in response.body)
+    self.assertFalse('null' in response.body)
+
+
+class ErrorTestCase(ScheduleViewerTestCase):
+
+  def testNoSuchRoute(self):
+    for i in range(2):
+      response = self.Get('/json/routepatterns?route=NOSUCHROUTE')
+      self.assertEquals(404, response.status)
+      self.assertOnlyErrorPage(response)
+
+  def testNoSuchTrip(self):
+    # Unknown trips give null rather than an error
+    response = self.Get('/json/tripstoptimes?trip=NOSUCHTRIP')
+    self.assertEquals(200, response.status)
+    self.assertEquals(None, response.GetJson())
+
+
+class CachedResponseTestCase(ScheduleViewerTestCase):
+
+  def setUp(self):
+    ScheduleViewerTestCase.setUp(self)
+    self._min_gzip_size = schedule_viewer.MIN_GZIP_SIZE
+    schedule_viewer.MIN_GZIP_SIZE = 10
+
+  def tearDown(self):
+    schedule_viewer.MIN_GZIP_SIZE = self._min_gzip_size
+
+  def testGzipHasOwnETag(self):
+    plain = self.Get('/json/routes')
+    gzipped = self.Get('/json/routes', {'Accept-Encoding': 'gzip'})
+    self.assertEquals(200, gzipped.status)
+    self.assertEquals('gzip', gzipped.headers['Content-Encoding'])
+    self.assertFalse('Content-Encoding' in plain.headers)
+    self.assertNotEqual(plain.headers['ETag'], gzipped.headers['ETag'])
+    self.assertEquals(plain.GetJson(), gzipped.GetJson())
+    for response in (plain, gzipped):
+      self.assertEquals('Accept-Encoding', response.headers['Vary'])
+
+  def testNotModified(self):
+    plain_etag = self.Get('/json/routes').headers['ETag']
+    gzip_etag = self.Get('/json/routes',
+                         {'Accept-Encoding': 'gzip'}).headers['ETag']
+    response = self.Get('/json/routes', {'Accept-Encoding': 'gzip',
+                                         'If-None-Match': gzip_etag})
+    self.assertEquals(304, response.status)
+    self.assertEquals(gzip_etag, response.headers['ETag'])
+    self.assertEquals('Accept-Encoding', response.headers['Vary'])
+    # A client which doesn't accept gzip can't use the gzip body
+    response = self.Get('/json/routes', {'If-None-Match': gzip_etag})
+    self.assertEquals(200, response.status)
+    self.assertEquals(plain_etag, response.headers['ETag'])
+
+  def testStaticFileNotModified(self):
+    gzipped = self.Get('/file/index.js', {'Accept-Encoding': 'gzip'})
+    self.assertEquals('gzip', gzipped.headers['Content-Encoding'])
+    response = self.Get('/file/index.js',
+                        {'If-None-Match': gzipped.headers['ETag']})
+    self.assertEquals(200, response.status)
+    response = self.Get('/file/index.js',
+                        {'Accept-Encoding': 'gzip',
+                         'If-None-Match': gzipped.headers['ETag']})
+    self.assertEquals(304, response.status)
+
+
+class TileTestCase(ScheduleViewerTestCase):
+
+  def testTileUrl(self):
+    # The tile at zoom 10 containing the stops of good_feed, as requested by
+    # fetchVisibleTiles in index.js
+    response = self.Get('/tile/10/179/398.json')
+    self.assertEquals(200, response.status)
+    tile = response.GetJson()
+    self.assertTrue('STAGECOACH' in [stop[0] for stop in tile['stops']])
+
+  def testTileOutOfRange(self):
+    response = self.Get('/tile/1/2/0.json')
+    self.assertEquals(404, response.status)
+    self.assertOnlyErrorPage(response)
+
+  def testBadTileParameter(self):
+    response = self.Get('/json/tile?z=a&x=0&y=0')
+    self.assertEquals(400, response.status)
+    self.assertOnlyErrorPage(response)
+
+
+class NotReadyTestCase(ScheduleViewerTestCase):
+
+  def setUp(self):
+    ScheduleViewerTestCase.setUp(self)
+    self.server.schedule = None
+
+  def testNotReady(self):
+    response = self.Get('/json/routes')
+    self.assertEquals(503, response.status)
+    self.assertEquals('5', response.headers['Retry-After'])
+    self.assertEquals(503, self.Get('/').status)
+
+  def testStatusAndFilesWhileLoading(self):
+    self.server.loader = schedule_viewer.FeedLoader(
+        self.server, util.DataPath('good_feed'))
+    response = self.Get('/json/status')
+    self.assertEquals(200, response.status)
+    self.assertEquals('loading', response.GetJson()['state'])
+    self.assertEquals(200, self.Get('/file/index.js').status)
+
+
+class SwapScheduleRequestHandler(RequestHandler):
+  """Replaces server.schedule while a request is being handled, like
+  FeedWatcher does when a reload finishes."""
+
+  def handle_json_GET_swap(self, params):
+    self.server.schedule = self.server.new_schedule
+    return [r.route_id for r in self.schedule.GetRouteList()]
+
+
+class ReloadTestCase(ScheduleViewerTestCase):
+
+  def setUp(self):
+    ScheduleViewerTestCase.setUp(self)
+    self.tempdirpath = tempfile.mkdtemp()
+    self.feed_path = os.path.join(self.tempdirpath, 'feed')
+    shutil.copytree(util.DataPath('good_feed'), self.feed_path)
+    self.watcher = schedule_viewer.FeedWatcher(self.server, self.feed_path)
+    # Hide the messages and tracebacks printed while reloading
+    self.saved_output = (sys.stdout, sys.stderr)
+    sys.stdout = sys.stderr = StringIO()
+
+  def tearDown(self):
+    sys.stdout, sys.stderr = self.saved_output
+    shutil.rmtree(self.tempdirpath)
+
+  def _AddStop(self, stop_id):
+    f = open(os.path.join(self.feed_path, 'stops.txt'), 'a')
+    f.write('%s,New stop,,36.9,-116.8,,,,,\n' % stop_id)
+    f.close()
+
+  def testReloadOnceStable(self):
+    self.assertFalse(self.watcher.CheckForChange())
+    self._AddStop('NEW1')
+    # The feed may still be being written
+    self.assertFalse(self.watcher.CheckForChange())
+    self._AddStop('NEW2')
+    self.assertFalse(self.watcher.CheckForChange())
+    self.assertTrue(self.server.schedule is self.schedule)
+    self.assertTrue(self.watcher.CheckForChange())
+    self.assertFalse(self.server.schedule is self.schedule)
+    self.assertEquals('NEW2', self.server.schedule.GetStop('NEW2').stop_id)
+    self.assertEquals('ready', self.server.loader.GetStatus()['state'])
+    self.assertFalse(self.watcher.CheckForChange())
+
+  def testFailedReloadKeepsSchedule(self):
+    feed_path = os.path.join(self.tempdirpath, 'feed.zip')
+    shutil.copy(util.DataPath('good_feed.zip'), feed_path)
+    watcher = schedule_viewer.FeedWatcher(self.server, feed_path)
+    f = open(feed_path, 'wb')
+    f.write('not a zip file')
+    f.close()
+    self.assertFalse(watcher.CheckForChange())
+    self.assertTrue(watcher.CheckForChange())
+    self.assertTrue(self.server.schedule is self.schedule)
+    self.assertEquals('error', self.server.loader.GetStatus()['state'])
+    # The broken feed isn't loaded again until it changes
+    self.assertFalse(watcher.CheckForChange())
+    self.assertEquals(200, self.Get('/json/routes').status)
+
+  def testRequestKeepsItsSchedule(self):
+    self.server.new_schedule = transitfeed.Schedule()
+    handler = SwapScheduleRequestHandler(self.server, '/json/swap', {})
+    handler.do_GET()
+    response = Response(handler.wfile.getvalue())
+    self.assertEquals(sorted(self.schedule.routes.keys()),
+                      sorted(response.GetJson()))
+    self.assertTrue(self.server.schedule is self.server.new_schedule)
+
+  def testReloadClearsResponseCache(self):
+    self.Get('/json/routes')
+    self.assertTrue(len(self.server.response_cache))
+    self._AddStop('NEW1')
+    self.watcher.CheckForChange()
+    self.assertTrue(self.watcher.CheckForChange())
+    self.assertFalse(len(self.server.response_cache))
+
+
+class TripsDataTestCase(ScheduleViewerTestCase):
+
+  def testTripsData(self):
+    data = self.Get('/json/tripsdata?trips=CITY1,CITY2,NOSUCHTRIP').GetJson()
+    self.assertEquals(['CITY1', 'CITY2'],
+                      [t['trip_id'] for t in data['trips']])
+    self.assertEquals(['NOSUCHTRIP'], data['missing'])
+    self.assertEquals(5, len(data['stops']))
+
+  def testMissingRoute(self):
+    del self.schedule.routes['CITY']
+    response = self.Get('/json/tripsdata?trips=CITY1')
+    self.assertEquals(200, response.status)
+    data = response.GetJson()
+    self.assertEquals(['CITY1'], [t['trip_id'] for t in data['trips']])
+    self.assertFalse('color' in data['shapes'][0])
@@ -370,5 +370,23 @@ class TestGraph(ShapeLibTestBase):
     self.assertPointsApproxEq([p1, p2, p3, p4], path.GetPoints())
 
 
+class TestEncodedPolyline(ShapeLibTestBase):
+  def testEncode(self):
+    # Example from the documentation of the Google Maps algorithm
+    points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    self.assertEqual('_p~iF~ps|U_ulLnnqC_mqNvxq`@',
+                     shapelib.EncodePolyline(points))
+    self.assertEqual('', shapelib.EncodePolyline([]))
+
+  def testDecode(self):
+    points = [(36.86845, -116.78458), (36.868, -116.78), (-1.5, 0.0)]
+    decoded = shapelib.DecodePolyline(shapelib.EncodePolyline(points))
+    self.assertEqual(len(points), len(decoded))
+    for (lat, lng), (decoded_lat, decoded_lng) in zip(points, decoded):
+      self.assertApproxEq(lat, decoded_lat)
+      self.assertApproxEq(lng, decoded_lng)
+    self.assertRaises(shapelib.ShapeError, shapelib.DecodePolyline, '_p~iF')
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,72 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for the departureindex module.
+from __future__ import absolute_import
+
+from tests import util
+import transitfeed
+
+
+class DepartureIndexTestCase(util.TestCase):
+  def setUp(self):
+    self.schedule = transitfeed.Loader(
+        util.DataPath('good_feed.zip'),
+        problems=util.GetTestFailureProblemReporter(self)).Load()
+    self.index = self.schedule.GetDepartureIndex()
+
+  def testMatchesGetStopTimeTrips(self):
+    for stop in self.schedule.GetStopList():
+      expected = sorted((secs, trip.trip_id, index, is_timepoint)
+                        for secs, (trip, index), is_timepoint
+                        in stop.GetStopTimeTrips(self.schedule))
+      departures = self.index.GetDepartures(stop.stop_id)
+      self.assertEquals(expected, [(secs, trip.trip_id, index, is_timepoint)
+                                   for secs, trip, index, is_timepoint, _
+                                   in departures])
+      self.assertEquals(len(expected),
+                        self.index.GetDepartureCount(stop.stop_id))
+
+  def testTimeAndLimit(self):
+    departures = self.index.GetDepartures('BEATTY_AIRPORT')
+    self.assertEquals(7, len(departures))
+    time = departures[2][0]
+    later = self.index.GetDepartures('BEATTY_AIRPORT', time=time, limit=2)
+    self.assertEquals(2, len(later))
+    self.assertTrue(all(d[0] >= time for d in later))
+    self.assertEquals(departures[2][0], later[0][0])
+
+  def testDateFilter(self):
+    # Service FULLW runs every day, WE only on weekends. 20070606 is a Wednesday
+    departures = self.index.GetDepartures('BEATTY_AIRPORT', date='20070606')
+    self.assertEquals(['STBA', 'AB1', 'AB2'],
+                      [d[1].trip_id for d in departures])
+    self.assertEquals(7, len(self.index.GetDepartures('BEATTY_AIRPORT',
+                                                      date='20070609')))
+    self.assertEquals([], self.index.GetDepartures('BEATTY_AIRPORT',
+                                                   date='20300101'))
+
+  def testHeadsign(self):
+    headsigns = dict((d[1].trip_id, d[4])
+                     for d in self.index.GetDepartures('BEATTY_AIRPORT'))
+    # STBA has a stop_headsign on its first stop, AB1 only a trip_headsign
+    self.assertEquals('to airport', headsigns['STBA'])
+    self.assertEquals('to Bullfrog', headsigns['AB1'])
+
+  def testUnknownStop(self):
+    self.assertEquals([], self.index.GetDepartures('no such stop'))
+    self.assertEquals(0, self.index.GetDepartureCount('no such stop'))
+
+  def testIndexIsCached(self):
+    self.assertTrue(self.schedule.GetDepartureIndex() is self.index)
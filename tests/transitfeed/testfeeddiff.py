@@ -0,0 +1,250 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for the feeddiff module.
+from __future__ import absolute_import
+
+import zipfile
+
+from tests import util
+import transitfeed
+from transitfeed import feeddiff
+from transitfeed.compat import StringIO
+
+
+class FeedDiffTestCase(util.MemoryZipTestCase):
+  def setUp(self):
+    util.MemoryZipTestCase.setUp(self)
+    self.SetArchiveContents(
+        "shapes.txt",
+        "shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence\n"
+        "S1,36.868446,-116.784582,1\n"
+        "S1,36.88108,-116.81797,2\n")
+    self.SetArchiveContents(
+        "trips.txt",
+        "route_id,service_id,trip_id,shape_id\n"
+        "AB,FULLW,AB1,S1\n"
+        "AB,WE,AB2,\n")
+    self.AppendToArchiveContents(
+        "stop_times.txt",
+        "AB2,11:00:00,11:00:00,BEATTY_AIRPORT,1\n"
+        "AB2,11:20:00,11:20:00,BULLFROG,2\n")
+    self.old_zip = self._GetZipFile()
+
+  def _GetZipFile(self):
+    """Return a StringIO with a zip file of the current archive contents."""
+    zip_file = StringIO()
+    archive = zipfile.ZipFile(zip_file, 'w')
+    for arcname, contents in self.zip_contents.items():
+      archive.writestr(arcname, contents)
+    archive.close()
+    return zip_file
+
+  def _Load(self, zip_file):
+    return transitfeed.Loader(zip=zipfile.ZipFile(zip_file),
+                              problems=self.problems,
+                              extra_validation=True).Load()
+
+  def _GetFeedContents(self, schedule):
+    """Return {file name: sorted lines} of a schedule written to a zip."""
+    output = StringIO()
+    schedule.WriteGoogleTransitFeed(output)
+    archive = zipfile.ZipFile(output)
+    return dict((name, sorted(archive.read(name).splitlines()))
+                for name in archive.namelist())
+
+  def _ApplyAndCompare(self):
+    """Apply the diff of the archive contents to the old schedule and check
+    that the result is the same as loading the new feed."""
+    schedule = self._Load(self.old_zip)
+    new_zip = self._GetZipFile()
+    feed_diff = transitfeed.DiffFeeds(self.old_zip, new_zip)
+    changed = feed_diff.ApplyToSchedule(schedule, self.problems)
+    self.assertEquals(self._GetFeedContents(self._Load(new_zip)),
+                      self._GetFeedContents(schedule))
+    return feed_diff, changed
+
+  def testNoChanges(self):
+    feed_diff = transitfeed.DiffFeeds(self.old_zip, self._GetZipFile())
+    self.assertTrue(feed_diff.IsEmpty())
+    self.assertEquals([], feed_diff.GetFileNames())
+
+  def testRowDiff(self):
+    self.SetArchiveContents(
+        "stops.txt",
+        "stop_name,stop_id,stop_lat,stop_lon\n"
+        "Airport,BEATTY_AIRPORT,36.868446,-116.784582\n"
+        "Bullfrog Depot,BULLFROG,36.88108,-116.81797\n"
+        "Stagecoach Hotel,STAGECOACH,36.915682,-116.751677\n"
+        "Amargosa Valley,AMV,36.641496,-116.40094\n")
+    feed_diff = transitfeed.DiffFeeds(self.old_zip, self._GetZipFile())
+    self.assertEquals(['stops.txt'], feed_diff.GetFileNames())
+    table_diff = feed_diff.GetTableDiff('stops.txt')
+    # Reordered columns don't count as a change
+    self.assertEquals(2, table_diff.GetChangeCount())
+    self.assertEquals([5], [line_num for line_num, _ in table_diff.added])
+    self.assertEquals('AMV', table_diff.added[0][1]['stop_id'])
+    old_row, line_num, new_row = table_diff.changed[0]
+    self.assertEquals(('Bullfrog', 3, 'Bullfrog Depot'),
+                      (old_row['stop_name'], line_num, new_row['stop_name']))
+    self.assertEquals([], table_diff.removed)
+
+  def testApplyStopsAndStopTimes(self):
+    self.SetArchiveContents(
+        "stops.txt",
+        "stop_id,stop_name,stop_lat,stop_lon\n"
+        "BEATTY_AIRPORT,Airport,36.868446,-116.784582\n"
+        "BULLFROG,Bullfrog Depot,36.88108,-116.81797\n"
+        "STAGECOACH,Stagecoach Hotel,36.915682,-116.751677\n"
+        "AMV,Amargosa Valley,36.641496,-116.40094\n")
+    self.SetArchiveContents(
+        "stop_times.txt",
+        "trip_id,arrival_time,departure_time,stop_id,stop_sequence\n"
+        "AB1,10:00:00,10:00:00,BEATTY_AIRPORT,1\n"
+        "AB1,10:25:00,10:25:00,STAGECOACH,3\n"
+        "AB1,11:30:00,11:30:00,AMV,4\n"
+        "AB2,11:00:00,11:00:00,BEATTY_AIRPORT,1\n"
+        "AB2,11:21:00,11:21:00,BULLFROG,2\n")
+    feed_diff, changed = self._ApplyAndCompare()
+    self.assertEquals(set(['AMV', 'BULLFROG']), changed['stops'])
+    self.assertEquals(set(['AB1', 'AB2']), changed['trips'])
+    self.assertEquals(set(), changed['routes'])
+
+  def testApplyTripsCalendarAndShapes(self):
+    self.SetArchiveContents(
+        "trips.txt",
+        "route_id,service_id,trip_id,shape_id\n"
+        "AB,FULLW,AB1,S1\n"
+        "AB,SAT,AB2,S2\n")
+    self.SetArchiveContents(
+        "calendar.txt",
+        "service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,"
+        "start_date,end_date\n"
+        "FULLW,1,1,1,1,1,1,1,20070101,20101231\n"
+        "SAT,0,0,0,0,0,1,0,20070101,20101231\n")
+    self.SetArchiveContents(
+        "calendar_dates.txt",
+        "service_id,date,exception_type\n"
+        "FULLW,20070102,2\n")
+    self.SetArchiveContents(
+        "shapes.txt",
+        "shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence\n"
+        "S1,36.868446,-116.784582,1\n"
+        "S1,36.88,-116.8,2\n"
+        "S1,36.88108,-116.81797,3\n"
+        "S2,36.868446,-116.784582,1\n"
+        "S2,36.88108,-116.81797,2\n")
+    feed_diff, changed = self._ApplyAndCompare()
+    self.assertEquals(set(['FULLW', 'SAT', 'WE']), changed['service_periods'])
+    self.assertEquals(set(['S1', 'S2']), changed['shapes'])
+    self.assertEquals(set(['AB1', 'AB2']), changed['trips'])
+
+  def testApplyChangedServicePeriod(self):
+    self.SetArchiveContents(
+        "calendar.txt",
+        "service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,"
+        "start_date,end_date\n"
+        "FULLW,1,1,1,1,1,1,1,20070101,20101231\n"
+        "WE,0,0,0,0,0,1,0,20070101,20101231\n")
+    feed_diff, changed = self._ApplyAndCompare()
+    self.assertEquals(set(['WE']), changed['service_periods'])
+    # The trips of the period are validated again though the service_id
+    # still exists
+    self.assertEquals(set(['AB2']), changed['trips'])
+
+  def testApplyChangedFrequency(self):
+    self.SetArchiveContents(
+        "frequencies.txt",
+        "trip_id,start_time,end_time,headway_secs\n"
+        "AB1,06:00:00,07:59:59,1800\n"
+        "AB1,08:00:00,09:59:59,600\n")
+    self.old_zip = self._GetZipFile()
+    self.SetArchiveContents(
+        "frequencies.txt",
+        "trip_id,start_time,end_time,headway_secs\n"
+        "AB1,06:00:00,07:59:59,1200\n"
+        "AB1,08:00:00,09:59:59,600\n")
+    schedule = self._Load(self.old_zip)
+    new_zip = self._GetZipFile()
+    transitfeed.DiffFeeds(self.old_zip, new_zip).ApplyToSchedule(
+        schedule, self.problems)
+    self.assertEquals(
+        self._Load(new_zip).GetTrip('AB1').GetFrequencyTuples(),
+        schedule.GetTrip('AB1').GetFrequencyTuples())
+
+  def testSortInChunks(self):
+    self.SetArchiveContents(
+        "stop_times.txt",
+        "trip_id,arrival_time,departure_time,stop_id,stop_sequence\n"
+        "AB2,11:00:00,11:00:00,BEATTY_AIRPORT,1\n"
+        "AB1,10:00:00,10:00:00,BEATTY_AIRPORT,1\n"
+        "AB1,10:25:00,10:25:00,STAGECOACH,3\n"
+        "AB2,11:21:00,11:21:00,BULLFROG,2\n")
+    saved_chunk_size = feeddiff._SORT_CHUNK_SIZE
+    feeddiff._SORT_CHUNK_SIZE = 2
+    try:
+      feed_diff, changed = self._ApplyAndCompare()
+    finally:
+      feeddiff._SORT_CHUNK_SIZE = saved_chunk_size
+    table_diff = feed_diff.GetTableDiff('stop_times.txt')
+    self.assertEquals([], table_diff.added)
+    self.assertEquals(['BULLFROG'],
+                      [row['stop_id'] for row in table_diff.removed])
+    self.assertEquals(['11:21:00'],
+                      [row['arrival_time'] for _, _, row in table_diff.changed])
+    self.assertEquals(set(['AB1', 'AB2']), changed['trips'])
+
+  def testApplyRemovedTrip(self):
+    self.SetArchiveContents(
+        "trips.txt",
+        "route_id,service_id,trip_id,shape_id\n"
+        "AB,FULLW,AB1,S1\n")
+    self.SetArchiveContents(
+        "stop_times.txt",
+        "trip_id,arrival_time,departure_time,stop_id,stop_sequence\n"
+        "AB1,10:00:00,10:00:00,BEATTY_AIRPORT,1\n"
+        "AB1,10:20:00,10:20:00,BULLFROG,2\n"
+        "AB1,10:25:00,10:25:00,STAGECOACH,3\n")
+    schedule = self._Load(self.old_zip)
+    feed_diff = transitfeed.DiffFeeds(self.old_zip, self._GetZipFile())
+    feed_diff.ApplyToSchedule(schedule, self.problems)
+    self.assertEquals(['AB1'],
+                      [t.trip_id for t in schedule.GetRoute('AB').trips])
+    self.assertEquals([], schedule.GetTimeStopsOfTrips(['AB2'])['AB2'])
+
+  def testProblemsUseNewLineNumbers(self):
+    self.SetArchiveContents(
+        "stop_times.txt",
+        "trip_id,arrival_time,departure_time,stop_id,stop_sequence\n"
+        "AB1,10:00:00,10:00:00,BEATTY_AIRPORT,1\n"
+        "AB1,10:20:00,10:20:00,BULLFROG,2\n"
+        "AB1,10:25:00,10:25:00,STAGECOACH,3\n"
+        "AB2,11:00:00,11:00:00,BEATTY_AIRPORT,1\n"
+        "AB2,11:20:00,11:20:00,BULLFROG,2\n"
+        "AB2,11:30:00,11:30:00,UNKNOWN,3\n")
+    schedule = self._Load(self.old_zip)
+    feed_diff = transitfeed.DiffFeeds(self.old_zip, self._GetZipFile())
+    feed_diff.ApplyToSchedule(schedule, self.problems)
+    e = self.accumulator.PopInvalidValue('stop_id', 'stop_times.txt')
+    self.assertEquals(7, e.row_num)
+    self.accumulator.AssertNoMoreExceptions()
+
+  def testUnsupportedFile(self):
+    feed_diff = transitfeed.FeedDiff()
+    table_diff = transitfeed.TableDiff('extra.txt', ['extra_id'])
+    table_diff.added.append((2, {'extra_id': u'1'}))
+    feed_diff.AddTableDiff(table_diff)
+    schedule = self._Load(self.old_zip)
+    self.assertRaises(transitfeed.FeedDiffError,
+                      feed_diff.ApplyToSchedule, schedule, self.problems)
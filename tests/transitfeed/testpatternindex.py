@@ -0,0 +1,114 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for the patternindex module.
+from __future__ import absolute_import
+
+from tests import util
+import transitfeed
+
+
+class PatternIndexTestCase(util.TestCase):
+  def setUp(self):
+    self.schedule = transitfeed.Loader(
+        util.DataPath('good_feed.zip'),
+        problems=util.GetTestFailureProblemReporter(self)).Load()
+    self.route = self.schedule.GetRoute('AAMV')
+    self.index = self.route.GetPatternIndex()
+    self.pattern_id = self.schedule.GetTrip('AAMV1').pattern_id
+
+  def testPatterns(self):
+    self.assertEquals(sorted(self.route.GetPatternIdTripDict().keys()),
+                      sorted(self.index.GetPatternIds()))
+    time_stops = self.index.GetTimeStops(self.pattern_id)
+    self.assertEquals(['BEATTY_AIRPORT', 'AMV'],
+                      [st[2].stop_id for st in time_stops])
+
+  def testTripsSortedByStartTime(self):
+    pattern_trips = self.index.GetPatternTrips(self.pattern_id)
+    self.assertEquals(['AAMV1', 'AAMV3'],
+                      [t.trip_id for t in pattern_trips.trips])
+    self.assertEquals([8 * 3600, 13 * 3600], pattern_trips.start_times)
+    self.assertFalse(pattern_trips.has_non_zero_trip_type)
+
+  def testGetSample(self):
+    pattern_trips = self.index.GetPatternTrips(self.pattern_id)
+    self.assertEquals((0, [(8 * 3600, 'AAMV1')], 1),
+                      pattern_trips.GetSample(0, 1))
+    self.assertEquals((1, [(13 * 3600, 'AAMV3')], 0),
+                      pattern_trips.GetSample(9 * 3600, 1))
+    # No trip starts later so the last trip is returned
+    self.assertEquals((1, [(13 * 3600, 'AAMV3')], 0),
+                      pattern_trips.GetSample(20 * 3600, 1))
+    self.assertEquals((0, [(8 * 3600, 'AAMV1'), (13 * 3600, 'AAMV3')], 0),
+                      pattern_trips.GetSample(20 * 3600, 3))
+
+  def testDateFilter(self):
+    # Route AAMV only runs on weekends and 20070606 is a Wednesday
+    self.assertEquals(
+        [], self.index.GetPatternTrips(self.pattern_id, '20070606').trips)
+    self.assertEquals(
+        ['AAMV1', 'AAMV3'],
+        [t.trip_id for t in
+         self.index.GetPatternTrips(self.pattern_id, '20070609').trips])
+
+  def testIndexIsCachedUntilTripsChange(self):
+    self.assertTrue(self.route.GetPatternIndex() is self.index)
+    trip = self.route.AddTrip(trip_id='AAMV5')
+    trip.AddStopTime(self.schedule.GetStop('BEATTY_AIRPORT'),
+                     stop_time='06:00:00')
+    trip.AddStopTime(self.schedule.GetStop('AMV'), stop_time='07:00:00')
+    index = self.route.GetPatternIndex()
+    self.assertFalse(index is self.index)
+    self.assertEquals(
+        ['AAMV5', 'AAMV1', 'AAMV3'],
+        [t.trip_id for t in index.GetPatternTrips(self.pattern_id).trips])
+
+  def testStopTimesChangePattern(self):
+    trip = self.schedule.GetTrip('AAMV3')
+    trip.ClearStopTimes()
+    trip.AddStopTime(self.schedule.GetStop('BEATTY_AIRPORT'),
+                     stop_time='13:00:00')
+    trip.AddStopTime(self.schedule.GetStop('BULLFROG'), stop_time='14:00:00')
+    self.assertNotEquals(self.pattern_id, trip.pattern_id)
+    index = self.route.GetPatternIndex()
+    self.assertEquals(
+        ['AAMV1'],
+        [t.trip_id for t in index.GetPatternTrips(self.pattern_id).trips])
+    self.assertEquals(3, len(index.GetPatternIds()))
+
+  def testSortListOfTripByTime(self):
+    trips = [self.schedule.GetTrip(t) for t in ('AAMV3', 'AAMV1', 'AB2')]
+    transitfeed.SortListOfTripByTime(trips)
+    self.assertEquals(['AAMV1', 'AB2', 'AAMV3'], [t.trip_id for t in trips])
+
+  def testTimetable(self):
+    timetable = self.index.GetTimetable(self.pattern_id)
+    self.assertTrue(self.index.GetTimetable(self.pattern_id) is timetable)
+    self.assertEquals(['BEATTY_AIRPORT', 'AMV'],
+                      [s.stop_id for s in timetable.stops])
+    self.assertEquals(['AAMV1', 'AAMV3'], [t.trip_id for t in timetable.trips])
+    self.assertEquals([[8 * 3600, 9 * 3600], [13 * 3600, 14 * 3600]],
+                      timetable.arrivals)
+    self.assertEquals(timetable.arrivals, timetable.departures)
+    self.assertEquals(8 * 3600, timetable.start_time)
+    self.assertEquals(14 * 3600, timetable.end_time)
+    self.assertEquals([3600], timetable.GetTravelTimes())
+
+  def testTimetableUntimedStops(self):
+    timetable = transitfeed.PatternTimetable(
+        [], [], [[None, 100, None, 400]], [[50, None, None, 500]])
+    self.assertEquals(50, timetable.start_time)
+    self.assertEquals(500, timetable.end_time)
+    self.assertEquals([50, None, None], timetable.GetTravelTimes())
@@ -0,0 +1,79 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for the phasestats module.
+from __future__ import absolute_import
+
+import json
+from tests import util
+import transitfeed
+from transitfeed.compat import StringIO
+
+
+class PhaseStatsTestCase(util.TestCase):
+  def testRunPhase(self):
+    stats = transitfeed.PhaseStats()
+    result = stats.RunPhase('double', 3, lambda x: x * 2, 21)
+    self.assertEquals(42, result)
+    phase = stats.GetPhase('double')
+    self.assertEquals(3, phase.rows)
+    self.assertTrue(phase.wall_time >= 0)
+    self.assertEquals([phase], stats.GetPhaseList())
+
+  def testGetPhaseMissing(self):
+    stats = transitfeed.PhaseStats()
+    self.assertRaises(KeyError, stats.GetPhase, 'stops.txt')
+
+  def testRowsPerSecond(self):
+    phase = transitfeed.Phase('stops.txt')
+    phase.End(100)
+    phase.wall_time = 2.0
+    self.assertEquals(50.0, phase.GetRowsPerSecond())
+    phase.rows = 0
+    self.assertEquals(None, phase.GetRowsPerSecond())
+
+  def testWriteJson(self):
+    stats = transitfeed.PhaseStats()
+    stats.EndPhase(stats.StartPhase('a'), 1)
+    stats.EndPhase(stats.StartPhase('b'), 2)
+    output = StringIO()
+    stats.WriteJson(output)
+    phases = json.loads(output.getvalue())
+    self.assertEquals(['a', 'b'], [p['name'] for p in phases])
+    self.assertEquals([1, 2], [p['rows'] for p in phases])
+
+  def testNullPhaseStats(self):
+    self.assertEquals(
+        4, transitfeed.null_phase_stats.RunPhase('n', 0, lambda: 4))
+
+
+class LoadAndValidatePhasesTestCase(util.TestCase):
+  def testGoodFeedPhases(self):
+    stats = transitfeed.PhaseStats()
+    loader = transitfeed.Loader(
+        util.DataPath('good_feed.zip'),
+        problems=util.GetTestFailureProblemReporter(self),
+        extra_validation=True,
+        stats=stats)
+    schedule = loader.Load()
+    self.assertTrue(loader.GetStats() is stats)
+    names = [p.name for p in stats.GetPhaseList()]
+    for name in ('calendar.txt/calendar_dates.txt', 'stops.txt',
+                 'routes.txt', 'trips.txt', 'stop_times.txt',
+                 'ValidateStops', 'ValidateTrips', 'ValidateUnusedShapes'):
+      self.assertTrue(name in names, name)
+    self.assertEquals(len(schedule.stops), stats.GetPhase('stops.txt').rows)
+    self.assertEquals(len(schedule.trips), stats.GetPhase('ValidateTrips').rows)
+    for phase in stats.GetPhaseList():
+      self.assertTrue(phase.wall_time is not None)
@@ -62,6 +62,44 @@ class ProblemReporterTestCase(util.RedirectStdOutTestCaseBase):
     self.assertTrue(re.search(r"1111.+2222", self.this_stdout.getvalue()))
 
 
+class AggregatingProblemAccumulatorTestCase(util.TestCase):
+  def testCountsAndSamples(self):
+    accumulator = transitfeed.AggregatingProblemAccumulator(sample_size=3,
+                                                            random_seed=1)
+    pr = transitfeed.ProblemReporter(accumulator)
+    for i in range(100):
+      pr.SetFileContext('stops.txt', i + 2, [], [])
+      pr.InvalidValue('stop_lat', str(i))
+    pr.InvalidValue('stop_lon', 'x', type=transitfeed.TYPE_WARNING)
+    pr.OtherProblem('other')
+    self.assertEquals({('InvalidValue', transitfeed.TYPE_ERROR, 'stop_lat'): 100,
+                       ('InvalidValue', transitfeed.TYPE_WARNING, 'stop_lon'): 1,
+                       ('OtherProblem', transitfeed.TYPE_ERROR, None): 1},
+                      accumulator.GetCounts())
+    samples = accumulator.GetSamples('InvalidValue', transitfeed.TYPE_ERROR,
+                                     'stop_lat')
+    self.assertEquals(3, len(samples))
+    self.assertEquals(3, len(set(e.value for e in samples)))
+    for e in samples:
+      self.assertEquals(int(e.value) + 2, e.row_num)
+    self.assertEquals(101, accumulator.ErrorCount())
+    self.assertEquals(1, accumulator.WarningCount())
+    self.assertFalse(accumulator.HasNotices())
+
+  def testSuppressedProblemsAreNotBuilt(self):
+    class NotBuiltAccumulator(transitfeed.AggregatingProblemAccumulator):
+      def _Report(self, e):
+        raise AssertionError('%s was built' % e.__class__.__name__)
+
+    accumulator = NotBuiltAccumulator(sample_size=0)
+    pr = transitfeed.ProblemReporter(accumulator)
+    for i in range(10):
+      pr.InvalidValue('stop_lat', str(i))
+      pr.MissingValue('stop_name')
+      pr.TooFastTravel('trip', 'a', 'b', 1000, 10, 360)
+    self.assertEquals(30, accumulator.ErrorCount())
+
+
 class BadProblemReporterTestCase(util.RedirectStdOutTestCaseBase):
   """Make sure ProblemReporter doesn't crash when given bad unicode data and
   does find some error"""
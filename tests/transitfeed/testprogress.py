@@ -0,0 +1,108 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for the progress module.
+from __future__ import absolute_import
+
+from tests import util
+import transitfeed
+from transitfeed.compat import StringIO
+
+
+class RecordingProgressReporter(transitfeed.ProgressReporter):
+  """Records every report, calling Update for each row."""
+
+  def __init__(self):
+    transitfeed.ProgressReporter.__init__(self, update_every=1,
+                                          min_interval=0)
+    self.reports = []
+
+  def Report(self, name, count, total, rate, finished):
+    self.reports.append((name, count, total, finished))
+
+  def GetFinished(self):
+    """Return a dict mapping phase name to (count, total) of ended phases."""
+    return dict((name, (count, total))
+                for name, count, total, finished in self.reports if finished)
+
+
+class ProgressReporterTestCase(util.TestCase):
+  def testCallback(self):
+    reports = []
+    def Callback(name, count, total, rate, finished):
+      reports.append((name, count, total, finished))
+    progress = transitfeed.ProgressReporter(Callback, update_every=2,
+                                            min_interval=0)
+    next_progress = progress.StartPhase('stops.txt', 5)
+    for count in range(1, 6):
+      if count == next_progress:
+        next_progress = progress.Update(count)
+    progress.EndPhase(5)
+    self.assertEquals([('stops.txt', 2, 5, False),
+                       ('stops.txt', 4, 5, False),
+                       ('stops.txt', 5, 5, True)], reports)
+
+  def testMinInterval(self):
+    progress = RecordingProgressReporter()
+    progress._min_interval = 3600
+    progress.StartPhase('stops.txt')
+    self.assertEquals(2, progress.Update(1))
+    progress.EndPhase(1)
+    self.assertEquals([('stops.txt', 1, None, True)], progress.reports)
+
+  def testFormatProgress(self):
+    self.assertEquals('trips.txt: 50 of ~200 (25%), 10/s',
+                      transitfeed.FormatProgress('trips.txt', 50, 200, 10.0))
+    self.assertEquals('trips.txt: 50',
+                      transitfeed.FormatProgress('trips.txt', 50, None, None))
+
+  def testConsoleProgressReporter(self):
+    output = StringIO()
+    progress = transitfeed.ConsoleProgressReporter(output)
+    progress.StartPhase('routes.txt', 4)
+    progress.EndPhase(4)
+    self.assertTrue(output.getvalue().startswith('\rroutes.txt: 4 of ~4 '))
+    self.assertTrue(output.getvalue().endswith('\n'))
+
+  def testNullProgressReporter(self):
+    null = transitfeed.null_progress_reporter
+    self.assertFalse(null.enabled)
+    self.assertTrue(null.StartPhase('stops.txt') > 10 ** 9)
+
+
+class LoadValidateWriteProgressTestCase(util.TestCase):
+  def testGoodFeed(self):
+    progress = RecordingProgressReporter()
+    loader = transitfeed.Loader(
+        util.DataPath('good_feed.zip'),
+        problems=util.GetTestFailureProblemReporter(self),
+        extra_validation=True,
+        progress=progress)
+    schedule = loader.Load()
+    finished = progress.GetFinished()
+    self.assertEquals(len(schedule.stops), finished['stops.txt'][0])
+    # The estimated total of a file is its number of lines
+    self.assertTrue(finished['stops.txt'][1] >= len(schedule.stops))
+    self.assertTrue('stop_times.txt' in finished)
+    self.assertEquals((len(schedule.trips), len(schedule.trips)),
+                      finished['ValidateTrips'])
+    self.assertTrue('ValidateUnusedShapes' in finished)
+
+    progress = RecordingProgressReporter()
+    schedule.WriteGoogleTransitFeed(StringIO(), progress)
+    finished = progress.GetFinished()
+    self.assertEquals((len(schedule.trips), len(schedule.trips)),
+                      finished['stop_times.txt'])
+    self.assertEquals((len(schedule.stops), len(schedule.stops)),
+                      finished['stops.txt'])
@@ -18,6 +18,7 @@ from __future__ import absolute_import
 from datetime import date
 import re
 from tests import util
+import threading
 import time
 import transitfeed
 
@@ -987,3 +988,90 @@ class ServiceGapsTestCase(util.MemoryZipTestCase):
     self.accumulator.AssertNoMoreExceptions()
 
 
+class MakeThreadSafeTestCase(util.TestCase):
+  def testReadFromThreads(self):
+    schedule = transitfeed.Loader(
+        util.DataPath('good_feed.zip'),
+        problems=util.GetTestFailureProblemReporter(self)).Load()
+    expected = dict((t.trip_id, t.GetTimeStops())
+                    for t in schedule.GetTripList())
+    schedule.MakeThreadSafe()
+    schedule.MakeThreadSafe()  # Calling it twice is harmless
+    results = []
+    def Read():
+      for i in range(20):
+        for trip in schedule.GetTripList():
+          time_stops = expected[trip.trip_id]
+          results.append(trip.GetTimeStops() == time_stops)
+          results.append(trip.GetCountStopTimes() == len(time_stops))
+    threads = [threading.Thread(target=Read) for i in range(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEquals(4 * 20 * len(expected) * 2, len(results))
+    self.assertTrue(all(results))
+
+  def testLockingCursor(self):
+    schedule = transitfeed.Schedule()
+    schedule.MakeThreadSafe()
+    cursor = schedule._connection.cursor()
+    cursor.execute('SELECT count(*) FROM stop_times')
+    self.assertEquals((0,), cursor.fetchone())
+    self.assertEquals(None, cursor.fetchone())
+    cursor.execute('DELETE FROM stop_times WHERE trip_id=?', ('t',))
+    self.assertEquals(0, cursor.rowcount)
+
+
+class GenerationTestCase(util.TestCase):
+  def runTest(self):
+    schedule = transitfeed.Schedule()
+    other = transitfeed.Schedule()
+    self.assertNotEquals(schedule.GetGeneration(), other.GetGeneration())
+    generations = [schedule.GetGeneration()]
+    schedule.AddAgency('Demo Agency', 'http://example.com',
+                       'America/Los_Angeles')
+    generations.append(schedule.GetGeneration())
+    route = schedule.AddRoute('A', 'Demo Route', 'Bus')
+    generations.append(schedule.GetGeneration())
+    stop = schedule.AddStop(36.9, -116.7, 'Demo Stop')
+    generations.append(schedule.GetGeneration())
+    trip = route.AddTrip(schedule)
+    generations.append(schedule.GetGeneration())
+    trip.AddStopTime(stop, stop_time='10:00:00')
+    generations.append(schedule.GetGeneration())
+    schedule.MarkChanged()
+    generations.append(schedule.GetGeneration())
+    self.assertEquals(len(generations), len(set(generations)))
+    self.assertEquals(schedule.GetGeneration(), schedule.GetGeneration())
+
+
+class BuildIndexesTestCase(util.TestCase):
+  def _Load(self):
+    return transitfeed.Loader(
+        util.DataPath('good_feed.zip'),
+        problems=util.GetTestFailureProblemReporter(self)).Load()
+
+  def testBuildIndexes(self):
+    schedule = self._Load()
+    schedule.BuildIndexes()
+    self.assertTrue(schedule._departure_index is not None)
+    self.assertTrue(schedule._stop_search_index is not None)
+    self.assertTrue(schedule._tile_index is not None)
+    for route in schedule.GetRouteList():
+      self.assertTrue(route._pattern_index is not None)
+
+
+class GetTimeStopsOfTripsTestCase(util.TestCase):
+  def runTest(self):
+    schedule = transitfeed.Loader(
+        util.DataPath('good_feed.zip'),
+        problems=util.GetTestFailureProblemReporter(self)).Load()
+    schedule._MAX_TRIPS_PER_QUERY = 2
+    trip_ids = ['AB1', 'AAMV1', 'STBA', 'CITY1']
+    time_stops = schedule.GetTimeStopsOfTrips(trip_ids + ['AB1'])
+    self.assertEquals(sorted(trip_ids), sorted(time_stops.keys()))
+    for trip_id in trip_ids:
+      self.assertEquals(schedule.GetTrip(trip_id).GetTimeStops(),
+                        time_stops[trip_id])
+    self.assertEquals({}, schedule.GetTimeStopsOfTrips([]))
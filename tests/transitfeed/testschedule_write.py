@@ -17,6 +17,7 @@ from __future__ import absolute_import
 
 from tests import util
 import transitfeed
+import zipfile
 
 
 class MinimalWriteTestCase(util.TempFileTestCaseBase):
@@ -70,6 +71,48 @@ class MinimalWriteTestCase(util.TempFileTestCaseBase):
     schedule.WriteGoogleTransitFeed(self.tempfilepath)
 
 
+class WriteArchiveFilesTestCase(util.TempFileTestCaseBase):
+  """Tests for the files written through temporary files."""
+
+  def testStopTimesAndShapes(self):
+    schedule = transitfeed.Schedule(
+        problem_reporter=util.ExceptionProblemReporterNoExpiration())
+    schedule.Load(util.DataPath('good_feed'))
+    shape = transitfeed.Shape('shape1')
+    shape.AddPoint(36.9, -116.7)
+    shape.AddPoint(36.8, -116.8)
+    schedule.AddShapeObject(shape)
+    schedule.WriteGoogleTransitFeed(self.tempfilepath)
+
+    archive = zipfile.ZipFile(self.tempfilepath)
+    for filename in ('stop_times.txt', 'shapes.txt', 'stops.txt'):
+      info = archive.getinfo(filename)
+      self.assertEqual(zipfile.ZIP_DEFLATED, info.compress_type)
+      self.assertEqual(0o666, info.external_attr >> 16)
+    lines = archive.read('stop_times.txt').splitlines()
+    self.assertEqual(
+        'trip_id,arrival_time,departure_time,stop_id,stop_sequence,'
+        'stop_headsign,pickup_type,drop_off_type,shape_dist_traveled,'
+        'timepoint', lines[0])
+    self.assertEqual(sum(len(t.GetStopTimes()) for t in schedule.GetTripList()),
+                     len(lines) - 1)
+    self.assertEqual(
+        ['shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence,'
+         'shape_dist_traveled', 'shape1,36.9,-116.7,1,', 'shape1,36.8,-116.8,2,'],
+        archive.read('shapes.txt').splitlines())
+    archive.close()
+
+  def testNoShapes(self):
+    schedule = transitfeed.Schedule(
+        problem_reporter=util.ExceptionProblemReporterNoExpiration())
+    schedule.Load(util.DataPath('good_feed'))
+    schedule.WriteGoogleTransitFeed(self.tempfilepath)
+    archive = zipfile.ZipFile(self.tempfilepath)
+    self.assertTrue('stop_times.txt' in archive.namelist())
+    self.assertFalse('shapes.txt' in archive.namelist())
+    archive.close()
+
+
 class ScheduleBuilderTestCase(util.TempFileTestCaseBase):
   """Tests for using a Schedule object to build a GTFS file."""
 
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for the stopsearch module.
+from __future__ import absolute_import
+
+from tests import util
+import transitfeed
+
+
+class NormalizeSearchTextTestCase(util.TestCase):
+  def runTest(self):
+    self.assertEquals(u'cafe', transitfeed.NormalizeSearchText(u'Caf\xe9'))
+    self.assertEquals(u'cafe', transitfeed.NormalizeSearchText('CAF\xc3\x89'))
+    self.assertEquals(u'', transitfeed.NormalizeSearchText(None))
+
+
+class StopSearchIndexTestCase(util.TestCase):
+  def setUp(self):
+    stops = []
+    for stop_id, name in (('S1', u'Main Street'),
+                          ('S2', u'Main'),
+                          ('S3', u'Old Mainline Depot'),
+                          ('S4', u'G\xe9n\xe9ral Leclerc'),
+                          ('MAIN5', u'Harbour'),
+                          ('S6', u'Domain Road')):
+      stops.append(transitfeed.Stop(lat=36.9, lng=-116.7, name=name,
+                                    stop_id=stop_id))
+    self.index = transitfeed.StopSearchIndex(stops)
+
+  def assertMatches(self, expected_stop_ids, query, limit=None):
+    self.assertEquals(expected_stop_ids,
+                      [s.stop_id for s in self.index.Search(query, limit)])
+
+  def testRanking(self):
+    # Exact name, then prefixes of name or id, then word prefix, then
+    # anywhere in the name
+    self.assertMatches(['S2', 'MAIN5', 'S1', 'S3', 'S6'], 'main')
+
+  def testLimit(self):
+    self.assertMatches(['S2', 'MAIN5'], 'MAIN', limit=2)
+
+  def testAccentsAndCase(self):
+    self.assertMatches(['S4'], 'general')
+    self.assertMatches(['S4'], u'G\xc9N\xc9RAL lec')
+    self.assertMatches(['S4'], 'g\xc3\xa9n\xc3\xa9ral')
+
+  def testShortQueryMatchesWordStart(self):
+    self.assertMatches(['S4'], 'le')
+    self.assertMatches(['MAIN5', 'S2', 'S1', 'S3'], 'M')
+    self.assertMatches(['S4'], 's4')
+
+  def testNoMatch(self):
+    self.assertMatches([], 'xyz')
+    self.assertMatches([], 'street main')
+    self.assertMatches([], '  ')
+
+
+class ScheduleStopSearchIndexTestCase(util.TestCase):
+  def runTest(self):
+    schedule = transitfeed.Schedule()
+    schedule.AddStop(36.9, -116.7, u'Furnace Creek Resort')
+    index = schedule.GetStopSearchIndex()
+    self.assertTrue(schedule.GetStopSearchIndex() is index)
+    self.assertEquals(1, len(index.Search('creek')))
+    schedule.AddStop(36.9, -116.7, u'Furnace Creek Airport')
+    self.assertEquals(
+        [u'Furnace Creek Airport', u'Furnace Creek Resort'],
+        [s.stop_name for s in schedule.GetStopSearchIndex().Search('creek')])
+
+
+class ScheduleStopSearchIndexReplacedStopTestCase(util.TestCase):
+  def runTest(self):
+    schedule = transitfeed.Schedule()
+    stop = schedule.AddStop(36.9, -116.7, u'Bullfrog')
+    self.assertEquals([stop], schedule.GetStopSearchIndex().Search('frog'))
+    # Replacing a stop doesn't change the number of stops
+    del schedule.stops[stop.stop_id]
+    new_stop = transitfeed.Stop(36.9, -116.7, u'Froggy Stop', stop.stop_id)
+    schedule.AddStopObject(new_stop)
+    self.assertEquals([new_stop],
+                      schedule.GetStopSearchIndex().Search('frog'))
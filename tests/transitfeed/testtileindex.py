@@ -0,0 +1,121 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for the tileindex module.
+from __future__ import absolute_import
+
+import math
+from tests import util
+import transitfeed
+from transitfeed import tileindex
+
+
+def TileOf(lat, lng, zoom):
+  x, y = tileindex.LatLngToWorld(lat, lng)
+  return int(x * (1 << zoom)), int(y * (1 << zoom))
+
+
+class ProjectionTestCase(util.TestCase):
+  def testRoundTrip(self):
+    for lat, lng in ((0, 0), (36.9, -116.7), (-33.9, 151.2)):
+      x, y = tileindex.LatLngToWorld(lat, lng)
+      back_lat, back_lng = tileindex.WorldToLatLng(x, y)
+      self.assertAlmostEqual(lat, back_lat, 9)
+      self.assertAlmostEqual(lng, back_lng, 9)
+
+  def testTileBounds(self):
+    north, east, south, west = tileindex.GetTileBounds(1, 0, 0)
+    self.assertAlmostEqual(tileindex.MAX_LATITUDE, north, 6)
+    self.assertAlmostEqual(0, east)
+    self.assertAlmostEqual(0, south)
+    self.assertAlmostEqual(-180, west)
+
+
+class SimplifyPointsTestCase(util.TestCase):
+  def testStraightLine(self):
+    points = [(0, 0), (1, 0.001), (2, 0), (3, 0)]
+    self.assertEquals([(0, 0), (3, 0)], tileindex.SimplifyPoints(points, 0.01))
+    self.assertEquals(points, tileindex.SimplifyPoints(points, 0.0001))
+
+  def testKeepsCorner(self):
+    points = [(0, 0), (1, 0), (1, 1), (2, 1)]
+    self.assertEquals(points, tileindex.SimplifyPoints(points, 0.1))
+
+
+class TileIndexTestCase(util.TestCase):
+  def setUp(self):
+    self.schedule = transitfeed.Schedule()
+    self.schedule.AddAgency('Demo Agency', 'http://example.com',
+                            'America/Los_Angeles')
+    self.stop_a = self.schedule.AddStop(36.900, -116.700, 'A')
+    self.stop_b = self.schedule.AddStop(36.905, -116.705, 'B')
+    self.stop_c = self.schedule.AddStop(36.950, -116.600, 'C')
+    shape = transitfeed.Shape('shape1')
+    for i in range(11):
+      # A straight line with a small bump in the middle
+      shape.AddPoint(36.9 + i * 0.01, -116.7 + (0.0001 if i == 5 else 0))
+    self.schedule.AddShapeObject(shape)
+    route = self.schedule.AddRoute('1', 'Route', 'Bus')
+    route.route_color = 'ff0000'
+    trip = route.AddTrip(self.schedule)
+    trip.shape_id = 'shape1'
+    self.index = self.schedule.GetTileIndex()
+
+  def testWorldTileHasAllShapesAndThinnedStops(self):
+    stops = self.index.GetTileStops(0, 0, 0)
+    # All stops are within a few pixels at zoom 0
+    self.assertEquals(1, len(stops))
+    x, y = TileOf(36.9, -116.7, 12)
+    self.assertEquals(2, len(self.index.GetTileStops(12, x, y)))
+    shapes = self.index.GetTileShapes(0, 0, 0)
+    self.assertEquals(1, len(shapes))
+    shape_id, color, points = shapes[0]
+    self.assertEquals(('shape1', 'ff0000'), (shape_id, color))
+    # Simplified to the first and last point
+    self.assertEquals(2, len(points))
+    self.assertAlmostEqual(36.9, points[0][0], 6)
+    self.assertAlmostEqual(37.0, points[-1][0], 6)
+
+  def testHighZoom(self):
+    x, y = TileOf(36.9, -116.7, 17)
+    stop_ids = [s.stop_id for s in self.index.GetTileStops(17, x, y)]
+    self.assertEquals([self.stop_a.stop_id], stop_ids)
+    x, y = TileOf(36.95, -116.7, 17)
+    self.assertEquals([], self.index.GetTileStops(17, x, y))
+    shapes = self.index.GetTileShapes(17, x, y)
+    self.assertEquals(1, len(shapes))
+    # All points of the shape near the tile are kept at this zoom
+    self.assertTrue(len(shapes[0][2]) >= 2)
+
+  def testEmptyTile(self):
+    x, y = TileOf(-33.9, 151.2, 10)
+    self.assertEquals([], self.index.GetTileStops(10, x, y))
+    self.assertEquals([], self.index.GetTileShapes(10, x, y))
+
+  def testAllStopsAtHighZoom(self):
+    found = set()
+    for lat, lng in ((36.900, -116.700), (36.905, -116.705),
+                     (36.950, -116.600)):
+      x, y = TileOf(lat, lng, 14)
+      found.update(s.stop_id for s in self.index.GetTileStops(14, x, y))
+    self.assertEquals(3, len(found))
+
+  def testRebuiltAfterChange(self):
+    self.assertTrue(self.schedule.GetTileIndex() is self.index)
+    self.schedule.AddStop(-33.9, 151.2, 'D')
+    index = self.schedule.GetTileIndex()
+    self.assertFalse(index is self.index)
+    x, y = TileOf(-33.9, 151.2, 10)
+    self.assertEquals(['D'],
+                      [s.stop_name for s in index.GetTileStops(10, x, y)])
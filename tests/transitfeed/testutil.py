@@ -252,6 +252,39 @@ class NonNegIntStringToIntTestCase(test_util.TestCase):
     accumulator.AssertNoMoreExceptions()
 
 
+class LruCacheTestCase(test_util.TestCase):
+  def testDropsLeastRecentlyUsed(self):
+    cache = util.LruCache(2)
+    cache.Set('a', 1)
+    cache.Set('b', 2)
+    self.assertEqual(1, cache.Get('a'))
+    cache.Set('c', 3)
+    self.assertEqual(2, len(cache))
+    self.assertEqual(None, cache.Get('b'))
+    self.assertEqual(1, cache.Get('a'))
+    self.assertEqual(3, cache.Get('c'))
+
+  def testReplaceValue(self):
+    cache = util.LruCache(2)
+    cache.Set('a', 1)
+    cache.Set('b', 2)
+    cache.Set('a', 10)
+    cache.Set('c', 3)
+    self.assertEqual(10, cache.Get('a'))
+    self.assertEqual('x', cache.Get('b', 'x'))
+
+  def testClearAndZeroSize(self):
+    cache = util.LruCache(2)
+    cache.Set('a', 1)
+    cache.Clear()
+    self.assertEqual(0, len(cache))
+    cache.Set('b', 2)
+    self.assertEqual(2, cache.Get('b'))
+    disabled = util.LruCache(0)
+    disabled.Set('a', 1)
+    self.assertEqual(None, disabled.Get('a'))
+
+
 class CheckVersionTestCase(test_util.TempDirTestCaseBase):
   def setUp(self):
     self.orig_urlopen = urllib2.urlopen
@@ -66,14 +66,19 @@ from __future__ import absolute_import
 # TODO: Solve this problem cleanly
 from .util import *
 from .agency import *
+from .departureindex import *
 from .fareattribute import *
 from .farerule import *
+from .feeddiff import *
 from .frequency import *
 from .gtfsfactory import *
 from .gtfsfactoryuser import *
 from .gtfsobjectbase import *
 from .loader import *
+from .patternindex import *
+from .phasestats import *
 from .problems import *
+from .progress import *
 from .route import *
 from .schedule import *
 from .serviceperiod import *
@@ -82,7 +87,9 @@ from .shapelib import *
 from .shapeloader import *
 from .shapepoint import *
 from .stop import *
+from .stopsearch import *
 from .stoptime import *
+from .tileindex import *
 from .transfer import *
 from .trip import *
 
@@ -0,0 +1,99 @@
+#!/usr/bin/python2.5
+
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+import bisect
+
+from .util import defaultdict
+
+
+class DepartureIndex(object):
+  """The departures from every stop of a schedule, sorted by time.
+
+  Each departure is a tuple (secs, trip, index, is_timepoint, headsign) where
+  secs is the possibly interpolated time in seconds since midnight, index is
+  the offset of the stop in trip.GetStopTimes() and headsign is the most
+  recent stop_headsign of the trip or, if there is none, its trip_headsign.
+
+  The index is built from all trips at once, which is much faster than
+  finding the trips of each stop with Stop.GetStopTimeTrips. It isn't updated
+  when the schedule changes.
+  """
+
+  def __init__(self, schedule):
+    self._schedule = schedule
+    # {stop_id: [departure tuple, ...]} sorted by time
+    self._departures = {}
+    # {stop_id: [secs, ...]} the times of _departures, for bisect
+    self._times = {}
+    self._Build()
+
+  def _Build(self):
+    departures = defaultdict(list)
+    for trip in self._schedule.GetTripList():
+      try:
+        time_stops = trip.GetTimeInterpolatedStops()
+      except ValueError:
+        # A trip without times at the first and last stop is reported by
+        # validation. Leave it out instead of failing for every stop.
+        continue
+      headsign = None
+      for index, (secs, stoptime, is_timepoint) in enumerate(time_stops):
+        if stoptime.stop_headsign:
+          headsign = stoptime.stop_headsign
+        departures[stoptime.stop_id].append(
+            (secs, trip, index, is_timepoint, headsign or trip.trip_headsign))
+    for stop_id, stop_departures in departures.items():
+      stop_departures.sort(key=lambda d: (d[0], d[1].trip_id, d[2]))
+      self._departures[stop_id] = stop_departures
+      self._times[stop_id] = [d[0] for d in stop_departures]
+
+  def GetDepartureCount(self, stop_id):
+    """Return the number of departures from stop_id on all days."""
+    return len(self._departures.get(stop_id, ()))
+
+  def GetDepartures(self, stop_id, time=0, date=None, limit=None):
+    """Return departures from a stop at or after a time.
+
+    Args:
+      stop_id: the stop_id of a stop
+      time: seconds since midnight of the earliest departure to return
+      date: a date string in the format YYYYMMDD; if given only departures
+        of trips with service on this date are returned
+      limit: the maximum number of departures to return, or None for all
+
+    Returns:
+      a list of departure tuples sorted by time
+    """
+    departures = self._departures.get(stop_id)
+    if not departures:
+      return []
+    result = []
+    is_active = {}  # {service_id: bool}
+    for i in range(bisect.bisect_left(self._times[stop_id], time),
+                   len(departures)):
+      departure = departures[i]
+      if date:
+        service_id = departure[1].service_id
+        if service_id not in is_active:
+          is_active[service_id] = self._schedule.GetServicePeriod(
+              service_id).IsActiveOn(date)
+        if not is_active[service_id]:
+          continue
+      result.append(departure)
+      if limit and len(result) >= limit:
+        break
+    return result
@@ -0,0 +1,840 @@
+#!/usr/bin/python2.5
+
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Differences between two versions of a feed.
+
+A feed which is published every day usually differs very little from the
+previous day's feed. DiffFeeds finds the rows which were added, removed or
+changed in each file and FeedDiff.ApplyToSchedule applies them to a Schedule
+loaded from the old feed, so that the new feed doesn't have to be loaded and
+validated from scratch.
+
+Files are compared without parsing when their contents are the same. Other
+files are read row by row, the rows of both versions are sorted by the key
+columns of the file and the two sorted sequences are walked side by side.
+Rows are sorted in chunks of _SORT_CHUNK_SIZE rows which are kept in
+temporary files and merged, so large files such as stop_times.txt aren't
+held in memory. Only the rows which differ are kept.
+
+Only the objects which were changed, and the trips which use them, are
+validated when a diff is applied. Checks of the whole schedule, such as
+stops which are too close to each other or overlapping blocks, are not done;
+use Schedule.Validate for them.
+"""
+
+from __future__ import absolute_import
+import codecs
+import csv
+import heapq
+import itertools
+import os
+import tempfile
+import zipfile
+
+from . import gtfsfactoryuser
+from . import problems as problems_module
+from . import util
+from .compat import pickle
+from .compat import StringIO
+
+# The columns which identify a row of each file. The rows of files which
+# aren't listed are identified by all their values, so a changed row is
+# reported as a removed row and an added row.
+_KEY_COLUMNS = {
+    'agency.txt': ('agency_id',),
+    'stops.txt': ('stop_id',),
+    'routes.txt': ('route_id',),
+    'trips.txt': ('trip_id',),
+    'stop_times.txt': ('trip_id', 'stop_sequence'),
+    'calendar.txt': ('service_id',),
+    'calendar_dates.txt': ('service_id', 'date'),
+    'fare_attributes.txt': ('fare_id',),
+    'shapes.txt': ('shape_id', 'shape_pt_sequence'),
+    'frequencies.txt': ('trip_id', 'start_time'),
+    }
+
+# Maximum number of values in one query of the stop_times table, below the
+# default limit of 999 parameters in an SQLite statement
+_MAX_VALUES_PER_QUERY = 500
+
+# Number of rows of a file sorted in memory at a time by _SortRows
+_SORT_CHUNK_SIZE = 100000
+
+# Number of bytes read at a time when comparing files
+_READ_BLOCK_SIZE = 1 << 16
+
+
+class FeedDiffError(problems_module.Error):
+  """A FeedDiff can't be applied to a Schedule."""
+  pass
+
+
+class TableDiff(object):
+  """The rows of one file which differ between two feeds.
+
+  Rows are dicts mapping column name to a unicode value, with whitespace
+  stripped like the Loader does.
+
+  Attributes:
+    file_name: the name of the file, such as 'stops.txt'
+    header: list of the columns of the new file, or of the old file if the
+      file was removed
+    added: list of (line number in the new file, row) of added rows
+    removed: list of rows of the old file which were removed
+    changed: list of (old row, line number in the new file, new row) of rows
+      with the same key and different values
+  """
+
+  def __init__(self, file_name, header):
+    self.file_name = file_name
+    self.header = header
+    self.added = []
+    self.removed = []
+    self.changed = []
+
+  def IsEmpty(self):
+    return not (self.added or self.removed or self.changed)
+
+  def GetChangeCount(self):
+    """Return the number of added, removed and changed rows."""
+    return len(self.added) + len(self.removed) + len(self.changed)
+
+  def GetRowsToRemove(self):
+    """Return the old rows which are removed or changed."""
+    return self.removed + [old_row for old_row, _, _ in self.changed]
+
+  def GetRowsToAdd(self):
+    """Return (line number, row) of the new rows which are added or
+    changed."""
+    return self.added + [(line_num, row) for _, line_num, row in self.changed]
+
+  def GetFileContext(self, line_num, row):
+    """Return a file context for a problem reporter for a new row."""
+    return (self.file_name, line_num, [row.get(c, u'') for c in self.header],
+            self.header)
+
+
+class FeedDiff(object):
+  """The differences between two feeds, as returned by DiffFeeds."""
+
+  def __init__(self):
+    # {file name: TableDiff} of the files with differences
+    self._tables = {}
+
+  def AddTableDiff(self, table_diff):
+    if not table_diff.IsEmpty():
+      self._tables[table_diff.file_name] = table_diff
+
+  def GetTableDiff(self, file_name):
+    """Return the TableDiff of a file or None if it didn't change."""
+    return self._tables.get(file_name)
+
+  def GetFileNames(self):
+    """Return a sorted list of the names of the files which changed."""
+    return sorted(self._tables.keys())
+
+  def IsEmpty(self):
+    return not self._tables
+
+  def GetChangeCount(self):
+    """Return the number of added, removed and changed rows of all files."""
+    return sum(t.GetChangeCount() for t in self._tables.values())
+
+  def ApplyToSchedule(self, schedule, problems=None):
+    """Change a schedule loaded from the old feed to match the new feed.
+
+    The changed objects are validated and problems are reported with the line
+    numbers of the new feed.
+
+    Args:
+      schedule: a Schedule loaded from the old feed passed to DiffFeeds
+      problems: a ProblemReporter, the problem reporter of the schedule is
+        used if None
+
+    Returns:
+      a dict mapping 'agency', 'stops', 'routes', 'trips', 'service_periods',
+      'shapes' and 'fares' to the set of ids of the objects that were added,
+      removed or changed. The set of trip ids also includes the trips which
+      were validated again because a stop, route or shape they use changed.
+
+    Raises:
+      FeedDiffError: a file which can't be updated incrementally changed. The
+        schedule isn't changed.
+    """
+    return _FeedDiffApplier(schedule, self, problems).Apply()
+
+
+def DiffFeeds(old_feed, new_feed, gtfs_factory=None):
+  """Return a FeedDiff with the differences between two feeds.
+
+  Only the files known to gtfs_factory are compared.
+
+  Args:
+    old_feed: the path of a zip file or directory, a zipfile.ZipFile or a
+      file-like object with a zip file
+    new_feed: the newer version of the feed, like old_feed
+    gtfs_factory: a GtfsFactory, or None to use the default
+  """
+  if gtfs_factory is None:
+    gtfs_factory = gtfsfactoryuser.GtfsFactoryUser().GetGtfsFactory()
+  old_archive = _FeedArchive(old_feed)
+  new_archive = _FeedArchive(new_feed)
+  known_file_names = set(gtfs_factory.GetKnownFilenames())
+  file_names = ((set(old_archive.GetFileNames()) |
+                 set(new_archive.GetFileNames())) & known_file_names)
+
+  feed_diff = FeedDiff()
+  for file_name in sorted(file_names):
+    old_fingerprint = old_archive.GetFingerprint(file_name)
+    if (old_fingerprint is not None and
+        old_fingerprint == new_archive.GetFingerprint(file_name)):
+      continue
+    if _FilesEqual(old_archive, new_archive, file_name):
+      continue
+    old_file = old_archive.Open(file_name)
+    new_file = new_archive.Open(file_name)
+    try:
+      feed_diff.AddTableDiff(_DiffTable(file_name, old_file, new_file))
+    finally:
+      for data_file in (old_file, new_file):
+        if data_file is not None:
+          data_file.close()
+  return feed_diff
+
+
+class _FeedArchive(object):
+  """Reads the files of a feed in a zip file or directory."""
+
+  def __init__(self, feed):
+    self._zip = None
+    self._path = None
+    if isinstance(feed, zipfile.ZipFile):
+      self._zip = feed
+    elif not isinstance(feed, basestring):
+      self._zip = zipfile.ZipFile(feed, mode='r')
+    elif os.path.isdir(feed):
+      self._path = feed
+    else:
+      self._zip = zipfile.ZipFile(feed, mode='r')
+
+  def GetFileNames(self):
+    if self._zip:
+      return self._zip.namelist()
+    return [n for n in os.listdir(self._path)
+            if os.path.isfile(os.path.join(self._path, n))]
+
+  def GetFingerprint(self, file_name):
+    """Return the CRC and size of a file in a zip file, or None."""
+    if not self._zip:
+      return None
+    try:
+      info = self._zip.getinfo(file_name)
+    except KeyError:
+      return None
+    return (info.CRC, info.file_size)
+
+  def Open(self, file_name):
+    """Return a binary file object of a file or None if it doesn't exist."""
+    if self._zip:
+      try:
+        return self._zip.open(file_name)
+      except KeyError:
+        return None
+    try:
+      return open(os.path.join(self._path, file_name), 'rb')
+    except IOError:
+      return None
+
+
+def _FilesEqual(old_archive, new_archive, file_name):
+  """Return True if the contents of a file are the same in two archives."""
+  old_file = old_archive.Open(file_name)
+  new_file = new_archive.Open(file_name)
+  try:
+    if old_file is None or new_file is None:
+      return old_file is new_file
+    while True:
+      old_block = old_file.read(_READ_BLOCK_SIZE)
+      if old_block != new_file.read(_READ_BLOCK_SIZE):
+        return False
+      if not old_block:
+        return True
+  finally:
+    for data_file in (old_file, new_file):
+      if data_file is not None:
+        data_file.close()
+
+
+def _ReadRows(data_file):
+  """Return (header, rows) of a CSV file.
+
+  rows is an iterator of (line number, list of values) with a value for each
+  column of header, which reads data_file as it goes. Values are decoded and
+  stripped like Loader._ReadCsvDict does, problems are left for the
+  validation of the objects. A UTF-16 file is decoded whole.
+
+  Args:
+    data_file: a binary file object, or None for a missing file
+  """
+  if data_file is None:
+    return [], iter([])
+  lines = iter(data_file)
+  first_line = next(lines, '')
+  if first_line[0:2] in (codecs.BOM_UTF16_BE, codecs.BOM_UTF16_LE):
+    contents = ''.join(itertools.chain([first_line], lines))
+    contents = codecs.getdecoder('utf-16')(contents)[0].encode('utf-8')
+    lines = StringIO(contents)
+    first_line = next(lines, '')
+  if first_line.startswith(codecs.BOM_UTF8):
+    first_line = first_line[len(codecs.BOM_UTF8):]
+  reader = csv.reader(itertools.chain([first_line], lines),
+                      skipinitialspace=True)
+  try:
+    raw_header = next(reader)
+  except StopIteration:
+    return [], iter([])
+  header = []
+  valid_columns = []
+  for i, h in enumerate(raw_header):
+    if h.strip():
+      header.append(h.strip())
+      valid_columns.append(i)
+
+  def GenerateRows():
+    line_num = 1
+    for raw_row in reader:
+      line_num += 1
+      if not raw_row:
+        continue
+      values = []
+      for i in valid_columns:
+        if i < len(raw_row):
+          values.append(raw_row[i].decode('utf-8', 'replace').strip())
+        else:
+          values.append(u'')
+      yield line_num, values
+
+  return header, GenerateRows()
+
+
+def _DiffTable(file_name, old_file, new_file):
+  """Return a TableDiff of two versions of a file.
+
+  Args:
+    file_name: the name of the file, such as 'stops.txt'
+    old_file: a binary file object of the old version or None
+    new_file: a binary file object of the new version or None
+  """
+  old_header, old_rows = _ReadRows(old_file)
+  new_header, new_rows = _ReadRows(new_file)
+  key_columns = (_KEY_COLUMNS.get(file_name) or
+                 sorted(set(old_header) | set(new_header)))
+  old_sorted = _SortRows(old_header, old_rows, key_columns)
+  new_sorted = _SortRows(new_header, new_rows, key_columns)
+  same_header = old_header == new_header
+
+  table_diff = TableDiff(file_name, new_header or old_header)
+  old_item = next(old_sorted, None)
+  new_item = next(new_sorted, None)
+  while old_item is not None or new_item is not None:
+    if new_item is None or (old_item is not None and
+                            old_item[0] < new_item[0]):
+      table_diff.removed.append(dict(zip(old_header, old_item[2])))
+      old_item = next(old_sorted, None)
+    elif old_item is None or new_item[0] < old_item[0]:
+      _, line_num, values = new_item
+      table_diff.added.append((line_num, dict(zip(new_header, values))))
+      new_item = next(new_sorted, None)
+    else:
+      old_row = old_item[2]
+      _, line_num, new_row = new_item
+      if same_header:
+        equal = old_row == new_row
+      else:
+        equal = _RowsEqual(dict(zip(old_header, old_row)),
+                           dict(zip(new_header, new_row)))
+      if not equal:
+        table_diff.changed.append((dict(zip(old_header, old_row)), line_num,
+                                   dict(zip(new_header, new_row))))
+      old_item = next(old_sorted, None)
+      new_item = next(new_sorted, None)
+  return table_diff
+
+
+def _SortRows(header, rows, key_columns):
+  """Return an iterator of (key, line number, values) of rows in sorted order.
+
+  Up to _SORT_CHUNK_SIZE rows are sorted in memory at a time. If there are
+  more, each sorted chunk is written to a temporary file and the chunks are
+  merged as they are read back.
+  """
+  indexes = [header.index(c) if c in header else None for c in key_columns]
+  chunk_files = []
+  chunk = []
+  for line_num, values in rows:
+    key = tuple(values[i] if i is not None else u'' for i in indexes)
+    chunk.append((key, line_num, values))
+    if len(chunk) >= _SORT_CHUNK_SIZE:
+      chunk.sort()
+      chunk_files.append(_WriteChunk(chunk))
+      chunk = []
+  chunk.sort()
+  if not chunk_files:
+    return iter(chunk)
+  return heapq.merge(iter(chunk), *[_ReadChunk(f) for f in chunk_files])
+
+
+def _WriteChunk(chunk):
+  """Write a list of rows to a temporary file for _ReadChunk."""
+  chunk_file = tempfile.TemporaryFile()
+  pickler = pickle.Pickler(chunk_file, pickle.HIGHEST_PROTOCOL)
+  for item in chunk:
+    pickler.dump(item)
+    # The rows aren't referenced more than once
+    pickler.clear_memo()
+  chunk_file.seek(0)
+  return chunk_file
+
+
+def _ReadChunk(chunk_file):
+  """Yield the rows written by _WriteChunk and close the file."""
+  try:
+    unpickler = pickle.Unpickler(chunk_file)
+    while True:
+      try:
+        yield unpickler.load()
+      except EOFError:
+        return
+  finally:
+    chunk_file.close()
+
+
+def _RowsEqual(a, b):
+  """Return True if two row dicts are the same, missing columns are blank."""
+  for column in set(a.keys()) | set(b.keys()):
+    if a.get(column, u'') != b.get(column, u''):
+      return False
+  return True
+
+
+class _FeedDiffApplier(object):
+  """Applies a FeedDiff to a Schedule, see FeedDiff.ApplyToSchedule."""
+
+  # Files which are applied, in the order they are loaded by the Loader
+  _SUPPORTED_FILE_NAMES = (
+      'agency.txt', 'stops.txt', 'routes.txt', 'calendar.txt',
+      'calendar_dates.txt', 'shapes.txt', 'trips.txt', 'stop_times.txt',
+      'frequencies.txt', 'fare_attributes.txt', 'fare_rules.txt',
+      'transfers.txt', 'feed_info.txt')
+
+  def __init__(self, schedule, feed_diff, problems):
+    self._schedule = schedule
+    self._feed_diff = feed_diff
+    if problems is None:
+      problems = schedule.problem_reporter
+    self._problems = problems
+    self._gtfs_factory = schedule._gtfs_factory
+    self._changed = {'agency': set(), 'stops': set(), 'routes': set(),
+                     'trips': set(), 'service_periods': set(),
+                     'shapes': set(), 'fares': set()}
+
+  def Apply(self):
+    unsupported = (set(self._feed_diff.GetFileNames()) -
+                   set(self._SUPPORTED_FILE_NAMES))
+    if unsupported:
+      raise FeedDiffError('Changes to %s can\'t be applied to a schedule, '
+                          'load the new feed instead.' %
+                          ', '.join(sorted(unsupported)))
+    self._problems.ClearContext()
+    self._ApplyAgencies()
+    self._ApplyStops()
+    self._ApplyRoutes()
+    self._ApplyServicePeriods()
+    self._ApplyShapes()
+    self._ApplyTrips()
+    self._ApplyStopTimes()
+    self._ApplyFrequencies()
+    self._ApplyFares()
+    self._ApplyTransfers()
+    self._ApplyFeedInfo()
+    self._ValidateTrips()
+    self._schedule._TripsChanged()
+    return self._changed
+
+  def _GetRowsToAdd(self, file_name):
+    table_diff = self._feed_diff.GetTableDiff(file_name)
+    if not table_diff:
+      return
+    for line_num, row in table_diff.GetRowsToAdd():
+      self._problems.SetFileContext(*table_diff.GetFileContext(line_num, row))
+      yield row
+      self._problems.ClearContext()
+
+  def _GetRowsToRemove(self, file_name):
+    table_diff = self._feed_diff.GetTableDiff(file_name)
+    if not table_diff:
+      return []
+    return table_diff.GetRowsToRemove()
+
+  def _ApplyObjects(self, file_name, id_column, objects,
+                    validate_after_add=True):
+    """Remove and add the objects of a file with one object per row.
+
+    Args:
+      file_name: the name of the file
+      id_column: the column with the id of the objects
+      objects: the dict of the schedule mapping id to object
+
+    Returns:
+      a tuple of dicts (removed, added) mapping id to the old and the new
+      objects
+    """
+    removed = {}
+    for row in self._GetRowsToRemove(file_name):
+      object_id = row.get(id_column)
+      if object_id in objects:
+        removed[object_id] = objects.pop(object_id)
+    added = {}
+    object_class = self._gtfs_factory.GetGtfsClassByFileName(file_name)
+    for row in self._GetRowsToAdd(file_name):
+      instance = object_class(field_dict=row)
+      instance.SetGtfsFactory(self._gtfs_factory)
+      if not instance.ValidateBeforeAdd(self._problems):
+        continue
+      instance.AddToSchedule(self._schedule, self._problems)
+      if validate_after_add:
+        instance.ValidateAfterAdd(self._problems)
+      object_id = row.get(id_column)
+      if objects.get(object_id) is instance:
+        added[object_id] = instance
+    return removed, added
+
+  def _ApplyAgencies(self):
+    removed, added = self._ApplyObjects('agency.txt', 'agency_id',
+                                        self._schedule._agencies)
+    if self._schedule._default_agency in removed.values():
+      self._schedule._default_agency = None
+    self._changed['agency'].update(removed.keys() + added.keys())
+
+  def _ApplyStops(self):
+    removed, added = self._ApplyObjects('stops.txt', 'stop_id',
+                                        self._schedule.stops)
+    if removed:
+      self._schedule.fare_zones = dict(
+          (s.zone_id, True) for s in self._schedule.stops.values()
+          if getattr(s, 'zone_id', None))
+    self._removed_stop_ids = set(removed.keys()) - set(added.keys())
+    self._changed['stops'].update(removed.keys() + added.keys())
+    # Trips visiting a changed stop are validated again
+    self._AddTripsVisitingStops(added.keys())
+
+  def _AddTripsVisitingStops(self, stop_ids):
+    cursor = self._schedule._connection.cursor()
+    stop_ids = list(stop_ids)
+    for start in range(0, len(stop_ids), _MAX_VALUES_PER_QUERY):
+      chunk = stop_ids[start:start + _MAX_VALUES_PER_QUERY]
+      cursor.execute('SELECT DISTINCT trip_id FROM stop_times '
+                     'WHERE stop_id IN (%s)' % ','.join(['?'] * len(chunk)),
+                     chunk)
+      self._changed['trips'].update(row[0] for row in cursor.fetchall())
+
+  def _ApplyRoutes(self):
+    removed, added = self._ApplyObjects('routes.txt', 'route_id',
+                                        self._schedule.routes)
+    for route_id, old_route in removed.items():
+      self._changed['trips'].update(t.trip_id for t in old_route._trips)
+      new_route = added.get(route_id)
+      if new_route is not None:
+        new_route._trips = old_route._trips
+    self._changed['routes'].update(removed.keys() + added.keys())
+
+  def _ApplyServicePeriods(self):
+    periods = self._schedule.service_periods
+    service_period_class = self._gtfs_factory.ServicePeriod
+    # {service_id: ServicePeriod} of the periods which are changed
+    changed = {}
+    removed_calendar_ids = set()
+    for row in self._GetRowsToRemove('calendar.txt'):
+      service_id = row.get('service_id')
+      if service_id in periods:
+        period = periods[service_id]
+        period.start_date = None
+        period.end_date = None
+        period.day_of_week = [False] * 7
+        period.original_day_values = []
+        changed[service_id] = period
+        removed_calendar_ids.add(service_id)
+    for row in self._GetRowsToAdd('calendar.txt'):
+      period = service_period_class(field_list=[
+          row.get(f) for f in service_period_class._FIELD_NAMES])
+      old_period = changed.get(period.service_id,
+                               periods.get(period.service_id))
+      if old_period is not None:
+        period.date_exceptions = old_period.date_exceptions
+      changed[period.service_id] = period
+      removed_calendar_ids.discard(period.service_id)
+
+    for row in self._GetRowsToRemove('calendar_dates.txt'):
+      service_id = row.get('service_id')
+      period = changed.get(service_id, periods.get(service_id))
+      if period is not None:
+        period.ResetDateToNormalService(row.get('date'))
+        changed[service_id] = period
+    for row in self._GetRowsToAdd('calendar_dates.txt'):
+      service_id = row.get('service_id')
+      period = changed.get(service_id, periods.get(service_id))
+      if period is None:
+        period = service_period_class(service_id)
+      changed[service_id] = period
+      exception_type = row.get('exception_type')
+      if exception_type == u'1':
+        period.SetDateHasService(row.get('date'), True, self._problems)
+      elif exception_type == u'2':
+        period.SetDateHasService(row.get('date'), False, self._problems)
+      else:
+        self._problems.InvalidValue('exception_type', exception_type)
+
+    # Trips using a changed service period are validated again
+    for trip in self._schedule.trips.values():
+      if trip.service_id in changed:
+        self._changed['trips'].add(trip.trip_id)
+    for service_id, period in changed.items():
+      old_period = periods.pop(service_id, None)
+      if self._schedule._default_service_period is old_period:
+        self._schedule._default_service_period = None
+      if service_id in removed_calendar_ids and not period.date_exceptions:
+        # Neither calendar.txt nor calendar_dates.txt have the service_id
+        continue
+      self._schedule.AddServicePeriodObject(period, self._problems)
+    self._changed['service_periods'].update(changed.keys())
+
+  def _ApplyShapes(self):
+    shapes = self._schedule._shapes
+    # {shape_id: Shape} of the shapes which are changed
+    changed = {}
+    for row in self._GetRowsToRemove('shapes.txt'):
+      shape_id = row.get('shape_id')
+      shape = shapes.get(shape_id)
+      if shape is None:
+        continue
+      try:
+        index = shape.sequence.index(int(row.get('shape_pt_sequence')))
+      except (TypeError, ValueError):
+        # The point wasn't loaded
+        continue
+      del shape.sequence[index]
+      del shape.distance[index]
+      del shape.points[index]
+      changed[shape_id] = shape
+
+    for row in self._GetRowsToAdd('shapes.txt'):
+      shapepoint = self._gtfs_factory.ShapePoint(field_dict=row)
+      if not shapepoint.ParseAttributes(self._problems):
+        continue
+      shape = changed.get(shapepoint.shape_id,
+                          shapes.get(shapepoint.shape_id))
+      if shape is None:
+        shape = self._gtfs_factory.Shape(shapepoint.shape_id)
+        shape.SetGtfsFactory(self._gtfs_factory)
+      shape.AddShapePointObjectUnsorted(shapepoint, self._problems)
+      changed[shape.shape_id] = shape
+
+    for shape_id, shape in changed.items():
+      shapes.pop(shape_id, None)
+      if shape.points:
+        shape.max_distance = max([0] + [d for d in shape.distance if d])
+        self._schedule.AddShapeObject(shape, self._problems)
+    for trip in self._schedule.trips.values():
+      if trip.shape_id in changed:
+        self._changed['trips'].add(trip.trip_id)
+    self._changed['shapes'].update(changed.keys())
+
+  def _ApplyTrips(self):
+    removed, added = self._ApplyObjects('trips.txt', 'trip_id',
+                                        self._schedule.trips,
+                                        validate_after_add=False)
+    # {route_id: set of id() of the old trips to remove from the route}
+    route_trips = {}
+    for trip_id, old_trip in removed.items():
+      route_trips.setdefault(old_trip.route_id, set()).add(id(old_trip))
+      new_trip = added.get(trip_id)
+      if new_trip is not None:
+        new_trip._headways = old_trip._headways
+    for route_id, trip_ids in route_trips.items():
+      route = self._schedule.routes.get(route_id)
+      if route is not None:
+        route._trips = [t for t in route._trips if id(t) not in trip_ids]
+    cursor = self._schedule._connection.cursor()
+    cursor.executemany('DELETE FROM stop_times WHERE trip_id=?',
+                       [(trip_id,) for trip_id in removed
+                        if trip_id not in added])
+    self._changed['trips'].update(removed.keys() + added.keys())
+
+  def _ApplyStopTimes(self):
+    trips = self._schedule.trips
+    stops = self._schedule.stops
+    delete_values = []
+    for row in self._GetRowsToRemove('stop_times.txt'):
+      try:
+        sequence = int(row.get('stop_sequence'))
+      except (TypeError, ValueError):
+        # The stop time wasn't loaded
+        continue
+      delete_values.append((row.get('trip_id'), sequence))
+      self._changed['trips'].add(row.get('trip_id'))
+    cursor = self._schedule._connection.cursor()
+    cursor.executemany('DELETE FROM stop_times WHERE trip_id=? AND '
+                       'stop_sequence=?', delete_values)
+
+    stop_time_class = self._gtfs_factory.StopTime
+    for row in self._GetRowsToAdd('stop_times.txt'):
+      # Like Loader._LoadStopTimes
+      stop_sequence = row.get('stop_sequence')
+      try:
+        sequence = int(stop_sequence)
+      except (TypeError, ValueError):
+        self._problems.InvalidValue('stop_sequence', stop_sequence,
+                                    'This should be a number.')
+        continue
+      if sequence < 0:
+        self._problems.InvalidValue('stop_sequence', sequence,
+                                    'Sequence numbers should be 0 or higher.')
+      stop_id = row.get('stop_id')
+      if stop_id not in stops:
+        self._problems.InvalidValue('stop_id', stop_id,
+                                    'This value wasn\'t defined in stops.txt')
+        continue
+      trip_id = row.get('trip_id')
+      if trip_id not in trips:
+        self._problems.InvalidValue('trip_id', trip_id,
+                                    'This value wasn\'t defined in trips.txt')
+        continue
+      stop_time = stop_time_class(
+          self._problems, stops[stop_id], row.get('arrival_time'),
+          row.get('departure_time'), row.get('stop_headsign'),
+          row.get('pickup_type'), row.get('drop_off_type'),
+          row.get('shape_dist_traveled'), stop_sequence=sequence,
+          timepoint=row.get('timepoint'))
+      trips[trip_id]._AddStopTimeObjectUnordered(stop_time, self._schedule)
+      self._changed['trips'].add(trip_id)
+
+    self._RemoveStopTimesOfRemovedStops()
+
+  def _RemoveStopTimesOfRemovedStops(self):
+    """Remove the stop times which use a stop that was removed, which the
+    Loader would not have loaded."""
+    cursor = self._schedule._connection.cursor()
+    stop_ids = list(self._removed_stop_ids)
+    for start in range(0, len(stop_ids), _MAX_VALUES_PER_QUERY):
+      chunk = stop_ids[start:start + _MAX_VALUES_PER_QUERY]
+      in_clause = ','.join(['?'] * len(chunk))
+      cursor.execute('SELECT trip_id,stop_id FROM stop_times '
+                     'WHERE stop_id IN (%s)' % in_clause, chunk)
+      for trip_id, stop_id in cursor.fetchall():
+        self._problems.InvalidValue('stop_id', stop_id,
+                                    'This value wasn\'t defined in stops.txt')
+        self._changed['trips'].add(trip_id)
+      cursor.execute('DELETE FROM stop_times WHERE stop_id IN (%s)' %
+                     in_clause, chunk)
+
+  def _ApplyFrequencies(self):
+    trips = self._schedule.trips
+    for row in self._GetRowsToRemove('frequencies.txt'):
+      trip = trips.get(row.get('trip_id'))
+      if trip is None:
+        continue
+      try:
+        start_time = util.TimeToSecondsSinceMidnight(row.get('start_time'))
+      except problems_module.Error:
+        continue
+      trip._headways = [h for h in trip._headways if h[0] != start_time]
+      self._changed['trips'].add(trip.trip_id)
+    frequency_class = self._gtfs_factory.Frequency
+    changed_trips = set()
+    for row in self._GetRowsToAdd('frequencies.txt'):
+      frequency = frequency_class(field_dict=row)
+      frequency.SetGtfsFactory(self._gtfs_factory)
+      if not frequency.ValidateBeforeAdd(self._problems):
+        continue
+      frequency.AddToSchedule(self._schedule, self._problems)
+      self._changed['trips'].add(row.get('trip_id'))
+      changed_trips.add(row.get('trip_id'))
+    # Added periods are appended, keep the periods of a trip by start time
+    for trip_id in changed_trips:
+      trip = trips.get(trip_id)
+      if trip is not None:
+        trip._headways.sort()
+
+  def _ApplyFares(self):
+    removed, added = self._ApplyObjects('fare_attributes.txt', 'fare_id',
+                                        self._schedule.fares)
+    for fare_id, new_fare in added.items():
+      if fare_id in removed:
+        new_fare.rules = removed[fare_id].rules
+    self._changed['fares'].update(removed.keys() + added.keys())
+
+    fare_rule_class = self._gtfs_factory.FareRule
+    for row in self._GetRowsToRemove('fare_rules.txt'):
+      fare = self._schedule.fares.get(row.get('fare_id'))
+      if fare is None:
+        continue
+      old_rule = fare_rule_class(field_dict=row)
+      for i, rule in enumerate(fare.rules):
+        if rule == old_rule:
+          del fare.rules[i]
+          self._changed['fares'].add(fare.fare_id)
+          break
+    for row in self._GetRowsToAdd('fare_rules.txt'):
+      rule = fare_rule_class(field_dict=row)
+      rule.SetGtfsFactory(self._gtfs_factory)
+      if rule.ValidateBeforeAdd(self._problems):
+        rule.AddToSchedule(self._schedule, self._problems)
+        rule.ValidateAfterAdd(self._problems)
+        self._changed['fares'].add(rule.fare_id)
+
+  def _ApplyTransfers(self):
+    transfers = self._schedule._transfers
+    transfer_class = self._gtfs_factory.Transfer
+    for row in self._GetRowsToRemove('transfers.txt'):
+      old_transfer = transfer_class(field_dict=row)
+      transfer_id = old_transfer._ID()
+      if transfer_id not in transfers:
+        continue
+      for i, transfer in enumerate(transfers[transfer_id]):
+        if transfer == old_transfer:
+          del transfers[transfer_id][i]
+          break
+      if not transfers[transfer_id]:
+        del transfers[transfer_id]
+    self._ApplyObjects('transfers.txt', None, {})
+
+  def _ApplyFeedInfo(self):
+    if self._GetRowsToRemove('feed_info.txt'):
+      self._schedule.feed_info = None
+    self._ApplyObjects('feed_info.txt', None, {})
+
+  def _ValidateTrips(self):
+    """Validate the changed trips like Schedule.Validate does."""
+    for trip_id in sorted(self._changed['trips']):
+      trip = self._schedule.trips.get(trip_id)
+      if trip is None:
+        continue
+      trip.__dict__.pop('_pattern_id', None)
+      trip.Validate(self._problems, validate_children=False)
+      stop_times = trip.GetStopTimes(self._problems)
+      self._schedule.ValidateStopTimesForTrip(self._problems, trip,
+                                              stop_times)
+      self._schedule.ValidateTripChildren(self._problems, trip)
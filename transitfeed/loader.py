@@ -22,7 +22,9 @@ import re
 import zipfile
 
 from . import gtfsfactoryuser
+from . import phasestats
 from . import problems
+from . import progress as progress_module
 from . import util
 from .compat import StringIO
 
@@ -36,7 +38,9 @@ class Loader:
                memory_db=True,
                zip=None,
                check_duplicate_trips=False,
-               gtfs_factory=None):
+               gtfs_factory=None,
+               stats=None,
+               progress=None):
     """Initialize a new Loader object.
 
     Args:
@@ -50,6 +54,10 @@ class Loader:
       memory_db: if creating a new Schedule object use an in-memory sqlite
         database instead of creating one in a temporary file
       zip: a zipfile.ZipFile object, optionally used instead of path
+      stats: a PhaseStats object which records the time, row count and memory
+        use of loading each file, or None to not record them
+      progress: a ProgressReporter object which is updated while each file is
+        loaded and the feed is validated, or None to not report progress
     """
     if gtfs_factory is None:
       gtfs_factory = gtfsfactoryuser.GtfsFactoryUser().GetGtfsFactory()
@@ -65,6 +73,16 @@ class Loader:
     self._zip = zip
     self._load_stop_times = load_stop_times
     self._gtfs_factory = gtfs_factory
+    if stats is None:
+      stats = phasestats.null_phase_stats
+    self._stats = stats
+    if progress is None:
+      progress = progress_module.null_progress_reporter
+    self._progress = progress
+
+  def GetStats(self):
+    """Return the stats object passed to __init__."""
+    return self._stats
 
   def _DetermineFormat(self):
     """Determines whether the feed is in a form that we understand, and
@@ -151,6 +169,9 @@ class Loader:
     contents = self._GetUtf8Contents(file_name)
     if not contents:
       return
+    if self._progress.enabled:
+      # Estimate one row per line after the header
+      self._progress.AddToTotal(contents.count('\n') - 1)
 
     eol_checker = util.EndOfLineChecker(StringIO(contents),
                                    file_name, self._problems)
@@ -286,6 +307,9 @@ class Loader:
     contents = self._GetUtf8Contents(file_name)
     if not contents:
       return
+    if self._progress.enabled:
+      # Estimate one row per line after the header
+      self._progress.AddToTotal(contents.count('\n') - 1)
 
     eol_checker = util.EndOfLineChecker(StringIO(contents),
                                    file_name, self._problems)
@@ -409,11 +433,17 @@ class Loader:
         pass # File is not required, and feed does not have it.
       else:
         object_class = self._gtfs_factory.GetGtfsClassByFileName(filename)
+        phase = self._stats.StartPhase(filename)
+        next_progress = self._progress.StartPhase(filename)
+        rows = 0
         for (d, row_num, header, row) in self._ReadCsvDict(
                                        filename,
                                        object_class._FIELD_NAMES,
                                        object_class._REQUIRED_FIELD_NAMES,
                                        object_class._DEPRECATED_FIELD_NAMES):
+          rows += 1
+          if rows == next_progress:
+            next_progress = self._progress.Update(rows)
           self._problems.SetFileContext(filename, row_num, row, header)
           instance = object_class(field_dict=d)
           instance.SetGtfsFactory(self._gtfs_factory)
@@ -422,6 +452,8 @@ class Loader:
           instance.AddToSchedule(self._schedule, self._problems)
           instance.ValidateAfterAdd(self._problems)
           self._problems.ClearContext()
+        self._stats.EndPhase(phase, rows)
+        self._progress.EndPhase(rows)
 
   def _LoadCalendar(self):
     file_name = 'calendar.txt'
@@ -430,6 +462,11 @@ class Loader:
       self._problems.MissingFile(file_name)
       return
 
+    phase = self._stats.StartPhase('%s/%s' % (file_name, file_name_dates))
+    next_progress = self._progress.StartPhase(
+        '%s/%s' % (file_name, file_name_dates))
+    rows = 0
+
     # map period IDs to (period object, (file_name, row_num, row, cols))
     periods = {}
 
@@ -443,6 +480,9 @@ class Loader:
                         service_period_class._FIELD_NAMES,
                         service_period_class._REQUIRED_FIELD_NAMES,
                         service_period_class._DEPRECATED_FIELD_NAMES):
+        rows += 1
+        if rows == next_progress:
+          next_progress = self._progress.Update(rows)
         context = (file_name, row_num, row, cols)
         self._problems.SetFileContext(*context)
 
@@ -462,6 +502,9 @@ class Loader:
               service_period_class._FIELD_NAMES_CALENDAR_DATES,
               service_period_class._REQUIRED_FIELD_NAMES_CALENDAR_DATES,
               service_period_class._DEPRECATED_FIELD_NAMES_CALENDAR_DATES):
+        rows += 1
+        if rows == next_progress:
+          next_progress = self._progress.Update(rows)
         context = (file_name_dates, row_num, row, cols)
         self._problems.SetFileContext(*context)
 
@@ -489,11 +532,16 @@ class Loader:
       self._problems.SetFileContext(*context)
       self._schedule.AddServicePeriodObject(period, self._problems)
       self._problems.ClearContext()
+    self._stats.EndPhase(phase, rows)
+    self._progress.EndPhase(rows)
 
   def _LoadShapes(self):
     file_name = 'shapes.txt'
     if not self._HasFile(file_name):
       return
+    phase = self._stats.StartPhase(file_name)
+    next_progress = self._progress.StartPhase(file_name)
+    rows = 0
     shapes = {}  # shape_id to shape object
 
     shape_class = self._gtfs_factory.Shape
@@ -503,6 +551,9 @@ class Loader:
         shape_class._FIELD_NAMES,
         shape_class._REQUIRED_FIELD_NAMES,
         shape_class._DEPRECATED_FIELD_NAMES):
+      rows += 1
+      if rows == next_progress:
+        next_progress = self._progress.Update(rows)
       file_context = (file_name, row_num, row, header)
       self._problems.SetFileContext(*file_context)
 
@@ -523,14 +574,22 @@ class Loader:
     for shape_id, shape in shapes.items():
       self._schedule.AddShapeObject(shape, self._problems)
       del shapes[shape_id]
+    self._stats.EndPhase(phase, rows)
+    self._progress.EndPhase(rows)
 
   def _LoadStopTimes(self):
     stop_time_class = self._gtfs_factory.StopTime
+    phase = self._stats.StartPhase('stop_times.txt')
+    next_progress = self._progress.StartPhase('stop_times.txt')
+    rows = 0
 
     for (row, row_num, cols) in self._ReadCSV('stop_times.txt',
         stop_time_class._FIELD_NAMES,
         stop_time_class._REQUIRED_FIELD_NAMES,
         stop_time_class._DEPRECATED_FIELD_NAMES):
+      rows += 1
+      if rows == next_progress:
+        next_progress = self._progress.Update(rows)
       file_context = ('stop_times.txt', row_num, row, cols)
       self._problems.SetFileContext(*file_context)
 
@@ -573,6 +632,8 @@ class Loader:
           timepoint=timepoint)
       trip._AddStopTimeObjectUnordered(stop_time, self._schedule)
       self._problems.ClearContext()
+    self._stats.EndPhase(phase, rows)
+    self._progress.EndPhase(rows)
 
     # stop_times are validated in Trip.ValidateChildren, called by
     # Schedule.Validate
@@ -595,6 +656,7 @@ class Loader:
       self._zip = None
 
     if self._extra_validation:
-      self._schedule.Validate(self._problems, validate_children=False)
+      self._schedule.Validate(self._problems, validate_children=False,
+                              stats=self._stats, progress=self._progress)
 
     return self._schedule
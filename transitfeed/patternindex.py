@@ -0,0 +1,219 @@
+#!/usr/bin/python2.5
+
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+import bisect
+
+
+class PatternTrips(object):
+  """The trips of one pattern that run on a set of service periods.
+
+  Attributes:
+    trips: list of Trip objects sorted by start time
+    start_times: list of the start times of trips, in seconds since midnight
+    has_non_zero_trip_type: True if any trip has a trip_type other than '0'
+  """
+
+  def __init__(self, trips, start_times):
+    self.trips = trips
+    self.start_times = start_times
+    self.has_non_zero_trip_type = False
+    for trip in trips:
+      if trip['trip_type'] and trip['trip_type'] != '0':
+        self.has_non_zero_trip_type = True
+        break
+
+  def GetSample(self, time, sample_size):
+    """Return sample_size trips starting at or after time.
+
+    If fewer than sample_size trips start after time the last sample_size
+    trips are returned.
+
+    Returns:
+      a tuple (start_index, sample, num_after_sample) where start_index is the
+      offset of the first sampled trip, sample is a list of (start time,
+      trip_id) tuples and num_after_sample is the number of trips after the
+      sample
+    """
+    num_trips = len(self.trips)
+    if num_trips <= sample_size:
+      start_index = 0
+    else:
+      start_index = min(bisect.bisect_left(self.start_times, time),
+                        num_trips - sample_size)
+    end_index = start_index + sample_size
+    sample = [(self.start_times[i], self.trips[i].trip_id)
+              for i in range(start_index, min(end_index, num_trips))]
+    return start_index, sample, max(0, num_trips - end_index)
+
+
+class PatternTimetable(object):
+  """The stop times of the trips of a pattern as a trips x stops matrix.
+
+  Attributes:
+    stops: list of the Stop objects of the pattern, in the order visited
+    trips: list of Trip objects sorted by start time
+    arrivals: list with a list for each trip of the arrival_secs at each
+      stop, which is None where the trip is untimed
+    departures: like arrivals, with departure_secs
+    start_time: the earliest start time of the trips, or None
+    end_time: the latest end time of the trips, or None
+  """
+
+  def __init__(self, stops, trips, arrivals, departures):
+    self.stops = stops
+    self.trips = trips
+    self.arrivals = arrivals
+    self.departures = departures
+    self.start_time = None
+    self.end_time = None
+    for trip_arrivals, trip_departures in zip(arrivals, departures):
+      if not trip_arrivals:
+        continue
+      start = _FirstNotNone(trip_arrivals[0], trip_departures[0])
+      end = _FirstNotNone(trip_departures[-1], trip_arrivals[-1])
+      if start is not None and (self.start_time is None or
+                                start < self.start_time):
+        self.start_time = start
+      if end is not None and (self.end_time is None or end > self.end_time):
+        self.end_time = end
+
+  def GetTravelTimes(self, index=0):
+    """Return the seconds trip index takes from each stop to the next.
+
+    Returns None for a pair of stops if the departure or the arrival isn't
+    timed. MareyGraph spaces the stations of a pattern with these times.
+    """
+    arrivals = self.arrivals[index]
+    departures = self.departures[index]
+    travel_times = []
+    for i in range(len(arrivals) - 1):
+      departure = _FirstNotNone(departures[i], arrivals[i])
+      arrival = _FirstNotNone(arrivals[i + 1], departures[i + 1])
+      if departure is None or arrival is None:
+        travel_times.append(None)
+      else:
+        travel_times.append(arrival - departure)
+    return travel_times
+
+
+def _FirstNotNone(a, b):
+  if a is not None:
+    return a
+  return b
+
+
+class PatternIndex(object):
+  """The trips of a route grouped by pattern and sorted by start time.
+
+  A pattern is the sequence of stops visited by a trip, see Trip.GetPattern.
+  Use Route.GetPatternIndex to get an index which is up to date with the
+  trips and stop times of the schedule.
+  """
+
+  # Maximum number of sets of service_ids for which GetPatternTrips keeps the
+  # filtered trips.
+  _MAX_CACHED_SERVICE_SETS = 32
+
+  def __init__(self, route):
+    self._schedule = route._schedule
+    # {pattern_id: PatternTrips} for all trips of the pattern
+    self._patterns = {}
+    # {pattern_id: result of GetTimeStops of the first trip}
+    self._time_stops = {}
+    # {tuple of service_ids: {pattern_id: PatternTrips}}
+    self._filtered = {}
+    # {pattern_id: PatternTimetable} built on demand
+    self._timetables = {}
+    self._Build(route)
+
+  def _Build(self, route):
+    for pattern_id, trips in route.GetPatternIdTripDict().items():
+      time_stops = trips[0].GetTimeStops()
+      if not time_stops:
+        # Trips without stop times have no pattern to show
+        continue
+      start_time_trips = sorted(
+          (t.GetStartTime(), t.trip_id, t) for t in trips)
+      self._patterns[pattern_id] = PatternTrips(
+          [t[2] for t in start_time_trips], [t[0] for t in start_time_trips])
+      self._time_stops[pattern_id] = time_stops
+
+  def GetPatternIds(self):
+    """Return a list of the pattern_ids of the route with stop times."""
+    return list(self._patterns.keys())
+
+  def GetTimeStops(self, pattern_id):
+    """Return GetTimeStops() of the first trip of a pattern."""
+    return self._time_stops[pattern_id]
+
+  def GetTimetable(self, pattern_id):
+    """Return a PatternTimetable of all trips of a pattern."""
+    timetable = self._timetables.get(pattern_id)
+    if timetable is None:
+      timetable = self._BuildTimetable(pattern_id)
+      self._timetables[pattern_id] = timetable
+    return timetable
+
+  def _BuildTimetable(self, pattern_id):
+    trips = self._patterns[pattern_id].trips
+    arrivals = []
+    departures = []
+    # Read the times directly instead of creating StopTime objects with
+    # Trip.GetTimeStops, which is much slower for large patterns
+    cursor = self._schedule._connection.cursor()
+    for trip in trips:
+      cursor.execute(
+          'SELECT arrival_secs,departure_secs FROM stop_times '
+          'WHERE trip_id=? ORDER BY stop_sequence', (trip.trip_id,))
+      rows = cursor.fetchall()
+      arrivals.append([row[0] for row in rows])
+      departures.append([row[1] for row in rows])
+    stops = [time_stop[2] for time_stop in self._time_stops[pattern_id]]
+    return PatternTimetable(stops, trips, arrivals, departures)
+
+  def GetPatternTrips(self, pattern_id, date=None):
+    """Return a PatternTrips object for the trips of a pattern.
+
+    Args:
+      pattern_id: a pattern_id returned by GetPatternIds
+      date: a date string in the format YYYYMMDD; if given only trips with
+        service on this date are included
+    """
+    if not date:
+      return self._patterns[pattern_id]
+    service_ids = tuple(sorted(
+        p.service_id for p in self._schedule.GetServicePeriodList()
+        if p.IsActiveOn(date)))
+    filtered = self._filtered.get(service_ids)
+    if filtered is None:
+      if len(self._filtered) >= self._MAX_CACHED_SERVICE_SETS:
+        self._filtered.clear()
+      filtered = self._FilterByService(set(service_ids))
+      self._filtered[service_ids] = filtered
+    return filtered[pattern_id]
+
+  def _FilterByService(self, service_ids):
+    filtered = {}
+    for pattern_id, pattern in self._patterns.items():
+      trips = []
+      start_times = []
+      for trip, start_time in zip(pattern.trips, pattern.start_times):
+        if trip.service_id in service_ids:
+          trips.append(trip)
+          start_times.append(start_time)
+      filtered[pattern_id] = PatternTrips(trips, start_times)
+    return filtered
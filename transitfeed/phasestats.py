@@ -0,0 +1,161 @@
+#!/usr/bin/python2.5
+
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+import json
+import os
+import time
+
+
+def GetResidentSetSize():
+  """Return the resident set size of this process in bytes.
+
+  The value is read from /proc so it is only available on Linux. None is
+  returned on other platforms.
+  """
+  try:
+    status_file = open('/proc/%d/status' % os.getpid())
+    try:
+      for line in status_file:
+        if line.startswith('VmRSS:'):
+          # The line looks like 'VmRSS:     9999 kB'
+          return int(line.split()[1]) * 1024
+    finally:
+      status_file.close()
+  except (IOError, OSError, ValueError):
+    pass
+  return None
+
+
+class Phase(object):
+  """The wall time, row count and memory use of one named phase.
+
+  Attributes:
+    name: a string such as 'stops.txt' or 'ValidateTrips'
+    rows: number of rows or entities processed during the phase
+    wall_time: seconds elapsed between start and end of the phase
+    start_rss: resident set size in bytes at the start, or None
+    end_rss: resident set size in bytes at the end, or None
+  """
+
+  def __init__(self, name):
+    self.name = name
+    self.rows = 0
+    self.wall_time = None
+    self.start_rss = GetResidentSetSize()
+    self.end_rss = None
+    self._start_time = time.time()
+
+  def End(self, rows=None):
+    """Record the end of this phase, optionally setting the row count."""
+    self.wall_time = time.time() - self._start_time
+    self.end_rss = GetResidentSetSize()
+    if rows is not None:
+      self.rows = rows
+
+  def GetRowsPerSecond(self):
+    """Return the rows processed per second or None if it is unknown."""
+    if not self.rows or not self.wall_time:
+      return None
+    return self.rows / self.wall_time
+
+  def GetRssDelta(self):
+    """Return the change of resident set size in bytes or None if unknown."""
+    if self.start_rss is None or self.end_rss is None:
+      return None
+    return self.end_rss - self.start_rss
+
+  def GetDict(self):
+    """Return a dict describing this phase, suitable for JSON output."""
+    return {'name': self.name,
+            'rows': self.rows,
+            'wall_time': self.wall_time,
+            'rows_per_second': self.GetRowsPerSecond(),
+            'rss_delta': self.GetRssDelta(),
+            'end_rss': self.end_rss}
+
+
+class PhaseStats(object):
+  """Collects a Phase object for each step of loading and validating a feed.
+
+  Pass an instance as the stats argument of Loader and Schedule.Validate and
+  read the results with GetPhaseList or WriteJson once they return.
+  """
+
+  def __init__(self):
+    self._phases = []
+
+  def StartPhase(self, name):
+    """Start timing a phase and return its Phase object.
+
+    Args:
+      name: a string identifying the phase
+
+    Returns:
+      a Phase object which should be passed to EndPhase
+    """
+    phase = Phase(name)
+    self._phases.append(phase)
+    return phase
+
+  def EndPhase(self, phase, rows=None):
+    """Record the end of phase, which was returned by StartPhase."""
+    phase.End(rows)
+
+  def RunPhase(self, name, rows, function, *args, **kwargs):
+    """Call function(*args, **kwargs) as a phase and return its result."""
+    phase = self.StartPhase(name)
+    result = function(*args, **kwargs)
+    self.EndPhase(phase, rows)
+    return result
+
+  def GetPhaseList(self):
+    """Return the list of Phase objects in the order they were started."""
+    return self._phases
+
+  def GetPhase(self, name):
+    """Return the last Phase with name or raise a KeyError."""
+    for phase in reversed(self._phases):
+      if phase.name == name:
+        return phase
+    raise KeyError(name)
+
+  def GetTotalWallTime(self):
+    return sum(p.wall_time for p in self._phases if p.wall_time is not None)
+
+  def WriteJson(self, f):
+    """Write a JSON list with one object per phase to file object f."""
+    json.dump([p.GetDict() for p in self._phases], f, indent=1)
+
+
+class NullPhaseStats(object):
+  """A stand-in for PhaseStats that records nothing.
+
+  Used when no stats object is passed to Loader or Schedule.Validate so that
+  instrumentation costs no more than a method call per phase.
+  """
+
+  def StartPhase(self, name):
+    return None
+
+  def EndPhase(self, phase, rows=None):
+    pass
+
+  def RunPhase(self, name, rows, function, *args, **kwargs):
+    return function(*args, **kwargs)
+
+
+null_phase_stats = NullPhaseStats()
@@ -18,6 +18,7 @@ from __future__ import print_function
 from __future__ import absolute_import
 from functools import reduce
 import logging
+import random
 import time
 
 from . import util
@@ -68,43 +69,69 @@ class ProblemReporter(object):
     """Report an exception to the Problem Accumulator"""
     self.accumulator._Report(e)
 
+  def _WantsProblem(self, problem_class, type, column_name=None):
+    """Return False if the accumulator will discard a problem of this kind.
+
+    Each problem method calls this before building the exception object so
+    that ignored and over-limit problems cost very little.
+    """
+    if type not in ALL_TYPES:
+      type = TYPE_ERROR  # as done by ExceptionWithContext.__init__
+    return self.accumulator._PreReport(problem_class, type, column_name)
+
   def NewVersionAvailable(self, version):
+    if not self._WantsProblem(NewVersionAvailable, TYPE_NOTICE):
+      return
     e = NewVersionAvailable(version=version, type=TYPE_NOTICE,
                             url='https://github.com/google/transitfeed')
     self.AddToAccumulator(e)
 
   def FeedNotFound(self, feed_name, context=None, type=TYPE_ERROR):
+    if not self._WantsProblem(FeedNotFound, type):
+      return
     e = FeedNotFound(feed_name=feed_name, context=context,
                      context2=self._context, type=type)
     self.AddToAccumulator(e)
 
   def UnknownFormat(self, feed_name, context=None, type=TYPE_ERROR):
+    if not self._WantsProblem(UnknownFormat, type):
+      return
     e = UnknownFormat(feed_name=feed_name, context=context,
                       context2=self._context, type=type)
     self.AddToAccumulator(e)
 
   def FileFormat(self, problem, context=None, type=TYPE_ERROR):
+    if not self._WantsProblem(FileFormat, type):
+      return
     e = FileFormat(problem=problem, context=context,
                    context2=self._context, type=type)
     self.AddToAccumulator(e)
 
   def MissingFile(self, file_name, context=None, type=TYPE_ERROR):
+    if not self._WantsProblem(MissingFile, type):
+      return
     e = MissingFile(file_name=file_name, context=context,
                     context2=self._context, type=type)
     self.AddToAccumulator(e)
 
   def UnknownFile(self, file_name, context=None, type=TYPE_WARNING):
+    if not self._WantsProblem(UnknownFile, type):
+      return
     e = UnknownFile(file_name=file_name, context=context,
                   context2=self._context, type=type)
     self.AddToAccumulator(e)
 
   def EmptyFile(self, file_name, context=None, type=TYPE_ERROR):
+    if not self._WantsProblem(EmptyFile, type):
+      return
     e = EmptyFile(file_name=file_name, context=context,
                   context2=self._context, type=type)
     self.AddToAccumulator(e)
 
   def MissingColumn(self, file_name, column_name, context=None,
                     type=TYPE_ERROR):
+    if not self._WantsProblem(MissingColumn, type, column_name):
+      return
     e = MissingColumn(file_name=file_name, column_name=column_name,
                       context=context, context2=self._context,
                       type=type)
@@ -112,6 +139,8 @@ class ProblemReporter(object):
 
   def UnrecognizedColumn(self, file_name, column_name, context=None,
                          type=TYPE_WARNING):
+    if not self._WantsProblem(UnrecognizedColumn, type, column_name):
+      return
     e = UnrecognizedColumn(file_name=file_name, column_name=column_name,
                            context=context, context2=self._context, type=type)
     self.AddToAccumulator(e)
@@ -121,18 +150,24 @@ class ProblemReporter(object):
     reason = None
     if not util.IsEmpty(new_name):
       reason = 'Please use the new column "%s" instead.' % (new_name)
+    if not self._WantsProblem(DeprecatedColumn, type, column_name):
+      return
     e = DeprecatedColumn(file_name=file_name, column_name=column_name,
                          reason=reason, context=context, context2=self._context,
                          type=type)
     self.AddToAccumulator(e)
 
   def CsvSyntax(self, description=None, context=None, type=TYPE_ERROR):
+    if not self._WantsProblem(CsvSyntax, type):
+      return
     e = CsvSyntax(description=description, context=context,
                   context2=self._context, type=type)
     self.AddToAccumulator(e)
 
   def DuplicateColumn(self, file_name, header, count, type=TYPE_ERROR,
                       context=None):
+    if not self._WantsProblem(DuplicateColumn, type):
+      return
     e = DuplicateColumn(file_name=file_name,
                         header=header,
                         count=count,
@@ -143,24 +178,32 @@ class ProblemReporter(object):
 
   def MissingValue(self, column_name, reason=None, context=None,
                    type=TYPE_ERROR):
+    if not self._WantsProblem(MissingValue, type, column_name):
+      return
     e = MissingValue(column_name=column_name, reason=reason, context=context,
                      context2=self._context, type=type)
     self.AddToAccumulator(e)
 
   def InvalidValue(self, column_name, value, reason=None, context=None,
                    type=TYPE_ERROR):
+    if not self._WantsProblem(InvalidValue, type, column_name):
+      return
     e = InvalidValue(column_name=column_name, value=value, reason=reason,
                      context=context, context2=self._context, type=type)
     self.AddToAccumulator(e)
 
   def InvalidFloatValue(self, value, reason=None, context=None,
                         type=TYPE_WARNING):
+    if not self._WantsProblem(InvalidFloatValue, type):
+      return
     e = InvalidFloatValue(value=value, reason=reason, context=context,
                           context2=self._context, type=type)
     self.AddToAccumulator(e)
 
   def InvalidNonNegativeIntegerValue(self, value, reason=None, context=None,
                                      type=TYPE_WARNING):
+    if not self._WantsProblem(InvalidNonNegativeIntegerValue, type):
+      return
     e = InvalidNonNegativeIntegerValue(value=value, reason=reason,
                                        context=context, context2=self._context,
                                        type=type)
@@ -171,23 +214,31 @@ class ProblemReporter(object):
       column_names = '(' + ', '.join(column_names) + ')'
     if isinstance(values, tuple):
       values = '(' + ', '.join(values) + ')'
+    if not self._WantsProblem(DuplicateID, type, column_names):
+      return
     e = DuplicateID(column_name=column_names, value=values,
                     context=context, context2=self._context, type=type)
     self.AddToAccumulator(e)
 
   def InvalidAgencyID(self, column_name, value, relating_type, relating_id,
                       context=None, type=TYPE_ERROR):
+    if not self._WantsProblem(InvalidAgencyID, type, column_name):
+      return
     e = InvalidAgencyID(column_name=column_name, value=value,
                         relating_type=relating_type, relating_id=relating_id,
                         context=context, context2=self._context, type=type)
     self.AddToAccumulator(e)
 
   def UnusedStop(self, stop_id, stop_name, context=None, type=TYPE_WARNING):
+    if not self._WantsProblem(UnusedStop, type):
+      return
     e = UnusedStop(stop_id=stop_id, stop_name=stop_name,
                    context=context, context2=self._context, type=type)
     self.AddToAccumulator(e)
 
   def UsedStation(self, stop_id, stop_name, context=None, type=TYPE_ERROR):
+    if not self._WantsProblem(UsedStation, type):
+      return
     e = UsedStation(stop_id=stop_id, stop_name=stop_name,
                     context=context, context2=self._context, type=type)
     self.AddToAccumulator(e)
@@ -195,6 +246,8 @@ class ProblemReporter(object):
   def StopTooFarFromParentStation(self, stop_id, stop_name, parent_stop_id,
                                   parent_stop_name, distance,
                                   type=TYPE_WARNING, context=None):
+    if not self._WantsProblem(StopTooFarFromParentStation, type):
+      return
     e = StopTooFarFromParentStation(
         stop_id=stop_id, stop_name=stop_name,
         parent_stop_id=parent_stop_id,
@@ -204,6 +257,8 @@ class ProblemReporter(object):
 
   def StopsTooClose(self, stop_name_a, stop_id_a, stop_name_b, stop_id_b,
                     distance, type=TYPE_WARNING, context=None):
+    if not self._WantsProblem(StopsTooClose, type):
+      return
     e = StopsTooClose(
         stop_name_a=stop_name_a, stop_id_a=stop_id_a, stop_name_b=stop_name_b,
         stop_id_b=stop_id_b, distance=distance, context=context,
@@ -212,6 +267,8 @@ class ProblemReporter(object):
 
   def StationsTooClose(self, stop_name_a, stop_id_a, stop_name_b, stop_id_b,
                        distance, type=TYPE_WARNING, context=None):
+    if not self._WantsProblem(StationsTooClose, type):
+      return
     e = StationsTooClose(
         stop_name_a=stop_name_a, stop_id_a=stop_id_a, stop_name_b=stop_name_b,
         stop_id_b=stop_id_b, distance=distance, context=context,
@@ -221,6 +278,8 @@ class ProblemReporter(object):
   def DifferentStationTooClose(self, stop_name, stop_id,
                                station_stop_name, station_stop_id,
                                distance, type=TYPE_WARNING, context=None):
+    if not self._WantsProblem(DifferentStationTooClose, type):
+      return
     e = DifferentStationTooClose(
         stop_name=stop_name, stop_id=stop_id,
         station_stop_name=station_stop_name, station_stop_id=station_stop_id,
@@ -231,6 +290,8 @@ class ProblemReporter(object):
                                           shape_dist_traveled, shape_id,
                                           distance, max_distance,
                                           type=TYPE_WARNING):
+    if not self._WantsProblem(StopTooFarFromShapeWithDistTraveled, type):
+      return
     e = StopTooFarFromShapeWithDistTraveled(
         trip_id=trip_id, stop_name=stop_name, stop_id=stop_id,
         shape_dist_traveled=shape_dist_traveled, shape_id=shape_id,
@@ -238,6 +299,8 @@ class ProblemReporter(object):
     self.AddToAccumulator(e)
 
   def ExpirationDate(self, expiration, expiration_origin_file, context=None):
+    if not self._WantsProblem(ExpirationDate, TYPE_WARNING):
+      return
     e = ExpirationDate(expiration=expiration,
                        expiration_origin_file=expiration_origin_file,
                        context=context, context2=self._context,
@@ -245,6 +308,8 @@ class ProblemReporter(object):
     self.AddToAccumulator(e)
 
   def FutureService(self, start_date, start_date_origin_file, context=None):
+    if not self._WantsProblem(FutureService, TYPE_WARNING):
+      return
     e = FutureService(start_date=start_date,
                       start_date_origin_file=start_date_origin_file,
                       context=context, context2=self._context,
@@ -254,6 +319,8 @@ class ProblemReporter(object):
   def DateOutsideValidRange(self, column_name, value, range_start_year,
                             range_end_year, reason=None, context=None,
                             type=TYPE_ERROR):
+    if not self._WantsProblem(DateOutsideValidRange, type, column_name):
+      return
     e = DateOutsideValidRange(column_name=column_name, value=value,
                               reason=reason, range_start_year=range_start_year,
                               range_end_year=range_end_year, context=context,
@@ -261,18 +328,24 @@ class ProblemReporter(object):
     self.AddToAccumulator(e)
 
   def NoServiceExceptions(self, start, end, type=TYPE_WARNING, context=None):
+    if not self._WantsProblem(NoServiceExceptions, type):
+      return
     e = NoServiceExceptions(start=start, end=end, context=context,
                             context2=self._context, type=type);
     self.AddToAccumulator(e)
 
   def InvalidLineEnd(self, bad_line_end, context=None, type=TYPE_WARNING):
     """bad_line_end is a human readable string."""
+    if not self._WantsProblem(InvalidLineEnd, type):
+      return
     e = InvalidLineEnd(bad_line_end=bad_line_end, context=context,
                        context2=self._context, type=type)
     self.AddToAccumulator(e)
 
   def TooFastTravel(self, trip_id, prev_stop, next_stop, dist, time, speed,
                     type=TYPE_ERROR):
+    if not self._WantsProblem(TooFastTravel, type):
+      return
     e = TooFastTravel(trip_id=trip_id, prev_stop=prev_stop,
                       next_stop=next_stop, time=time, dist=dist, speed=speed,
                       context=None, context2=self._context, type=type)
@@ -280,6 +353,8 @@ class ProblemReporter(object):
 
   def StopWithMultipleRouteTypes(self, stop_name, stop_id, route_id1, route_id2,
                                  context=None, type=TYPE_WARNING):
+    if not self._WantsProblem(StopWithMultipleRouteTypes, type):
+      return
     e = StopWithMultipleRouteTypes(stop_name=stop_name, stop_id=stop_id,
                                    route_id1=route_id1, route_id2=route_id2,
                                    context=context, context2=self._context,
@@ -288,6 +363,8 @@ class ProblemReporter(object):
 
   def DuplicateTrip(self, trip_id1, route_id1, trip_id2, route_id2,
                     context=None, type=TYPE_WARNING):
+    if not self._WantsProblem(DuplicateTrip, type):
+      return
     e = DuplicateTrip(trip_id1=trip_id1, route_id1=route_id1, trip_id2=trip_id2,
                       route_id2=route_id2, context=context,
                       context2=self._context, type=type)
@@ -295,6 +372,8 @@ class ProblemReporter(object):
 
   def OverlappingTripsInSameBlock(self, trip_id1, trip_id2, block_id,
                                   context=None, type=TYPE_WARNING):
+    if not self._WantsProblem(OverlappingTripsInSameBlock, type):
+      return
     e = OverlappingTripsInSameBlock(trip_id1=trip_id1, trip_id2=trip_id2,
                                     block_id=block_id, context=context,
                                     context2=self._context, type=type);
@@ -302,6 +381,8 @@ class ProblemReporter(object):
 
   def TransferDistanceTooBig(self, from_stop_id, to_stop_id, distance,
                              context=None, type=TYPE_ERROR):
+    if not self._WantsProblem(TransferDistanceTooBig, type):
+      return
     e = TransferDistanceTooBig(from_stop_id=from_stop_id, to_stop_id=to_stop_id,
                                distance=distance, context=context,
                                context2=self._context, type=type)
@@ -310,6 +391,8 @@ class ProblemReporter(object):
   def TransferWalkingSpeedTooFast(self, from_stop_id, to_stop_id, distance,
                                   transfer_time, context=None,
                                   type=TYPE_WARNING):
+    if not self._WantsProblem(TransferWalkingSpeedTooFast, type):
+      return
     e = TransferWalkingSpeedTooFast(from_stop_id=from_stop_id,
                                     transfer_time=transfer_time,
                                     distance=distance,
@@ -318,6 +401,8 @@ class ProblemReporter(object):
     self.AddToAccumulator(e)
 
   def OtherProblem(self, description, context=None, type=TYPE_ERROR):
+    if not self._WantsProblem(OtherProblem, type):
+      return
     e = OtherProblem(description=description,
                     context=context, context2=self._context, type=type)
     self.AddToAccumulator(e)
@@ -328,6 +413,8 @@ class ProblemReporter(object):
                                 consecutive_days_without_service,
                                 context=None,
                                 type=TYPE_WARNING):
+    if not self._WantsProblem(TooManyDaysWithoutService, type):
+      return
     e = TooManyDaysWithoutService(
         first_day_without_service=first_day_without_service,
         last_day_without_service=last_day_without_service,
@@ -341,6 +428,9 @@ class ProblemReporter(object):
                                                     transfer_type=None,
                                                     context=None,
                                                     type=TYPE_ERROR):
+    if not self._WantsProblem(MinimumTransferTimeSetWithInvalidTransferType,
+                              type):
+      return
     e = MinimumTransferTimeSetWithInvalidTransferType(context=context,
         context2=self._context, transfer_type=transfer_type, type=type)
     self.AddToAccumulator(e)
@@ -351,6 +441,8 @@ class ProblemReporter(object):
       number_of_stop_times,
       time_in_secs,
       type=TYPE_WARNING):
+    if not self._WantsProblem(TooManyConsecutiveStopTimesWithSameTime, type):
+      return
     e = TooManyConsecutiveStopTimesWithSameTime(trip_id=trip_id,
         number_of_stop_times=number_of_stop_times,
         stop_time=util.FormatSecondsSinceMidnight(time_in_secs),
@@ -366,6 +458,22 @@ class ProblemAccumulatorInterface(object):
     raise NotImplementedError("Please use a concrete Problem Accumulator that "
                               "implements error and warning handling.")
 
+  def _PreReport(self, problem_class, type, column_name=None):
+    """Called by the ProblemReporter before it builds a problem object.
+
+    Accumulators which discard some problems may override this to return False
+    so that the ProblemReporter doesn't build the object or call _Report.
+
+    Args:
+      problem_class: the ExceptionWithContext subclass of the problem
+      type: TYPE_ERROR, TYPE_WARNING or TYPE_NOTICE
+      column_name: the column_name of the problem or None
+
+    Returns:
+      True if the problem should be built and passed to _Report.
+    """
+    return True
+
 
 class SimpleProblemAccumulator(ProblemAccumulatorInterface):
   """This is a basic problem accumulator that just prints to console."""
@@ -795,6 +903,93 @@ class ExceptionProblemAccumulator(ProblemAccumulatorInterface):
       self.accumulator._Report(e)
 
 
+class AggregatingProblemAccumulator(ProblemAccumulatorInterface):
+  """A problem accumulator that counts every problem but keeps few of them.
+
+  Problems are grouped by (class name, type, column name). The count of each
+  group is exact but only sample_size problems of each group are kept. They
+  are chosen by reservoir sampling so each problem of a group has the same
+  chance of being kept. Problems which won't be kept are rejected in
+  _PreReport so the ProblemReporter doesn't build them.
+  """
+  def __init__(self, sample_size=5, random_seed=None):
+    """Initialise.
+
+    Args:
+      sample_size: maximum number of problems to keep of each group
+      random_seed: seed for choosing the sample, or None for a random seed
+    """
+    self._sample_size = sample_size
+    self._random = random.Random(random_seed)
+    # {(class name, type, column name): count}
+    self._counts = {}
+    # {(class name, type, column name): [ExceptionWithContext, ...]}
+    self._samples = {}
+    # (key, sample index) of the problem accepted by the last _PreReport
+    self._pending = None
+
+  def _PreReport(self, problem_class, type, column_name=None):
+    key = (problem_class.__name__, type, column_name)
+    index = self._Sample(key)
+    if index is None:
+      return False
+    self._pending = (key, index)
+    return True
+
+  def _Report(self, e):
+    key = (e.__class__.__name__, e.GetType(), getattr(e, 'column_name', None))
+    if self._pending and self._pending[0] == key:
+      # Already counted by _PreReport
+      index = self._pending[1]
+    else:
+      index = self._Sample(key)
+    self._pending = None
+    if index is None:
+      return
+    samples = self._samples.setdefault(key, [])
+    if index == len(samples):
+      samples.append(e)
+    else:
+      samples[index] = e
+
+  def _Sample(self, key):
+    """Count a problem and return the index to keep it at or None."""
+    count = self._counts.get(key, 0) + 1
+    self._counts[key] = count
+    if count <= self._sample_size:
+      return count - 1
+    index = self._random.randrange(count)
+    if index < self._sample_size:
+      return index
+    return None
+
+  def GetCounts(self):
+    """Return a dict mapping (class name, type, column name) to a count."""
+    return self._counts
+
+  def GetSamples(self, class_name, type, column_name=None):
+    """Return the list of problems kept for a group."""
+    return self._samples.get((class_name, type, column_name), [])
+
+  def _CountType(self, type):
+    return sum(count for (_, t, _), count in self._counts.items() if t == type)
+
+  def ErrorCount(self):
+    return self._CountType(TYPE_ERROR)
+
+  def WarningCount(self):
+    return self._CountType(TYPE_WARNING)
+
+  def NoticeCount(self):
+    return self._CountType(TYPE_NOTICE)
+
+  def HasIssues(self):
+    return self.ErrorCount() or self.WarningCount()
+
+  def HasNotices(self):
+    return self.NoticeCount()
+
+
 default_accumulator = ExceptionProblemAccumulator()
 default_problem_reporter = ProblemReporter(default_accumulator)
 
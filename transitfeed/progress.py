@@ -0,0 +1,160 @@
+#!/usr/bin/python2.5
+
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+import sys
+import time
+
+
+class ProgressReporter(object):
+  """Passes progress of long running operations to a callback.
+
+  Loader, Schedule.Validate, Schedule.WriteGoogleTransitFeed and the merge
+  tool accept a ProgressReporter. They call StartPhase when they begin a step
+  such as reading stops.txt, Update while processing rows and EndPhase when
+  the step is done.
+
+  To keep the cost low callers only call Update when the row count reaches
+  the value returned by the previous StartPhase or Update call and the
+  callback is called at most once every min_interval seconds per phase.
+
+  Args:
+    callback: a function called as callback(name, count, total, rate,
+      finished) where name is the phase name, count the rows processed so far,
+      total the estimated number of rows or None if unknown, rate the rows
+      processed per second and finished is True for the final call of a phase
+    update_every: number of rows between calls to Update
+    min_interval: minimum number of seconds between calls to callback
+  """
+
+  enabled = True
+
+  def __init__(self, callback=None, update_every=1000, min_interval=1.0):
+    self._callback = callback
+    self._update_every = update_every
+    self._min_interval = min_interval
+    self._name = None
+    self._total = None
+    self._count = 0
+    self._start_time = None
+    self._last_report_time = None
+
+  def StartPhase(self, name, total=None):
+    """Start a new phase.
+
+    Args:
+      name: a string such as 'stop_times.txt' or 'ValidateTrips'
+      total: the estimated number of rows in the phase or None if unknown
+
+    Returns:
+      the row count at which Update should be called next
+    """
+    self._name = name
+    self._total = total
+    self._count = 0
+    self._start_time = time.time()
+    self._last_report_time = self._start_time
+    return self._update_every
+
+  def AddToTotal(self, rows):
+    """Add rows to the estimated number of rows of the current phase."""
+    self._total = (self._total or 0) + rows
+
+  def Update(self, count):
+    """Report that count rows of the current phase have been processed.
+
+    Returns:
+      the row count at which Update should be called next
+    """
+    self._count = count
+    now = time.time()
+    if now - self._last_report_time >= self._min_interval:
+      self._last_report_time = now
+      self._Report(False, now)
+    return count + self._update_every
+
+  def EndPhase(self, count=None):
+    """Report that the current phase is done after processing count rows."""
+    if count is not None:
+      self._count = count
+    self._Report(True, time.time())
+
+  def _Report(self, finished, now):
+    elapsed = now - self._start_time
+    if elapsed > 0:
+      rate = self._count / elapsed
+    else:
+      rate = None
+    self.Report(self._name, self._count, self._total, rate, finished)
+
+  def Report(self, name, count, total, rate, finished):
+    """Pass one progress update to the callback. See the class docstring."""
+    if self._callback:
+      self._callback(name, count, total, rate, finished)
+
+
+class ConsoleProgressReporter(ProgressReporter):
+  """Writes a single, continuously updated, progress line to a stream."""
+
+  def __init__(self, output=None, **kwargs):
+    ProgressReporter.__init__(self, **kwargs)
+    self._output = output or sys.stderr
+    self._line_length = 0
+
+  def Report(self, name, count, total, rate, finished):
+    line = FormatProgress(name, count, total, rate)
+    # Pad with spaces to overwrite the rest of a longer previous line
+    self._output.write('\r' + line.ljust(self._line_length))
+    self._line_length = len(line)
+    if finished:
+      self._output.write('\n')
+      self._line_length = 0
+    self._output.flush()
+
+
+def FormatProgress(name, count, total, rate):
+  """Return a one line description of the progress of a phase."""
+  text = '%s: %d' % (name, count)
+  if total:
+    text += ' of ~%d (%d%%)' % (total, min(100, 100 * count // total))
+  if rate:
+    text += ', %d/s' % rate
+  return text
+
+
+class NullProgressReporter(object):
+  """A stand-in for ProgressReporter that reports nothing.
+
+  StartPhase and Update return sys.maxsize, a row count which is never
+  reached, so callers never call Update.
+  """
+
+  enabled = False
+
+  def StartPhase(self, name, total=None):
+    return sys.maxsize
+
+  def AddToTotal(self, rows):
+    pass
+
+  def Update(self, count):
+    return sys.maxsize
+
+  def EndPhase(self, count=None):
+    pass
+
+
+null_progress_reporter = NullProgressReporter()
@@ -16,6 +16,7 @@
 
 from __future__ import absolute_import
 from .gtfsobjectbase import GtfsObjectBase
+from . import patternindex
 from . import problems as problems_module
 from . import util
 
@@ -48,6 +49,8 @@ class Route(GtfsObjectBase):
                route_id=None, agency_id=None, field_dict=None):
     self._schedule = None
     self._trips = []
+    self._pattern_index = None
+    self._pattern_index_generation = None
 
     if not field_dict:
       field_dict = {}
@@ -117,6 +120,17 @@ class Route(GtfsObjectBase):
       d.setdefault(t.pattern_id, []).append(t)
     return d
 
+  def GetPatternIndex(self):
+    """Return a PatternIndex of the trips of this route, building it if needed.
+
+    The index is kept until trips or stop times of the schedule change.
+    """
+    generation = self._schedule._trip_generation
+    if self._pattern_index_generation != generation:
+      self._pattern_index = patternindex.PatternIndex(self)
+      self._pattern_index_generation = generation
+    return self._pattern_index
+
   def ValidateRouteIdIsPresent(self, problems):
     if util.IsEmpty(self.route_id):
       problems.MissingValue('route_id')
@@ -30,6 +30,7 @@ except ImportError:
     from com.ziclix.python.sql import zxJDBC as sqlite
     native_sqlite = False
 import tempfile
+import threading
 import time
 import warnings
 # Objects in a schedule (Route, Trip, etc) should not keep a strong reference
@@ -39,12 +40,106 @@ import warnings
 import weakref
 import zipfile
 
+from . import departureindex
 from . import gtfsfactoryuser
+from . import phasestats
+from . import progress as progress_module
 from . import problems as problems_module
+from . import stopsearch
+from . import tileindex
 from .util import defaultdict
 from . import util
 from .compat import StringIO
 
+class LockingConnection(object):
+  """Wraps a database connection so that it can be shared by threads.
+
+  Each query is run while holding a lock and all of its rows are fetched
+  before the lock is released, so the cursors returned by cursor() can be
+  used from any thread.
+  """
+
+  def __init__(self, connection):
+    self._connection = connection
+    self._lock = threading.RLock()
+
+  def cursor(self):
+    return LockingCursor(self._connection, self._lock)
+
+  def commit(self):
+    self._lock.acquire()
+    try:
+      self._connection.commit()
+    finally:
+      self._lock.release()
+
+  def close(self):
+    self._connection.close()
+
+
+class LockingCursor(object):
+  """A cursor of a LockingConnection. See LockingConnection."""
+
+  def __init__(self, connection, lock):
+    self._connection = connection
+    self._lock = lock
+    self._rows = []
+    self._next_row = 0
+    self.rowcount = -1
+
+  def execute(self, query, parameters=()):
+    self._lock.acquire()
+    try:
+      cursor = self._connection.cursor()
+      try:
+        cursor.execute(query, parameters)
+        self._rows = cursor.fetchall()
+        self.rowcount = cursor.rowcount
+      finally:
+        cursor.close()
+    finally:
+      self._lock.release()
+    self._next_row = 0
+    return self
+
+  def executemany(self, query, seq_of_parameters):
+    self._lock.acquire()
+    try:
+      cursor = self._connection.cursor()
+      try:
+        cursor.executemany(query, seq_of_parameters)
+        self.rowcount = cursor.rowcount
+      finally:
+        cursor.close()
+    finally:
+      self._lock.release()
+    self._rows = []
+    self._next_row = 0
+    return self
+
+  def fetchone(self):
+    if self._next_row >= len(self._rows):
+      return None
+    row = self._rows[self._next_row]
+    self._next_row += 1
+    return row
+
+  def fetchall(self):
+    rows = self._rows[self._next_row:]
+    self._next_row = len(self._rows)
+    return rows
+
+  def __iter__(self):
+    return iter(self.fetchall())
+
+  def close(self):
+    self._rows = []
+
+
+# Source of the values returned by Schedule.GetGeneration
+_generation_counter = itertools.count(1)
+
+
 class Schedule(object):
   """Represents a Schedule, a collection of stops, routes, trips and
   an agency.  This is the main class for this module."""
@@ -82,6 +177,17 @@ class Schedule(object):
     else:
       self.problem_reporter = problem_reporter
     self._check_duplicate_trips = check_duplicate_trips
+    # Built by GetDepartureIndex when first needed
+    self._departure_index = None
+    self._departure_index_generation = None
+    self._index_lock = threading.Lock()
+    # Incremented when trips or stop times change, see _TripsChanged
+    self._trip_generation = 0
+    self._generation = next(_generation_counter)
+    self._stop_search_index = None
+    self._stop_search_index_generation = None
+    self._tile_index = None
+    self._tile_index_generation = None
     self.ConnectDb(memory_db)
 
   def AddTableColumn(self, table, column):
@@ -113,7 +219,8 @@ class Schedule(object):
   def ConnectDb(self, memory_db):
     def connector(db_file):
       if native_sqlite:
-        return sqlite.connect(db_file)
+        # Allow MakeThreadSafe to share the connection between threads
+        return sqlite.connect(db_file, check_same_thread=False)
       else:
         return sqlite.connect("jdbc:sqlite:%s" % db_file,
                               "", "", "org.sqlite.JDBC")
@@ -147,6 +254,96 @@ class Schedule(object):
     cursor.execute("""CREATE INDEX trip_index ON stop_times (trip_id);""")
     cursor.execute("""CREATE INDEX stop_index ON stop_times (stop_id);""")
 
+  def MakeThreadSafe(self):
+    """Allow this schedule to be read from several threads at the same time.
+
+    Queries of the stop_times table are serialized with a lock. Changing the
+    schedule while other threads read it is not supported.
+    """
+    if not isinstance(self._connection, LockingConnection):
+      self._connection = LockingConnection(self._connection)
+
+  def GetGeneration(self):
+    """Return a number which changes when this schedule changes.
+
+    The number changes when objects are added with the Add*Object methods,
+    when stop times change and when MarkChanged is called. Numbers are never
+    reused, also not by other Schedule objects, so they can be used to key
+    cached results.
+    """
+    return self._generation
+
+  def MarkChanged(self):
+    """Change the number returned by GetGeneration.
+
+    Call this after modifying attributes of objects in the schedule, such as
+    the location of a stop, so that results cached for the old generation
+    aren't used.
+    """
+    self._generation = next(_generation_counter)
+
+  def _TripsChanged(self):
+    """Called when trips or stop times change to invalidate cached indexes."""
+    self._trip_generation += 1
+    self.MarkChanged()
+
+  def GetDepartureIndex(self):
+    """Return a DepartureIndex of this schedule, building it if needed.
+
+    The index is kept until trips or stop times of the schedule change.
+    """
+    self._index_lock.acquire()
+    try:
+      if self._departure_index_generation != self._trip_generation:
+        self._departure_index = departureindex.DepartureIndex(self)
+        self._departure_index_generation = self._trip_generation
+      return self._departure_index
+    finally:
+      self._index_lock.release()
+
+  def GetStopSearchIndex(self):
+    """Return a StopSearchIndex of the stops, building it if needed.
+
+    The index is rebuilt when GetGeneration changes.
+    """
+    self._index_lock.acquire()
+    try:
+      generation = self.GetGeneration()
+      if self._stop_search_index_generation != generation:
+        self._stop_search_index = stopsearch.StopSearchIndex(
+            self.GetStopList())
+        self._stop_search_index_generation = generation
+      return self._stop_search_index
+    finally:
+      self._index_lock.release()
+
+  def GetTileIndex(self):
+    """Return a TileIndex of the stops and shapes, building it if needed.
+
+    The index is rebuilt when GetGeneration changes.
+    """
+    self._index_lock.acquire()
+    try:
+      generation = self.GetGeneration()
+      if self._tile_index_generation != generation:
+        self._tile_index = tileindex.TileIndex(self)
+        self._tile_index_generation = generation
+      return self._tile_index
+    finally:
+      self._index_lock.release()
+
+  def BuildIndexes(self):
+    """Build the indexes used to browse the schedule ahead of their first use.
+
+    Builds the indexes returned by GetDepartureIndex, GetStopSearchIndex,
+    GetTileIndex and Route.GetPatternIndex.
+    """
+    self.GetDepartureIndex()
+    self.GetStopSearchIndex()
+    self.GetTileIndex()
+    for route in self.GetRouteList():
+      route.GetPatternIndex()
+
   def GetStopBoundingBox(self):
     return (min(s.stop_lat for s in self.stops.values()),
             min(s.stop_lon for s in self.stops.values()),
@@ -176,6 +373,7 @@ class Schedule(object):
     if validate:
       agency.Validate(problem_reporter)
     self._agencies[agency.agency_id] = agency
+    self.MarkChanged()
 
   def GetAgency(self, agency_id):
     """Return Agency with agency_id or throw a KeyError"""
@@ -259,6 +457,7 @@ class Schedule(object):
     if validate:
       service_period.Validate(problem_reporter)
     self.service_periods[service_period.service_id] = service_period
+    self.MarkChanged()
 
   def GetServicePeriodList(self):
     return self.service_periods.values()
@@ -371,6 +570,7 @@ class Schedule(object):
     stop._schedule = weakref.proxy(self)
     self.AddTableColumns('stops', stop._ColumnNames())
     self.stops[stop.stop_id] = stop
+    self.MarkChanged()
     if hasattr(stop, 'zone_id') and stop.zone_id:
       self.fare_zones[stop.zone_id] = True
 
@@ -416,6 +616,7 @@ class Schedule(object):
     self.AddTableColumns('routes', route._ColumnNames())
     route._schedule = weakref.proxy(self)
     self.routes[route.route_id] = route
+    self.MarkChanged()
 
   def GetRouteList(self):
     return self.routes.values()
@@ -434,6 +635,7 @@ class Schedule(object):
       return
 
     self._shapes[shape.shape_id] = shape
+    self.MarkChanged()
 
   def GetShapeList(self):
     return self._shapes.values()
@@ -452,6 +654,7 @@ class Schedule(object):
     self.AddTableColumns('trips', trip._ColumnNames())
     trip._schedule = weakref.proxy(self)
     self.trips[trip.trip_id] = trip
+    self._TripsChanged()
 
     # Call Trip.Validate after setting trip._schedule so that references
     # are checked. trip.ValidateChildren will be called directly by
@@ -472,6 +675,35 @@ class Schedule(object):
   def GetTrip(self, trip_id):
     return self.trips[trip_id]
 
+  # Maximum number of trip_ids in one query of GetTimeStopsOfTrips, below the
+  # default limit of 999 parameters in an SQLite statement
+  _MAX_TRIPS_PER_QUERY = 500
+
+  def GetTimeStopsOfTrips(self, trip_ids):
+    """Return the stop times of many trips with a few database queries.
+
+    Args:
+      trip_ids: an iterable of trip_id strings
+
+    Returns:
+      a dict mapping each trip_id to a list of (arrival_secs, departure_secs,
+      stop) tuples like Trip.GetTimeStops. Trips without stop times map to an
+      empty list.
+    """
+    trip_ids = list(set(trip_ids))
+    result = dict((trip_id, []) for trip_id in trip_ids)
+    cursor = self._connection.cursor()
+    for start in range(0, len(trip_ids), self._MAX_TRIPS_PER_QUERY):
+      chunk = trip_ids[start:start + self._MAX_TRIPS_PER_QUERY]
+      cursor.execute(
+          'SELECT trip_id,arrival_secs,departure_secs,stop_id FROM stop_times '
+          'WHERE trip_id IN (%s) ORDER BY trip_id,stop_sequence' %
+          ','.join(['?'] * len(chunk)), chunk)
+      for trip_id, arrival_secs, departure_secs, stop_id in cursor.fetchall():
+        result[trip_id].append(
+            (arrival_secs, departure_secs, self.stops[stop_id]))
+    return result
+
   def AddFareObject(self, fare, problem_reporter=None):
     """Deprecated. Please use AddFareAttributeObject."""
     warnings.warn("No longer supported. The Fare class was renamed to "
@@ -489,6 +721,7 @@ class Schedule(object):
       return
 
     self.fares[fare.fare_id] = fare
+    self.MarkChanged()
 
   def GetFareList(self):
     """Deprecated. Please use GetFareAttributeList instead"""
@@ -529,6 +762,7 @@ class Schedule(object):
 
     if rule.fare_id in self.fares:
       self.GetFareAttribute(rule.fare_id).rules.append(rule)
+      self.MarkChanged()
     else:
       problem_reporter.InvalidValue('fare_id', rule.fare_id,
                                     '(This fare_id doesn\'t correspond to any '
@@ -547,6 +781,7 @@ class Schedule(object):
       feed_info.Validate(problem_reporter)
     self.AddTableColumns('feed_info', feed_info._ColumnNames())
     self.feed_info = feed_info
+    self.MarkChanged()
 
   def AddTransferObject(self, transfer, problem_reporter=None):
     assert transfer._schedule is None, "only add Transfer to a schedule once"
@@ -564,6 +799,7 @@ class Schedule(object):
     transfer._schedule = weakref.proxy(self)  # See weakref comment at top
     self.AddTableColumns('transfers', transfer._ColumnNames())
     self._transfers[transfer_id].append(transfer)
+    self.MarkChanged()
 
   def GetTransferIter(self):
     """Return an iterator for all Transfer objects in this schedule."""
@@ -605,10 +841,11 @@ class Schedule(object):
           break
     return stop_list
 
-  def Load(self, feed_path, extra_validation=False):
+  def Load(self, feed_path, extra_validation=False, progress=None):
     loader = self._gtfs_factory.Loader(feed_path,
                                        self, problems=self.problem_reporter,
-                                       extra_validation=extra_validation)
+                                       extra_validation=extra_validation,
+                                       progress=progress)
     loader.Load()
 
   def _WriteArchiveString(self, archive, filename, stringio):
@@ -620,15 +857,36 @@ class Schedule(object):
     zi.compress_type = zipfile.ZIP_DEFLATED
     archive.writestr(zi, stringio.getvalue())
 
-  def WriteGoogleTransitFeed(self, file):
+  def _CreateArchiveTempFile(self):
+    """Return (file object, path) of a new temporary file for the contents of
+    a large file of the archive."""
+    (fd, path) = tempfile.mkstemp('.txt')
+    return (os.fdopen(fd, 'wb'), path)
+
+  def _WriteArchiveFile(self, archive, filename, path):
+    """Like _WriteArchiveString for the contents of the file at path.
+
+    zipfile compresses the file in blocks, so large files such as
+    stop_times.txt are never held in memory as a whole.
+    """
+    archive.write(path, filename, zipfile.ZIP_DEFLATED)
+    # The permissions are only stored in the central directory, which is
+    # written by archive.close()
+    archive.getinfo(filename).external_attr = 0o666 << 16
+
+  def WriteGoogleTransitFeed(self, file, progress=None):
     """Output this schedule as a Google Transit Feed in file_name.
 
     Args:
       file: path of new feed file (a string) or a file-like object
+      progress: a ProgressReporter object which is updated while the large
+        files are written, or None to not report progress
 
     Returns:
       None
     """
+    if progress is None:
+      progress = progress_module.null_progress_reporter
     # Compression type given when adding each file
     archive = zipfile.ZipFile(file, 'w')
 
@@ -682,9 +940,15 @@ class Schedule(object):
       writer = util.CsvUnicodeWriter(stop_string)
       columns = self.GetTableColumns('stops')
       writer.writerow(columns)
+      next_progress = progress.StartPhase('stops.txt', len(self.stops))
+      count = 0
       for s in self.stops.values():
+        count += 1
+        if count == next_progress:
+          next_progress = progress.Update(count)
         writer.writerow([util.EncodeUnicode(s[c]) for c in columns])
       self._WriteArchiveString(archive, 'stops.txt', stop_string)
+      progress.EndPhase(count)
 
     if 'routes' in self._table_columns:
       route_string = StringIO()
@@ -700,9 +964,15 @@ class Schedule(object):
       writer = util.CsvUnicodeWriter(trips_string)
       columns = self.GetTableColumns('trips')
       writer.writerow(columns)
+      next_progress = progress.StartPhase('trips.txt', len(self.trips))
+      count = 0
       for t in self.trips.values():
+        count += 1
+        if count == next_progress:
+          next_progress = progress.Update(count)
         writer.writerow([util.EncodeUnicode(t[c]) for c in columns])
       self._WriteArchiveString(archive, 'trips.txt', trips_string)
+      progress.EndPhase(count)
 
     # write frequencies.txt (if applicable)
     headway_rows = []
@@ -735,26 +1005,52 @@ class Schedule(object):
       writer.writerow(self._gtfs_factory.FareRule._FIELD_NAMES)
       writer.writerows(rule_rows)
       self._WriteArchiveString(archive, 'fare_rules.txt', rule_string)
-    stop_times_string = StringIO()
-    writer = util.CsvUnicodeWriter(stop_times_string)
-    writer.writerow(self._gtfs_factory.StopTime._FIELD_NAMES)
-    for t in self.trips.values():
-      writer.writerows(t._GenerateStopTimesTuples())
-    self._WriteArchiveString(archive, 'stop_times.txt', stop_times_string)
+    # stop_times.txt and shapes.txt are written through temporary files
+    # because they can be larger than the available memory
+    (stop_times_file, stop_times_path) = self._CreateArchiveTempFile()
+    try:
+      writer = util.CsvUnicodeWriter(stop_times_file)
+      writer.writerow(self._gtfs_factory.StopTime._FIELD_NAMES)
+      # Progress of stop_times.txt is counted in trips because the number of
+      # stop times isn't known without querying the database.
+      next_progress = progress.StartPhase('stop_times.txt', len(self.trips))
+      count = 0
+      for t in self.trips.values():
+        count += 1
+        if count == next_progress:
+          next_progress = progress.Update(count)
+        writer.writerows(t._GenerateStopTimesTuples())
+      stop_times_file.close()
+      self._WriteArchiveFile(archive, 'stop_times.txt', stop_times_path)
+      progress.EndPhase(count)
+    finally:
+      stop_times_file.close()
+      os.remove(stop_times_path)
 
     # write shapes (if applicable)
-    shape_rows = []
-    for shape in self.GetShapeList():
-      seq = 1
-      for (lat, lon, dist) in shape.points:
-        shape_rows.append((shape.shape_id, lat, lon, seq, dist))
-        seq += 1
-    if shape_rows:
-      shape_string = StringIO()
-      writer = util.CsvUnicodeWriter(shape_string)
+    (shape_file, shape_path) = self._CreateArchiveTempFile()
+    try:
+      writer = util.CsvUnicodeWriter(shape_file)
       writer.writerow(self._gtfs_factory.Shape._FIELD_NAMES)
-      writer.writerows(shape_rows)
-      self._WriteArchiveString(archive, 'shapes.txt', shape_string)
+      has_data = False
+      next_progress = progress.StartPhase('shapes.txt', len(self._shapes))
+      count = 0
+      for shape in self.GetShapeList():
+        count += 1
+        if count == next_progress:
+          next_progress = progress.Update(count)
+        seq = 1
+        for (lat, lon, dist) in shape.points:
+          has_data = True
+          writer.writerow((shape.shape_id, lat, lon, seq, dist))
+          seq += 1
+      shape_file.close()
+      if has_data:
+        self._WriteArchiveFile(archive, 'shapes.txt', shape_path)
+      progress.EndPhase(count)
+    finally:
+      shape_file.close()
+      os.remove(shape_path)
 
     if 'transfers' in self._table_columns:
       transfer_string = StringIO()
@@ -1096,7 +1392,11 @@ class Schedule(object):
       else:
         route_names[name] = route
 
-  def ValidateTrips(self, problems):
+  def ValidateTrips(self, problems, progress=None):
+    if progress is None:
+      progress = progress_module.null_progress_reporter
+    next_progress = progress.StartPhase('ValidateTrips', len(self.trips))
+    count = 0
     stop_types = {} # a dict mapping stop_id to [route_id, route_type, is_match]
     trips = {} # a dict mapping tuple to (route_id, trip_id)
 
@@ -1105,6 +1405,9 @@ class Schedule(object):
     trip_intervals_by_block_id = defaultdict(lambda: [])
 
     for trip in sorted(self.trips.values()):
+      count += 1
+      if count == next_progress:
+        next_progress = progress.Update(count)
       if trip.route_id not in self.routes:
         continue
       route_type = self.GetRoute(trip.route_id).route_type
@@ -1165,6 +1468,7 @@ class Schedule(object):
     # Now that we've generated our block trip intervls, we can check for
     # overlaps in the intervals
     self.ValidateBlocks(problems, trip_intervals_by_block_id)
+    progress.EndPhase(count)
 
   def ValidateStopTimesForTrip(self, problems, trip, stop_times):
     """Checks for the stop times of a trip.
@@ -1295,30 +1599,43 @@ class Schedule(object):
         problems.InvalidAgencyID('agency_id', route.agency_id,
                                  'route', route.route_id)
 
-  def ValidateTripStopTimes(self, problems):
+  def ValidateTripStopTimes(self, problems, progress=None):
     # Make sure all trips have stop_times
     # We're doing this here instead of in Trip.Validate() so that
     # Trips can be validated without error during the reading of trips.txt
+    if progress is None:
+      progress = progress_module.null_progress_reporter
+    next_progress = progress.StartPhase('ValidateTripStopTimes',
+                                        len(self.trips))
+    count = 0
     for trip in self.trips.values():
-      trip.ValidateChildren(problems)
-      count_stop_times = trip.GetCountStopTimes()
-      if not count_stop_times:
-        problems.OtherProblem('The trip with the trip_id "%s" doesn\'t have '
-                              'any stop times defined.' % trip.trip_id,
-                              type=problems_module.TYPE_WARNING)
-        if len(trip._headways) > 0:  # no stoptimes, but there are headways
-          problems.OtherProblem('Frequencies defined, but no stop times given '
-                                'in trip %s' % trip.trip_id,
-                                type=problems_module.TYPE_ERROR)
-      elif count_stop_times == 1:
-        problems.OtherProblem('The trip with the trip_id "%s" only has one '
-                              'stop on it; it should have at least one more '
-                              'stop so that the riders can leave!' %
-                              trip.trip_id, type=problems_module.TYPE_WARNING)
-      else:
-        # These methods report InvalidValue if there's no first or last time
-        trip.GetStartTime(problems=problems)
-        trip.GetEndTime(problems=problems)
+      count += 1
+      if count == next_progress:
+        next_progress = progress.Update(count)
+      self.ValidateTripChildren(problems, trip)
+    progress.EndPhase(count)
+
+  def ValidateTripChildren(self, problems, trip):
+    """Validate the stop times and frequencies of one trip."""
+    trip.ValidateChildren(problems)
+    count_stop_times = trip.GetCountStopTimes()
+    if not count_stop_times:
+      problems.OtherProblem('The trip with the trip_id "%s" doesn\'t have '
+                            'any stop times defined.' % trip.trip_id,
+                            type=problems_module.TYPE_WARNING)
+      if len(trip._headways) > 0:  # no stoptimes, but there are headways
+        problems.OtherProblem('Frequencies defined, but no stop times given '
+                              'in trip %s' % trip.trip_id,
+                              type=problems_module.TYPE_ERROR)
+    elif count_stop_times == 1:
+      problems.OtherProblem('The trip with the trip_id "%s" only has one '
+                            'stop on it; it should have at least one more '
+                            'stop so that the riders can leave!' %
+                            trip.trip_id, type=problems_module.TYPE_WARNING)
+    else:
+      # These methods report InvalidValue if there's no first or last time
+      trip.GetStartTime(problems=problems)
+      trip.GetEndTime(problems=problems)
 
   def ValidateUnusedShapes(self, problems):
     # Check for unused shapes
@@ -1333,29 +1650,69 @@ class Schedule(object):
                             ', '.join(unused_shape_ids),
                             type=problems_module.TYPE_WARNING)
 
+  def _RunValidationStep(self, stats, progress, name, rows, function, *args):
+    """Run one step of Validate, recording stats and reporting progress."""
+    progress.StartPhase(name, rows)
+    stats.RunPhase(name, rows, function, *args)
+    progress.EndPhase(rows)
+
   def Validate(self,
                problems=None,
                validate_children=True,
                today=None,
-               service_gap_interval=None):
+               service_gap_interval=None,
+               stats=None,
+               progress=None):
     """Validates various holistic aspects of the schedule
-       (mostly interrelationships between the various data sets)."""
+       (mostly interrelationships between the various data sets).
+
+    Args:
+      problems: a ProblemReporter or None to use self.problem_reporter
+      validate_children: if True each entity is validated too
+      today: a date object used to check the feed dates, or None for today
+      service_gap_interval: days without service that trigger a warning, or
+        None to not check for service gaps
+      stats: a PhaseStats object which records the time and memory use of
+        each validation step, or None to not record them
+      progress: a ProgressReporter object which is updated as each validation
+        step runs, or None to not report progress
+    """
 
     if not problems:
       problems = self.problem_reporter
-
-    self.ValidateAgenciesHaveSameAgencyTimezone(problems)
-    self.ValidateFeedInfoLangMatchesAgencyLang(problems)
-    self.ValidateServiceRangeAndExceptions(problems, today,
-                                           service_gap_interval)
+    if stats is None:
+      stats = phasestats.null_phase_stats
+    if progress is None:
+      progress = progress_module.null_progress_reporter
+
+    step = self._RunValidationStep
+    step(stats, progress, 'ValidateAgenciesHaveSameAgencyTimezone',
+         len(self._agencies),
+         self.ValidateAgenciesHaveSameAgencyTimezone, problems)
+    step(stats, progress, 'ValidateFeedInfoLangMatchesAgencyLang',
+         len(self._agencies),
+         self.ValidateFeedInfoLangMatchesAgencyLang, problems)
+    step(stats, progress, 'ValidateServiceRangeAndExceptions',
+         len(self.service_periods),
+         self.ValidateServiceRangeAndExceptions, problems, today,
+         service_gap_interval)
     # TODO: Check Trip fields against valid values
-    self.ValidateStops(problems, validate_children)
+    step(stats, progress, 'ValidateStops', len(self.stops),
+         self.ValidateStops, problems, validate_children)
     #TODO: check that every station is used.
     # Then uncomment testStationWithoutReference.
-    self.ValidateNearbyStops(problems)
-    self.ValidateRouteNames(problems, validate_children)
-    self.ValidateTrips(problems)
-    self.ValidateIdlessAgency(problems)
-    self.ValidateRouteAgencyId(problems)
-    self.ValidateTripStopTimes(problems)
-    self.ValidateUnusedShapes(problems)
+    step(stats, progress, 'ValidateNearbyStops', len(self.stops),
+         self.ValidateNearbyStops, problems)
+    step(stats, progress, 'ValidateRouteNames', len(self.routes),
+         self.ValidateRouteNames, problems, validate_children)
+    # The trip steps are the slow ones so they report progress per trip
+    stats.RunPhase('ValidateTrips', len(self.trips),
+                   self.ValidateTrips, problems, progress)
+    step(stats, progress, 'ValidateIdlessAgency', len(self._agencies),
+         self.ValidateIdlessAgency, problems)
+    step(stats, progress, 'ValidateRouteAgencyId', len(self.routes),
+         self.ValidateRouteAgencyId, problems)
+    stats.RunPhase('ValidateTripStopTimes', len(self.trips),
+                   self.ValidateTripStopTimes, problems, progress)
+    step(stats, progress, 'ValidateUnusedShapes', len(self._shapes),
+         self.ValidateUnusedShapes, problems)
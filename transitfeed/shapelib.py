@@ -242,6 +242,62 @@ def GetClosestPoint(x, a, b):
   else:
     return b
 
+def EncodePolyline(points, precision=5):
+  """
+  Returns points encoded with the Google Maps encoded polyline algorithm.
+
+  points is a list of (lat, lng) tuples in degrees. Each coordinate is
+  rounded to precision decimal digits and stored as the difference to the
+  previous point, which is usually much shorter than a list of numbers.
+  """
+  factor = 10 ** precision
+  chunks = []
+  prev_lat = 0
+  prev_lng = 0
+  for lat, lng in points:
+    lat = int(round(lat * factor))
+    lng = int(round(lng * factor))
+    for delta in (lat - prev_lat, lng - prev_lng):
+      value = delta << 1
+      if delta < 0:
+        value = ~value
+      while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+      chunks.append(chr(value + 63))
+    prev_lat = lat
+    prev_lng = lng
+  return ''.join(chunks)
+
+def DecodePolyline(encoded, precision=5):
+  """
+  Returns the list of (lat, lng) tuples encoded by EncodePolyline.
+  """
+  factor = float(10 ** precision)
+  points = []
+  values = []
+  value = 0
+  shift = 0
+  for c in encoded:
+    byte = ord(c) - 63
+    value |= (byte & 0x1f) << shift
+    shift += 5
+    if byte < 0x20:
+      if value & 1:
+        value = ~value
+      values.append(value >> 1)
+      value = 0
+      shift = 0
+  if len(values) % 2:
+    raise ShapeError('Encoded polyline has an odd number of values')
+  lat = 0
+  lng = 0
+  for i in range(0, len(values), 2):
+    lat += values[i]
+    lng += values[i + 1]
+    points.append((lat / factor, lng / factor))
+  return points
+
 
 class Poly(object):
   """
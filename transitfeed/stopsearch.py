@@ -0,0 +1,169 @@
+#!/usr/bin/python2.5
+
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+import bisect
+import re
+import unicodedata
+
+from .util import defaultdict
+
+# Length of the substrings used as keys of the n-gram index
+NGRAM_LENGTH = 3
+
+# Ranks of a match, lower is better
+RANK_EXACT = 0
+RANK_PREFIX = 1
+RANK_WORD_PREFIX = 2
+RANK_SUBSTRING = 3
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def NormalizeSearchText(text):
+  """Return text lowercased and without accents, for search.
+
+  Args:
+    text: a unicode string or a UTF-8 encoded str
+
+  Returns:
+    a unicode string, for example u'cafe' for u'Caf\\xe9'
+  """
+  if text is None:
+    return u''
+  if not isinstance(text, type(u'')):
+    text = text.decode('utf-8', 'replace')
+  text = text.lower()
+  try:
+    text.encode('ascii')
+    # Most names are plain ASCII and have no accents to remove
+    return text
+  except UnicodeError:
+    pass
+  decomposed = unicodedata.normalize('NFKD', text)
+  return u''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+class StopSearchIndex(object):
+  """Finds stops whose stop_name or stop_id contain a query string.
+
+  Matching ignores case and accents. Queries of NGRAM_LENGTH or more
+  characters look up the stops containing every n-gram of the query and then
+  check only those stops. Shorter queries match the start of a word of the
+  stop_name or the start of the stop_id using binary search over a sorted
+  list of words. Neither scans all stops.
+
+  Matches are ranked: the query equals the stop_name or stop_id, it is a
+  prefix of one of them, it is a prefix of a word of the stop_name or it is
+  elsewhere in the text. Matches with the same rank are ordered by stop_name
+  and stop_id.
+  """
+
+  def __init__(self, stops):
+    """Build the index.
+
+    Args:
+      stops: an iterable of Stop objects
+    """
+    # Sorted by the order in which equally ranked matches are returned
+    self._stops = sorted(stops, key=lambda s: (s.stop_name, s.stop_id))
+    # [(normalized stop_name, normalized stop_id, words of the stop_name)]
+    # parallel to _stops
+    self._texts = []
+    # {n-gram: [offset in _stops, ...]} offsets are in increasing order
+    self._ngrams = defaultdict(list)
+    # Sorted list of (word, offset in _stops) for words of the stop_name and
+    # the stop_id
+    self._words = []
+    self._Build()
+
+  def _Build(self):
+    for i, stop in enumerate(self._stops):
+      name = NormalizeSearchText(stop.stop_name)
+      stop_id = NormalizeSearchText(stop.stop_id)
+      name_words = tuple(_WORD_RE.findall(name))
+      self._texts.append((name, stop_id, name_words))
+      ngrams = set()
+      for text in (name, stop_id):
+        for start in range(len(text) - NGRAM_LENGTH + 1):
+          ngrams.add(text[start:start + NGRAM_LENGTH])
+      for ngram in ngrams:
+        self._ngrams[ngram].append(i)
+      for word in set(name_words + (stop_id,)):
+        self._words.append((word, i))
+    self._words.sort()
+
+  def Search(self, query, limit=None):
+    """Return stops matching query, best matches first.
+
+    Args:
+      query: a unicode string or a UTF-8 encoded str
+      limit: the maximum number of stops to return, or None for all
+
+    Returns:
+      a list of Stop objects
+    """
+    query = NormalizeSearchText(query).strip()
+    if not query:
+      return []
+    ranked = []
+    for i in self._GetCandidates(query):
+      rank = self._Rank(query, i)
+      if rank is not None:
+        ranked.append((rank, i))
+    ranked.sort()
+    if limit is not None:
+      ranked = ranked[:limit]
+    return [self._stops[i] for rank, i in ranked]
+
+  def _GetCandidates(self, query):
+    """Return offsets of stops which may match query."""
+    if len(query) < NGRAM_LENGTH:
+      candidates = set()
+      words = self._words
+      for j in range(bisect.bisect_left(words, (query,)), len(words)):
+        word, i = words[j]
+        if not word.startswith(query):
+          break
+        candidates.add(i)
+      return candidates
+    postings = []
+    for start in range(len(query) - NGRAM_LENGTH + 1):
+      posting = self._ngrams.get(query[start:start + NGRAM_LENGTH])
+      if not posting:
+        return ()
+      postings.append(posting)
+    postings.sort(key=len)
+    candidates = set(postings[0])
+    for posting in postings[1:]:
+      candidates.intersection_update(posting)
+      if not candidates:
+        break
+    return candidates
+
+  def _Rank(self, query, i):
+    """Return the rank of stop i for query or None if it doesn't match."""
+    name, stop_id, name_words = self._texts[i]
+    if query == name or query == stop_id:
+      return RANK_EXACT
+    if name.startswith(query) or stop_id.startswith(query):
+      return RANK_PREFIX
+    for word in name_words:
+      if word.startswith(query):
+        return RANK_WORD_PREFIX
+    if query in name or query in stop_id:
+      return RANK_SUBSTRING
+    return None
@@ -0,0 +1,319 @@
+#!/usr/bin/python2.5
+
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Map tiles of the stops and shapes of a schedule.
+
+Tiles are addressed by zoom, x and y as in the Web Mercator projection used by
+web maps: the tile 0/0/0 covers the world and each tile at zoom z is split in
+four tiles at zoom z + 1. Positions are handled as world coordinates, which
+are in [0, 1) with (0, 0) at the north west corner of tile 0/0/0.
+
+Stops are indexed by the Morton code of the cell containing them at
+STOP_INDEX_ZOOM and shapes by the codes of the cells their segments cross at
+SHAPE_INDEX_ZOOM. The cells inside any tile have consecutive codes, so the
+items of a tile are found with a binary search in a sorted list of codes.
+"""
+
+from __future__ import absolute_import
+import bisect
+import math
+
+# Zoom levels of the cells used to index stops and shape segments. Shapes
+# use larger cells because a segment is added to every cell it crosses.
+STOP_INDEX_ZOOM = 16
+SHAPE_INDEX_ZOOM = 12
+
+# Size of a tile in pixels, used to choose the simplification tolerance
+TILE_SIZE = 256
+
+# Stops closer than this many pixels in a tile are thinned to one stop
+STOP_CELL_PIXELS = 8
+
+# Largest latitude of the Web Mercator projection
+MAX_LATITUDE = 85.05112878
+
+
+def LatLngToWorld(lat, lng):
+  """Return world coordinates (x, y) of a position, each in [0, 1)."""
+  lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+  x = (lng + 180.0) / 360.0
+  sin_lat = math.sin(math.radians(lat))
+  y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+  return (min(max(x, 0.0), 1.0 - 1e-12), min(max(y, 0.0), 1.0 - 1e-12))
+
+
+def WorldToLatLng(x, y):
+  """Return (lat, lng) of world coordinates x, y."""
+  lng = x * 360.0 - 180.0
+  lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+  return (lat, lng)
+
+
+def GetTileBounds(zoom, x, y):
+  """Return the (north, east, south, west) bounds of a tile in degrees."""
+  scale = float(1 << zoom)
+  north, west = WorldToLatLng(x / scale, y / scale)
+  south, east = WorldToLatLng((x + 1) / scale, (y + 1) / scale)
+  return (north, east, south, west)
+
+
+def _Interleave(x, y):
+  """Return the Morton code of cell x, y by interleaving their bits."""
+  code = 0
+  bit = 0
+  while x or y:
+    code |= ((x & 1) << (2 * bit + 1)) | ((y & 1) << (2 * bit))
+    x >>= 1
+    y >>= 1
+    bit += 1
+  return code
+
+
+def _CellCode(world_x, world_y, index_zoom):
+  scale = 1 << index_zoom
+  return _Interleave(int(world_x * scale), int(world_y * scale))
+
+
+def _TileCodeRange(zoom, x, y, index_zoom):
+  """Return [first, last) Morton codes of the index cells in a tile.
+
+  Tiles with a zoom above index_zoom are inside a single cell, the range of
+  that cell is returned.
+  """
+  if zoom > index_zoom:
+    x >>= zoom - index_zoom
+    y >>= zoom - index_zoom
+    zoom = index_zoom
+  shift = 2 * (index_zoom - zoom)
+  first = _Interleave(x, y) << shift
+  return first, first + (1 << shift)
+
+
+def _AddSegmentCells(cells, a, b, value):
+  """Add (code, value) to cells for each SHAPE_INDEX_ZOOM cell that the
+  segment from world coordinates a to b crosses.
+
+  Long segments are split so that the number of cells added grows with the
+  length and not the area of the segment's bounding box.
+  """
+  scale = 1 << SHAPE_INDEX_ZOOM
+  stack = [(a, b)]
+  while stack:
+    a, b = stack.pop()
+    min_x = int(min(a[0], b[0]) * scale)
+    max_x = int(max(a[0], b[0]) * scale)
+    min_y = int(min(a[1], b[1]) * scale)
+    max_y = int(max(a[1], b[1]) * scale)
+    if max_x - min_x > 1 or max_y - min_y > 1:
+      middle = ((a[0] + b[0]) / 2, (a[1] + b[1]) / 2)
+      stack.append((a, middle))
+      stack.append((middle, b))
+      continue
+    for cell_x in range(min_x, max_x + 1):
+      for cell_y in range(min_y, max_y + 1):
+        cells.add((_Interleave(cell_x, cell_y), value))
+
+
+def SimplifyPoints(points, tolerance):
+  """Simplify a polyline with the Douglas-Peucker algorithm.
+
+  Args:
+    points: a list of (x, y) tuples
+    tolerance: points closer than this to the simplified line are dropped
+
+  Returns:
+    a list of (x, y) tuples which is a subset of points, including the first
+    and last
+  """
+  if len(points) < 3:
+    return list(points)
+  keep = [False] * len(points)
+  keep[0] = keep[-1] = True
+  tolerance2 = tolerance * tolerance
+  stack = [(0, len(points) - 1)]
+  while stack:
+    first, last = stack.pop()
+    ax, ay = points[first]
+    bx, by = points[last]
+    dx = bx - ax
+    dy = by - ay
+    length2 = float(dx * dx + dy * dy)
+    max_distance2 = tolerance2
+    farthest = None
+    for i in range(first + 1, last):
+      px, py = points[i]
+      if length2 == 0:
+        distance2 = (px - ax) ** 2 + (py - ay) ** 2
+      else:
+        t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length2))
+        distance2 = (px - ax - t * dx) ** 2 + (py - ay - t * dy) ** 2
+      if distance2 > max_distance2:
+        max_distance2 = distance2
+        farthest = i
+    if farthest is not None:
+      keep[farthest] = True
+      stack.append((first, farthest))
+      stack.append((farthest, last))
+  return [p for p, k in zip(points, keep) if k]
+
+
+class TileIndex(object):
+  """Finds the stops and shapes of a schedule in map tiles.
+
+  Shapes are simplified to a tolerance of one pixel at the zoom of the tile,
+  so low zoom tiles of large feeds stay small. The simplified shapes are kept
+  for each zoom used.
+  """
+
+  def __init__(self, schedule):
+    self._schedule = schedule
+    # Sorted parallel lists of Morton codes and stops
+    self._stop_codes = []
+    self._stops = []
+    # Sorted parallel lists of Morton codes and shape_ids, with an entry for
+    # every index cell crossed by a segment of the shape
+    self._shape_codes = []
+    self._shape_ids = []
+    # {shape_id: [(x, y), ...]} the points of shapes in world coordinates
+    self._shape_points = {}
+    # {(shape_id, zoom): [(x, y), ...]} simplified shape points
+    self._simplified = {}
+    # {shape_id: route_color or None}
+    self._shape_colors = {}
+    self._Build()
+
+  def _Build(self):
+    stops = []
+    for stop in self._schedule.GetStopList():
+      if stop.stop_lat is None or stop.stop_lon is None:
+        continue
+      world_x, world_y = LatLngToWorld(stop.stop_lat, stop.stop_lon)
+      stops.append((_CellCode(world_x, world_y, STOP_INDEX_ZOOM),
+                    stop.stop_id, stop))
+    stops.sort()
+    self._stop_codes = [s[0] for s in stops]
+    self._stops = [s[2] for s in stops]
+
+    shape_cells = set()
+    for shape in self._schedule.GetShapeList():
+      points = [LatLngToWorld(lat, lng) for lat, lng, _ in shape.points]
+      if not points:
+        continue
+      self._shape_points[shape.shape_id] = points
+      previous = points[0]
+      for point in points[1:] or points:
+        _AddSegmentCells(shape_cells, previous, point, shape.shape_id)
+        previous = point
+    shape_cells = sorted(shape_cells)
+    self._shape_codes = [c[0] for c in shape_cells]
+    self._shape_ids = [c[1] for c in shape_cells]
+
+    for trip in self._schedule.GetTripList():
+      if trip.shape_id in self._shape_points:
+        color = self._shape_colors.get(trip.shape_id)
+        if color is None:
+          route = self._schedule.routes.get(trip.route_id)
+          if route is not None:
+            self._shape_colors[trip.shape_id] = route.route_color
+
+  def GetTileStops(self, zoom, x, y):
+    """Return the stops in a tile.
+
+    When several stops are within STOP_CELL_PIXELS of each other only the
+    first, in index order, is returned.
+    """
+    first, last = _TileCodeRange(zoom, x, y, STOP_INDEX_ZOOM)
+    start = bisect.bisect_left(self._stop_codes, first)
+    end = bisect.bisect_left(self._stop_codes, last)
+    # Thin to one stop per cell of STOP_CELL_PIXELS at this zoom
+    cell_zoom = zoom + int(math.log(TILE_SIZE // STOP_CELL_PIXELS, 2))
+    shift = 2 * max(0, STOP_INDEX_ZOOM - cell_zoom)
+    north, east, south, west = GetTileBounds(zoom, x, y)
+    stops = []
+    previous_cell = None
+    for i in range(start, end):
+      stop = self._stops[i]
+      if zoom > STOP_INDEX_ZOOM and not (south <= stop.stop_lat < north and
+                                    west <= stop.stop_lon < east):
+        continue
+      cell = self._stop_codes[i] >> shift
+      if shift and cell == previous_cell:
+        continue
+      previous_cell = cell
+      stops.append(stop)
+    return stops
+
+  def GetTileShapes(self, zoom, x, y):
+    """Return the shapes crossing a tile, simplified and clipped to it.
+
+    Returns:
+      a list of (shape_id, color, points) tuples where color is the
+      route_color of a route using the shape or None and points is a list of
+      (lat, lng) tuples. A shape leaving and entering the tile several times
+      has a tuple for each part inside the tile.
+    """
+    first, last = _TileCodeRange(zoom, x, y, SHAPE_INDEX_ZOOM)
+    start = bisect.bisect_left(self._shape_codes, first)
+    end = bisect.bisect_left(self._shape_codes, last)
+    shape_ids = sorted(set(self._shape_ids[start:end]))
+    scale = float(1 << zoom)
+    # Keep segments up to one pixel outside the tile so that lines continue
+    # smoothly into the neighbouring tiles
+    margin = 1.0 / TILE_SIZE
+    min_x = x / scale - margin / scale
+    max_x = (x + 1) / scale + margin / scale
+    min_y = y / scale - margin / scale
+    max_y = (y + 1) / scale + margin / scale
+    result = []
+    for shape_id in shape_ids:
+      points = self._GetSimplifiedPoints(shape_id, zoom)
+      color = self._shape_colors.get(shape_id)
+      for part in _ClipPolyline(points, min_x, min_y, max_x, max_y):
+        result.append((shape_id, color,
+                       [WorldToLatLng(px, py) for px, py in part]))
+    return result
+
+  def _GetSimplifiedPoints(self, shape_id, zoom):
+    key = (shape_id, zoom)
+    points = self._simplified.get(key)
+    if points is None:
+      tolerance = 1.0 / (TILE_SIZE * (1 << zoom))
+      points = SimplifyPoints(self._shape_points[shape_id], tolerance)
+      self._simplified[key] = points
+    return points
+
+
+def _ClipPolyline(points, min_x, min_y, max_x, max_y):
+  """Return the runs of points whose segments touch a rectangle."""
+  if len(points) == 1:
+    px, py = points[0]
+    if min_x <= px <= max_x and min_y <= py <= max_y:
+      return [list(points)]
+    return []
+  parts = []
+  part = None
+  for i in range(1, len(points)):
+    (ax, ay), (bx, by) = points[i - 1], points[i]
+    touches = (min(ax, bx) <= max_x and max(ax, bx) >= min_x and
+               min(ay, by) <= max_y and max(ay, by) >= min_y)
+    if touches:
+      if part is None:
+        part = [points[i - 1]]
+        parts.append(part)
+      part.append(points[i])
+    else:
+      part = None
+  return parts
@@ -87,6 +87,12 @@ class Trip(GtfsObjectBase):
     cursor = schedule._connection.cursor()
     cursor.execute(
         insert_query, stoptime.GetSqlValuesTuple(self.trip_id))
+    self._StopTimesChanged(schedule)
+
+  def _StopTimesChanged(self, schedule):
+    # The pattern may have changed and indexes built from stop times are stale
+    self.__dict__.pop('_pattern_id', None)
+    schedule._TripsChanged()
 
   def ReplaceStopTimeObject(self, stoptime, schedule=None):
     """Replace a StopTime object from this trip with the given one.
@@ -223,6 +229,7 @@ class Trip(GtfsObjectBase):
     """
     cursor = self._schedule._connection.cursor()
     cursor.execute('DELETE FROM stop_times WHERE trip_id=?', (self.trip_id,))
+    self._StopTimesChanged(self._schedule)
 
   def GetStopTimes(self, problems=None):
     """Return a sorted list of StopTime objects for this trip."""
@@ -764,4 +771,4 @@ class Trip(GtfsObjectBase):
 
 
 def SortListOfTripByTime(trips):
-  trips.sort(key=GetStartTime)
+  trips.sort(key=lambda trip: trip.GetStartTime())
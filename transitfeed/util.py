@@ -25,6 +25,7 @@ import random
 import re
 import socket
 import sys
+import threading
 import time
 import urllib2
 
@@ -538,6 +539,80 @@ def ApproximateDistanceBetweenStops(stop1, stop2):
   return ApproximateDistance(stop1.stop_lat, stop1.stop_lon,
                              stop2.stop_lat, stop2.stop_lon)
 
+class LruCache(object):
+  """A cache of at most max_size values which drops the least recently used.
+
+  Get and Set may be called from several threads at the same time.
+  """
+
+  def __init__(self, max_size):
+    self._max_size = max_size
+    self._lock = threading.Lock()
+    # {key: link} where link is [previous link, next link, key, value]
+    self._links = {}
+    # The root of a circular doubly linked list of links. root[1] is the
+    # least and root[0] the most recently used link.
+    self._root = []
+    self._root[:] = [self._root, self._root, None, None]
+
+  def __len__(self):
+    return len(self._links)
+
+  def Get(self, key, default=None):
+    """Return the value of key, or default if it isn't in the cache."""
+    self._lock.acquire()
+    try:
+      link = self._links.get(key)
+      if link is None:
+        return default
+      self._Unlink(link)
+      self._Append(link)
+      return link[3]
+    finally:
+      self._lock.release()
+
+  def Set(self, key, value):
+    """Add value to the cache, dropping the least recently used if full."""
+    if self._max_size <= 0:
+      return
+    self._lock.acquire()
+    try:
+      link = self._links.get(key)
+      if link is not None:
+        self._Unlink(link)
+        link[3] = value
+      else:
+        if len(self._links) >= self._max_size:
+          oldest = self._root[1]
+          self._Unlink(oldest)
+          del self._links[oldest[2]]
+        link = [None, None, key, value]
+        self._links[key] = link
+      self._Append(link)
+    finally:
+      self._lock.release()
+
+  def Clear(self):
+    """Remove all values from the cache."""
+    self._lock.acquire()
+    try:
+      self._links.clear()
+      self._root[:] = [self._root, self._root, None, None]
+    finally:
+      self._lock.release()
+
+  def _Unlink(self, link):
+    link[0][1] = link[1]
+    link[1][0] = link[0]
+
+  def _Append(self, link):
+    last = self._root[0]
+    link[0] = last
+    link[1] = self._root
+    last[1] = link
+    self._root[0] = link
+
+
 class CsvUnicodeWriter:
   """
   Create a wrapper around a csv writer object which can safely write unicode